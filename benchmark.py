@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+#
+""" Time the log loading paths of nmea.fake, and startup
+
+    python benchmark.py [-m megabytes] [-w workers] [logfile]
+    python benchmark.py -s [-n runs]
+"""
+
+import nmea.fake
+import nmea.framer
+import sys, os, time, tempfile, getopt, multiprocessing, subprocess
+
+try:
+    import nmea.packet as packet
+except ImportError:
+    packet = None
+
+def synthetic_log(path, megabytes):
+    "Write a log of fake.log repeated to about the given size."
+    sample = open("fake.log").read()
+    fp = open(path, "w")
+    for n in range(int(megabytes * (1 << 20) / len(sample)) + 1):
+        fp.write(sample)
+    fp.close()
+
+def timed(label, size, function, *args):
+    start = time.time()
+    result = function(*args)
+    elapsed = time.time() - start
+    print "%-24s %8.3f s %8.1f MB/s" % (label, elapsed, size / elapsed / (1 << 20))
+    return result
+
+def framing(path):
+    "Frame a log with the packet module and with the bulk framer."
+    size = os.path.getsize(path)
+    # NumPy is imported on first use; keep that out of the timings
+    nmea.framer.frame("#\n")
+    if packet:
+        sniffed = timed("packet module", size, lambda: list(nmea.fake._sniff(open(path))))
+    framed = timed("bulk framer", size, lambda: list(nmea.framer.read_packets(open(path))))
+    if packet:
+        if sniffed == framed:
+            print "%d packets, identical" % len(framed)
+        else:
+            print "MISMATCH: %d packets from the packet module, %d from the framer" % (len(sniffed), len(framed))
+
+def loading(path, workers):
+    "Load a log into a TestLoad serially and with process pools."
+    size = os.path.getsize(path)
+    if packet:
+        timed("TestLoad", size, nmea.fake.TestLoad, path)
+    serial = timed("TestLoad bulk", size, nmea.fake.TestLoad, path, False, True)
+    (saved, nmea.fake.PARALLEL_LOAD) = (nmea.fake.PARALLEL_LOAD, 0)
+    try:
+        for n in sorted(set([2, max(workers, 2)])):
+            load = timed("TestLoad %d workers" % n, size, nmea.fake.TestLoad, path, False, False, n)
+            if load.sentences != serial.sentences:
+                print "MISMATCH with %d workers" % n
+    finally:
+        nmea.fake.PARALLEL_LOAD = saved
+
+STARTUP = (
+    ("python", ["-c", "pass"]),
+    ("import nmea", ["-c", "import nmea"]),
+    ("import nmea.fake", ["-c", "import nmea.fake"]),
+    ("nmeafake -h", ["nmeafake", "-h"]),
+)
+
+def startup(runs):
+    "Time fresh interpreters importing the package and starting nmeafake."
+    devnull = open(os.devnull, "w")
+    for (label, args) in STARTUP:
+        times = []
+        for n in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable] + args, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+        times.sort()
+        print "%-24s %8.1f ms best %8.1f ms median" % (label, times[0] * 1000, times[len(times) // 2] * 1000)
+    devnull.close()
+
+if __name__ == "__main__":
+    (options, arguments) = getopt.getopt(sys.argv[1:], "m:n:sw:")
+    megabytes = 20
+    workers = multiprocessing.cpu_count()
+    runs = 20
+    for (switch, val) in options:
+        if switch == '-m':
+            megabytes = float(val)
+        elif switch == '-n':
+            runs = int(val)
+        elif switch == '-s':
+            startup(runs)
+            sys.exit(0)
+        elif switch == '-w':
+            workers = int(val)
+    if arguments:
+        path = arguments[0]
+        temporary = False
+    else:
+        (fd, path) = tempfile.mkstemp(suffix=".log")
+        os.close(fd)
+        synthetic_log(path, megabytes)
+        temporary = True
+    try:
+        framing(path)
+        loading(path, workers)
+    finally:
+        if temporary:
+            os.remove(path)
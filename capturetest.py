@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.capture recorder """
+
+import nmea.capture
+import unittest
+import os, shutil, tempfile
+
+def report(device, n):
+    return '{"class":"TPV","device":"%s","time":%d,"lat":57.7,"lon":11.6}\r\n' % (device, n)
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "capture")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, writer, start, stop):
+        for n in range(start, stop):
+            writer.write(1000.0 + n, report("/dev/pts/%d" % (n % 3), n))
+
+    def testDevice(self):
+        self.assertEquals("/dev/pts/4", nmea.capture.report_device(report("/dev/pts/4", 1)))
+        self.assertEquals("", nmea.capture.report_device('{"class":"VERSION"}\r\n'))
+
+    def testRoundTrip(self):
+        writer = nmea.capture.CaptureWriter(self.path, blocksize=1000)
+        self.fill(writer, 0, 300)
+        writer.close()
+        self.assertTrue(len(writer.blocks) > 10)
+        reader = nmea.capture.CaptureReader(self.path)
+        records = list(reader.records())
+        self.assertEquals(300, len(records))
+        self.assertEquals((1007.0, "/dev/pts/1", report("/dev/pts/1", 7)), records[7])
+        self.assertEquals((1000.0, 1299.0), reader.span())
+        reader.close()
+
+    def testSeek(self):
+        writer = nmea.capture.CaptureWriter(self.path, blocksize=1000)
+        self.fill(writer, 0, 300)
+        writer.close()
+        reader = nmea.capture.CaptureReader(self.path)
+        when = [r[0] for r in reader.records(start=1100, end=1120)]
+        self.assertEquals([1000.0 + n for n in range(100, 121)], when)
+        pts2 = list(reader.records(start=1100, end=1120, device="/dev/pts/2"))
+        self.assertEquals([1101.0, 1104.0, 1107.0, 1110.0, 1113.0, 1116.0, 1119.0],
+                          [r[0] for r in pts2])
+        self.assertEquals([], list(reader.records(device="/dev/pts/9")))
+        reader.close()
+
+    def testAppend(self):
+        writer = nmea.capture.CaptureWriter(self.path, blocksize=1000)
+        self.fill(writer, 0, 100)
+        writer.close()
+        writer = nmea.capture.CaptureWriter(self.path, blocksize=1000)
+        writer.write(1100.0, report("/dev/pts/7", 100))
+        self.fill(writer, 101, 200)
+        writer.close()
+        reader = nmea.capture.CaptureReader(self.path)
+        records = list(reader.records())
+        self.assertEquals(200, len(records))
+        self.assertEquals("/dev/pts/7", records[100][1])
+        self.assertEquals("/dev/pts/2", records[101][1])
+        reader.close()
+
+    def testUnclosed(self):
+        writer = nmea.capture.CaptureWriter(self.path, blocksize=1000)
+        self.fill(writer, 0, 100)
+        writer.flush()
+        writer.fp.close()           # As if the writer had crashed
+        reader = nmea.capture.CaptureReader(self.path)
+        self.assertEquals(100, len(list(reader.records())))
+        self.assertEquals(["/dev/pts/0", "/dev/pts/1", "/dev/pts/2"], reader.names)
+        reader.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+#
+""" Test nmea.checkpoint and the state of the fake GPSes """
+
+import nmea.fake
+import nmea.checkpoint
+import unittest, tempfile, os
+
+class TestDeviceState(unittest.TestCase):
+    def testSimulator(self):
+        plan = nmea.fake.builtin_plan()
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=plan)
+        for n in range(1234):
+            sim.step()
+        state = sim.state()
+        expected = [sim.step() for n in range(300)]
+        resumed = nmea.fake.GPSSimulator(currtime=0, shipplan=plan)
+        resumed.restore(state)
+        self.assertEquals(expected, [resumed.step() for n in range(300)])
+
+    def testLog(self):
+        load = nmea.fake.TestLoad("fake.log")
+        log = nmea.fake.FakeLogGPS(load)
+        for n in range(17):
+            log.step()
+        resumed = nmea.fake.FakeLogGPS(load)
+        resumed.restore(log.state())
+        self.assertEquals(log.step(), resumed.step())
+
+class TestCheckpointer(unittest.TestCase):
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix=".checkpoint")
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def session(self):
+        session = nmea.fake.TestSession()
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=nmea.fake.builtin_plan())
+        device = nmea.fake.FakePTY(sim)
+        device.key = "0:builtin"
+        session.append(device)
+        return (session, device)
+
+    def testSaveAndRestore(self):
+        checkpointer = nmea.checkpoint.Checkpointer(self.path)
+        self.assertEquals(None, checkpointer.load())
+        (session, device) = self.session()
+        for n in range(100):
+            device.feed(False)
+        checkpointer.save(session)
+        expected = device._gpsSimulator.step()
+        (again, resumed) = self.session()
+        self.assertEquals(1, again.restore(checkpointer.load()))
+        self.assertEquals(expected, resumed._gpsSimulator.step())
+
+    def testTick(self):
+        checkpointer = nmea.checkpoint.Checkpointer(self.path, interval=10.0)
+        (session, device) = self.session()
+        start = checkpointer.next_save
+        checkpointer.tick(session, start - 1)
+        self.assertEquals(0, checkpointer.saves)
+        checkpointer.tick(session, start)
+        checkpointer.tick(session, start + 5)
+        self.assertEquals(1, checkpointer.saves)
+        self.assertTrue(os.path.exists(self.path))
+
+    def testBadFile(self):
+        open(self.path, "w").write("not json")
+        self.assertRaises(nmea.checkpoint.CheckpointError,
+                          nmea.checkpoint.Checkpointer(self.path).load)
+
+if __name__ == "__main__":
+    unittest.main()
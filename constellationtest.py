@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.constellation satellite geometry """
+
+import nmea.constellation
+import nmea.scenario
+import nmea.fake
+import unittest, math, operator
+
+WHEN = 1330759883
+
+def checksummed(line):
+    (body, cksum) = line[1:].rstrip("\r\n").split("*")
+    return reduce(operator.xor, (ord(c) for c in body), 0) == int(cksum, 16)
+
+class TestConstellation(unittest.TestCase):
+    def setUp(self):
+        self.sky = nmea.constellation.Constellation()
+
+    def testOrbits(self):
+        sats = self.sky.satellites(WHEN)
+        self.assertEquals((24, 3), sats.shape)
+        for (x, y, z) in sats:
+            self.assertAlmostEqual(nmea.constellation.ORBIT_RADIUS, math.sqrt(x*x + y*y + z*z), 6)
+            self.assertTrue(abs(math.degrees(math.asin(z / nmea.constellation.ORBIT_RADIUS))) <= 55.0 + 1e-9)
+
+    def testOverhead(self):
+        # Straight under a satellite it is at the zenith
+        (x, y, z) = self.sky.satellites(WHEN)[5]
+        lat = math.degrees(math.asin(z / nmea.constellation.ORBIT_RADIUS))
+        lon = math.degrees(math.atan2(y, x))
+        (azimuth, elevation, snr, used, dops) = self.sky.views(WHEN, [lat, 0.0], [lon, 0.0])
+        self.assertEquals((2, 24), elevation.shape)
+        self.assertAlmostEqual(90.0, elevation[0][5], 6)
+        self.assertEquals(50, snr[0][5])
+        self.assertTrue(used[0][5])
+
+    def testDops(self):
+        (azimuth, elevation, snr, used, dops) = self.sky.views(WHEN, [57.7, -33.9, 0.0], [11.7, 18.4, 0.0])
+        for n in range(3):
+            self.assertTrue(used[n].sum() >= 4)
+            (pdop, hdop, vdop) = dops[n]
+            self.assertTrue(0 < hdop < pdop < 10)
+            self.assertAlmostEqual(pdop * pdop, hdop * hdop + vdop * vdop, 9)
+
+    def testSentences(self):
+        sky = self.sky.sky(WHEN, 57.70723, 11.695213333333333)
+        gsa = sky["GSA"].splitlines()
+        gsv = sky["GSV"].splitlines()
+        self.assertEquals(1, len(gsa))
+        self.assertTrue(gsa[0].startswith("$GPGSA,A,3,"))
+        self.assertEquals(18, len(gsa[0].split(",")))
+        visible = int(gsv[0].split(",")[3])
+        self.assertEquals((visible + 3) // 4, len(gsv))
+        for (n, line) in enumerate(gsv):
+            fields = line.split("*")[0].split(",")
+            self.assertEquals(str(len(gsv)), fields[1])
+            self.assertEquals(str(n + 1), fields[2])
+        for line in gsa + gsv:
+            self.assertTrue(checksummed(line))
+
+    def testSharedCells(self):
+        self.sky.sky(WHEN, 57.70723, 11.69521)
+        self.sky.sky(WHEN, 57.70823, 11.69621)
+        self.assertEquals(1, self.sky.computed)
+        self.assertEquals(1, self.sky.hits)
+        self.sky.sky(WHEN + 1, 57.70723, 11.69521)
+        self.assertEquals(2, self.sky.computed)
+
+    def testEpochsEvicted(self):
+        for n in range(10):
+            self.sky.sky(WHEN + n, 57.7, 11.7)
+        self.assertEquals(self.sky.keep, len(self.sky.epochs))
+        self.assertEquals(range(WHEN + 10 - self.sky.keep, WHEN + 10), sorted(self.sky.epochs))
+
+    def testFleetComputedTogether(self):
+        sims = [nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.0 + n, longitude=11.0,
+                                       sky=self.sky, sentences=("RMC", "GSV"))
+                for n in range(5)]
+        sims[0].step()
+        self.assertEquals(5, self.sky.computed)
+        for sim in sims[1:]:
+            sim.step()
+        self.assertEquals(5, self.sky.computed)
+        self.assertEquals(4, self.sky.hits)
+
+class TestSimulatorSky(unittest.TestCase):
+    def testProfile(self):
+        sky = nmea.constellation.Constellation()
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.70723, longitude=11.695213333333333,
+                                     sky=sky, sentences=("RMC", "GSA", "GSV"))
+        ref = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.70723, longitude=11.695213333333333)
+        lines = sim.step().splitlines(True)
+        self.assertEquals(ref.step(), lines[0])
+        self.assertTrue(lines[1].startswith("$GPGSA,"))
+        self.assertTrue(lines[2].startswith("$GPGSV,"))
+
+    def testWithoutRMC(self):
+        sky = nmea.constellation.Constellation()
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, sky=sky, sentences=("GSV",))
+        for line in sim.step().splitlines():
+            self.assertTrue(line.startswith("$GPGSV,"))
+
+    def testDetach(self):
+        sky = nmea.constellation.Constellation()
+        sims = [nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.0 + n, longitude=11.0,
+                                       sky=sky, sentences=("RMC", "GSV"))
+                for n in range(3)]
+        sims[2].close()
+        self.assertEquals(sims[:2], sky.vessels)
+        sims[0].step()
+        self.assertEquals(2, sky.computed)
+        sims[2].close()
+
+    def testScenario(self):
+        scenario = nmea.scenario.compile_scenario('''{"vessels": [
+            {"name": "a", "start": [57.7, 11.7], "legs": [[10, 0, 5.0]], "sentences": ["RMC", "GSV"], "count": 2},
+            {"name": "b", "start": [57.7, 11.7], "legs": [[10, 0, 5.0]]}]}''')
+        sims = dict(scenario.simulators())
+        self.assertTrue("$GPGSV," in sims["a-0"].step())
+        self.assertTrue(sims["a-0"]._sky is sims["a-1"]._sky)
+        self.assertEquals(1, len(sims["b"].step().splitlines()))
+
+    def testUnsupported(self):
+        self.assertRaises(nmea.scenario.ScenarioError, nmea.scenario.compile_scenario,
+                          '{"vessels": [{"start": [0, 0], "legs": [[10, 0, 1]], "sentences": ["VTG"]}]}')
+
+if __name__ == "__main__":
+    unittest.main()
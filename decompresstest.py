@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+#
+""" Test loading compressed logs """
+
+import nmea.fake
+import nmea.decompress
+import unittest
+import os, shutil, tempfile, subprocess, gzip, bz2
+
+class TestCompressedLoad(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.plain = nmea.fake.TestLoad("fake.log").sentences
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compressed(self, name, opener):
+        path = os.path.join(self.directory, name)
+        fp = opener(path)
+        fp.write(open("fake.log").read())
+        fp.close()
+        return path
+
+    def testFormats(self):
+        self.assertEquals(None, nmea.decompress.compression("fake.log"))
+        path = self.compressed("fake.log.gz", lambda p: gzip.open(p, "wb"))
+        self.assertEquals("gzip", nmea.decompress.compression(path))
+        path = self.compressed("fake.bz2", lambda p: bz2.BZ2File(p, "wb"))
+        self.assertEquals("bzip2", nmea.decompress.compression(path))
+
+    def testGzip(self):
+        path = self.compressed("fake.log.gz", lambda p: gzip.open(p, "wb"))
+        load = nmea.fake.TestLoad(path)
+        self.assertEquals(self.plain, load.sentences)
+        self.assertEquals(path, load.name)
+
+    def testBzip2(self):
+        path = self.compressed("fake.log.bz2", lambda p: bz2.BZ2File(p, "wb"))
+        self.assertEquals(self.plain, nmea.fake.TestLoad(path).sentences)
+
+    def testForkedModule(self):
+        path = self.compressed("fake.log.gz", lambda p: gzip.open(p, "wb"))
+        saved = nmea.decompress.COMMANDS
+        nmea.decompress.COMMANDS = {}
+        try:
+            stream = nmea.decompress.open_log(path)
+            self.assertEquals(None, stream.process)
+            self.assertEquals(self.plain, nmea.fake.TestLoad(path).sentences)
+            stream.close()
+        finally:
+            nmea.decompress.COMMANDS = saved
+
+    def testCorrupt(self):
+        path = os.path.join(self.directory, "bad.gz")
+        fp = open(path, "wb")
+        fp.write("\x1f\x8b" + "not gzip at all" * 10)
+        fp.close()
+        self.assertRaises(nmea.fake.TestLoadError, nmea.fake.TestLoad, path)
+
+    def testForkedCorrupt(self):
+        # A valid header in front of a broken deflate stream
+        path = os.path.join(self.directory, "bad.gz")
+        fp = open(path, "wb")
+        fp.write("\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03" + "\xff" * 200)
+        fp.close()
+        saved = nmea.decompress.COMMANDS
+        nmea.decompress.COMMANDS = {}
+        log = tempfile.TemporaryFile()
+        stderr = os.dup(2)
+        os.dup2(log.fileno(), 2)
+        try:
+            self.assertRaises(nmea.fake.TestLoadError, nmea.fake.TestLoad, path)
+        finally:
+            os.dup2(stderr, 2)
+            os.close(stderr)
+            nmea.decompress.COMMANDS = saved
+        log.seek(0)
+        self.assertTrue(log.read().startswith("decompress: %s: " % path))
+
+    def testNoZombie(self):
+        path = os.path.join(self.directory, "serial.log.gz")
+        fp = gzip.open(path, "wb")
+        fp.write("# Serial: 4800 9X1\n" + open("fake.log").read() * 50)
+        fp.close()
+        self.assertRaises(nmea.fake.TestLoadError, nmea.fake.TestLoad, path)
+        # The decompressor has been reaped, so there are no children left
+        self.assertRaises(OSError, os.waitpid, -1, os.WNOHANG)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.framer bulk framer against the packet module """
+
+import nmea.fake
+import nmea.framer
+import unittest
+import os, tempfile, random, StringIO
+
+try:
+    import nmea.packet as packet
+except ImportError:
+    packet = None
+
+def nmea_sentence(body, end="\r\n"):
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+    return "$%s*%02X%s" % (body, checksum, end)
+
+# Text the two framers must agree on, packet for packet
+cases = [
+    open("fake.log").read(),
+    "# comment line\n" + nmea_sentence("GPGGA,092750.000,5321.6802,N,00630.3372,W,1,8,1.03,61.7,M,55.2,M,,"),
+    "$GPGSA,A,3,10,07,05,02,29,04,08,13,,,,,1.72,1.03,1.38*0B\r\n",
+    "!AIVDM,1,1,,A,13u?etPv2;0n:dDPwUM1U1Cb069D,0*24\r\n!AIVDO,1,1,,A,13u?etPv2;0n:dDPwUM1U1Cb069D,0*26\r\n",
+    "$GPTXT,hi\r\n#x\r\n#y\n", "garbage\n$GP\r\n", "$GPTXT,hi*4a\r\n$GPTXT,hi*6B\r\n$GPTXT,hi*62 \r\n",
+    "$GPTXT,h*i*62\r\n$GPTXT,hi*\r\n$GPTXT,hi*5\r\n", "$$GPTXT,hi\r\n$!AIVDM,1\r\n$#a\n",
+    "$GPTXT,a\rb\r\n$GPTXT,hi\r\r\n$ABCDE\r\n$PXXX,1\r\n$CA,1\r\n", "#a$b\n##\n#\n",
+    "$GPTXT,hi\n\n$GPTXT,hi", "$GPGGA," + "1" * 1000 + "\r\n", "garbage\n", "x",
+]
+
+def sniffed(data):
+    "Packets of data as the packet module frames them."
+    fp = tempfile.TemporaryFile()
+    fp.write(data)
+    fp.flush()
+    fp.seek(0)
+    getter = packet.new()
+    result = []
+    while True:
+        (length, ptype, text) = getter.get(fp.fileno())
+        if length <= 0:
+            break
+        result.append((ptype, text))
+    fp.close()
+    return result
+
+class TestFramer(unittest.TestCase):
+    def testTypes(self):
+        self.assertEquals([(nmea.framer.COMMENT_PACKET, "# hi\n"),
+                           (nmea.framer.NMEA_PACKET, "$GPTXT,hi*62\r\n"),
+                           (nmea.framer.BAD_PACKET, "$GPTXT,hi*63\r\n"),
+                           (nmea.framer.AIVDM_PACKET, "!AIVDM,1\r\n")],
+                          list(nmea.framer.packets("# hi\n$GPTXT,hi*62\r\n$GPTXT,hi*63\r\n!AIVDM,1\r\n")))
+
+    def testBlocks(self):
+        data = "".join(cases[:-2]) * 20
+        whole = list(nmea.framer.packets(data))
+        for blocksize in (7, 100, 1031, 4096):
+            self.assertEquals(whole, list(nmea.framer.read_packets(StringIO.StringIO(data), blocksize)))
+
+    def testWithoutNumPy(self):
+        text = "".join(cases)
+        expected = list(nmea.framer.packets(text))
+        saved = nmea.framer.numpy
+        nmea.framer.numpy = None
+        try:
+            self.assertEquals(expected, list(nmea.framer.packets(text)))
+        finally:
+            nmea.framer.numpy = saved
+
+    def testParallel(self):
+        (fd, path) = tempfile.mkstemp()
+        os.write(fd, "".join(cases[:-2]) * 50)
+        os.close(fd)
+        try:
+            for (start, stop) in nmea.framer.chunks(path, 7):
+                self.assertTrue(start == 0 or open(path).read()[start - 1] == "\n")
+            serial = list(nmea.framer.read_packets(open(path)))
+            self.assertEquals(serial, list(nmea.framer.parallel_packets(path, 3, 1000)))
+            (saved, nmea.fake.PARALLEL_LOAD) = (nmea.fake.PARALLEL_LOAD, 0)
+            try:
+                self.assertEquals(nmea.fake.TestLoad(path, bulk=True).sentences,
+                                  nmea.fake.TestLoad(path, workers=2).sentences)
+            finally:
+                nmea.fake.PARALLEL_LOAD = saved
+        finally:
+            os.remove(path)
+
+    def testTextual(self):
+        (fd, path) = tempfile.mkstemp()
+        os.write(fd, "".join(cases))
+        os.close(fd)
+        try:
+            self.assertTrue(nmea.framer.textual(path))
+            fp = open(path, "ab")
+            fp.write("\xa0\xa2\x00\x02")
+            fp.close()
+            self.assertFalse(nmea.framer.textual(path))
+            # Only the start of the file is looked at
+            self.assertTrue(nmea.framer.textual(path, 100))
+        finally:
+            os.remove(path)
+
+    if packet:
+        def testBinaryNotParallel(self):
+            (fd, path) = tempfile.mkstemp()
+            os.write(fd, "\xa0\xa2\x00\x02\x84\x00\x84\x00\xb0\xb3" + "".join(cases[:3]) * 50)
+            os.close(fd)
+            (saved, nmea.fake.PARALLEL_LOAD) = (nmea.fake.PARALLEL_LOAD, 0)
+            try:
+                self.assertEquals(nmea.fake.TestLoad(path).sentences,
+                                  nmea.fake.TestLoad(path, workers=2).sentences)
+            finally:
+                nmea.fake.PARALLEL_LOAD = saved
+                os.remove(path)
+
+        def testTestLoad(self):
+            self.assertEquals(nmea.fake.TestLoad("fake.log").sentences,
+                              nmea.fake.TestLoad("fake.log", bulk=True).sentences)
+
+        def testMatchesPacketModule(self):
+            for data in cases:
+                self.assertEquals(sniffed(data), list(nmea.framer.packets(data)))
+
+        def testRandomLog(self):
+            rand = random.Random(1)
+            pieces = []
+            for n in range(2000):
+                body = "GPGGA,%06d.000,5321.%04d,N,00630.3372,W,1,8,1.03,61.7,M,55.2,M,," % (n, rand.randint(0, 9999))
+                choice = rand.random()
+                if choice < 0.1:
+                    pieces.append("# %d\n" % n)
+                elif choice < 0.15:
+                    pieces.append(nmea_sentence(body)[:-4] + "00\r\n")
+                elif choice < 0.2:
+                    pieces.append(nmea_sentence(body, "\n"))
+                else:
+                    pieces.append(nmea_sentence(body))
+            data = "".join(pieces)
+            self.assertEquals(sniffed(data), list(nmea.framer.packets(data)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.gps client helpers """
+
+import nmea
+import socket
+import unittest
+
+def makefix(when, lat, lon, speed=1.0):
+    fix = nmea.gpsfix()
+    fix.time = when
+    fix.latitude = lat
+    fix.longitude = lon
+    fix.speed = speed
+    fix.mode = nmea.MODE_2D
+    return fix
+
+class TestFixHistory(unittest.TestCase):
+    def testEmpty(self):
+        dut = nmea.fixhistory(4)
+        self.assertEquals(0, len(dut))
+        self.assertEquals(0, len(dut.window()["time"]))
+        self.assertEquals(0, len(dut.last(60)["time"]))
+
+    def testWrapAround(self):
+        dut = nmea.fixhistory(3)
+        for i in range(5):
+            dut.push(makefix(100.0 + i, 57.0 + i, 11.0))
+        self.assertEquals(3, len(dut))
+        self.assertEquals([102.0, 103.0, 104.0], list(dut.column("time")))
+        self.assertEquals([59.0, 60.0, 61.0], list(dut.column("latitude")))
+
+    def testWindow(self):
+        dut = nmea.fixhistory(10)
+        for i in range(10):
+            dut.push(makefix(100.0 + i, 57.0, 11.0, speed=float(i)))
+        cols = dut.window(start=102, end=105)
+        self.assertEquals([102.0, 103.0, 104.0], list(cols["time"]))
+        self.assertEquals([2.0, 3.0, 4.0], list(cols["speed"]))
+        self.assertEquals([107.0, 108.0, 109.0], list(dut.last(2)["time"]))
+
+    def testIsoTime(self):
+        dut = nmea.fixhistory(2)
+        dut.push(makefix("2012-03-03T07:31:23.5Z", 57.0, 11.0))
+        self.assertEquals([1330759883.5], list(dut.column("time")))
+
+class TestMux(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(2)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def testTaggedReportsAndReconnect(self):
+        mux = nmea.gpsmux(retry=0)
+        mux.add("alpha", port=self.port)
+        (conn, addr) = self.server.accept()
+        conn.sendall('{"class":"TPV","device":"/dev/pts/1","lat":57.5}\r\n'
+                     '$GPRMC,073123.000,A,5742.434,N,1141.713,E,1.00,0.00,280511,,,S*41\r\n')
+        reports = []
+        while len(reports) < 2:
+            reports += mux.poll(1.0)
+        self.assertEquals("alpha", reports[0][0])
+        self.assertEquals(57.5, reports[0][1]["lat"])
+        self.assertTrue(reports[1][1].startswith("$GPRMC"))
+        conn.close()
+        self.assertEquals([], mux.poll(1.0))
+        self.assertEquals({}, mux.sessions)
+        mux.poll(0)
+        self.assertTrue("alpha" in mux.sessions)
+        mux.close()
+
+    def testHangupMidLine(self):
+        mux = nmea.gpsmux(retry=60)
+        mux.add("alpha", port=self.port)
+        (conn, addr) = self.server.accept()
+        conn.sendall('$GPRMC,073123.000,A,5742.434,N,1141.7')
+        while not mux.sessions["alpha"].linebuffer:
+            mux.poll(1.0)
+        # Read the watch request so the close is a clean FIN, not a reset
+        conn.recv(4096)
+        conn.close()
+        self.assertEquals([], mux.poll(1.0))
+        self.assertEquals({}, mux.sessions)
+        self.assertTrue("alpha" in mux.retries)
+        mux.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,9 @@
 """ Test the nmea.GPSSimulator """
 
 import nmea.fake
+import nmea.scenario
 import unittest
+import os, shutil, tempfile
 
 rmcdoc = """
 === RMC - Recommended Minimum Navigation Information ===
@@ -89,5 +91,140 @@ class TestShipPLans(unittest.TestCase):
         dut = nmea.fake.GPSSimulator(currtime=1330759883, latitude=57.70723, longitude=11.695213333333333, shipplan=plan)
 
 
+def roundtrip():
+    plan = nmea.fake.ShipPlan(latitude=58.1388066666, longitude=11.83308166666)
+    plan.addLeg(length=5, course=180, speed=5.0)
+    plan.addLeg(length=7, course=134, speed=8.0)
+    plan.addLeg(length=2, course=10, speed=0.0)
+    return plan
+
+class TestSentenceCache(unittest.TestCase):
+    def testCyclic(self):
+        self.assertTrue(roundtrip().isCyclic())
+        plan = nmea.fake.ShipPlan()
+        plan.addLeg(length=-1, course=0, speed=10.0)
+        self.assertFalse(plan.isCyclic())
+
+    def testReplayMatchesSimulation(self):
+        plain = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=roundtrip())
+        cached = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=roundtrip(),
+                                        cache=nmea.fake.SentenceCache())
+        for i in range(4 * 14):
+            self.assertEquals(plain.step(), cached.step())
+        self.assertEquals(plain._latitude, cached._latitude)
+
+    def testReplayFromFloatTime(self):
+        plain = nmea.fake.GPSSimulator(currtime=1330759883.0, shipplan=roundtrip())
+        cached = nmea.fake.GPSSimulator(currtime=1330759883.0, shipplan=roundtrip(),
+                                        cache=nmea.fake.SentenceCache())
+        for i in range(3 * 14):
+            self.assertEquals(plain.step(), cached.step())
+
+    def testReplayedGGA(self):
+        plan = nmea.fake.builtin_plan()
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=plan,
+                                     cache=nmea.fake.SentenceCache(), sentences=("RMC", "GGA"))
+        for i in range(plan._totalLength + 100):
+            (rmc, gga) = sim.step().splitlines()
+            self.assertEquals(rmc.split(",")[3:7], gga.split(",")[2:6])
+        self.assertTrue(sim._lap)
+
+    def testOnDisk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            first = nmea.fake.SentenceCache(directory).lap(roundtrip())
+            second = nmea.fake.SentenceCache(directory).lap(roundtrip())
+            self.assertEquals(first.fields, second.fields)
+            self.assertEquals(list(first.checksums), list(second.checksums))
+            self.assertEquals(list(first.latitude), list(second.latitude))
+        finally:
+            shutil.rmtree(directory)
+
+class TestLegIndex(unittest.TestCase):
+    def linear(self, plan, when):
+        # The leg search ShipPlan.courseAtTime() did before it was indexed
+        when = when % plan._totalLength
+        totalLength = 0
+        for (length, course, speed) in plan._legs:
+            if length < 0:
+                return (course,speed)
+            totalLength += length
+            if(when < totalLength):
+                return (course,speed)
+        return (course,speed)
+
+    def testMatchesLinearSearch(self):
+        plans = [roundtrip(), nmea.fake.builtin_plan()]
+        plan = nmea.fake.ShipPlan()
+        plan.addLeg(length=10, course=0, speed=1.0)
+        plan.addLeg(length=0, course=90, speed=2.0)
+        plan.addLeg(length=10, course=180, speed=3.0)
+        plan.addLeg(length=-1, course=270, speed=4.0)
+        plan.addLeg(length=10, course=45, speed=5.0)
+        plans.append(plan)
+        for plan in plans:
+            for when in range(-5, 2 * abs(plan._totalLength) + 5):
+                self.assertEquals(self.linear(plan, when), plan.courseAtTime(when))
+
+    def testSeek(self):
+        plan = nmea.fake.builtin_plan()
+        total = plan._totalLength
+        plain = nmea.fake.GPSSimulator(currtime=1330759883, shipplan=plan)
+        for i in range(total):
+            plain.step()
+        for (lap, offset) in enumerate((0, 1, 49, 50, 51, 200, total - 1)):
+            when = 1330759883 + (lap + 1) * total + offset
+            seeker = nmea.fake.GPSSimulator(currtime=when, shipplan=plan)
+            seeker.seek(offset)
+            while plain._time < seeker._time:
+                plain.step()
+            self.assertEquals(plain.step(), seeker.step())
+            self.assertEquals(plain.step(), seeker.step())
+
+class TestScenario(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        fp = open(self.path, "w")
+        fp.write(text)
+        fp.close()
+
+    def testBuiltinRoute(self):
+        scenario = nmea.scenario.load("roundtrip.json", os.path.join(self.directory, "c"))
+        self.assertEquals(nmea.fake.builtin_plan().signature(), scenario.plans[0].signature())
+
+    def testFleet(self):
+        self.write('{"routes": {"r": {"start": [57.7, 11.7], "legs": [[60, 0, 10], [60, 180, 10]]}},'
+                   ' "vessels": [{"name": "ferry", "route": "r", "count": 3, "stagger": 30, "rate": 2},'
+                   ' {"name": "solo", "start": [57.0, 11.0], "legs": [[10, 90, 5]]}]}')
+        scenario = nmea.scenario.load(self.path)
+        self.assertEquals(["ferry-0", "ferry-1", "ferry-2", "solo"],
+                          [v[0] for v in scenario.vessels])
+        self.assertEquals([0, 30, 60, 0], [v[3] for v in scenario.vessels])
+        sims = dict(scenario.simulators())
+        self.assertEquals(0.5, sims["ferry-1"].period)
+        self.assertEquals((57.0, 11.0), (sims["solo"]._latitude, sims["solo"]._longitude))
+
+    def testCacheInvalidation(self):
+        self.write('{"vessels": [{"start": [57.0, 11.0], "legs": [[10, 90, 5]]}]}')
+        first = nmea.scenario.load(self.path)
+        self.assertTrue(os.path.exists(self.path + ".cache"))
+        self.assertEquals(first.vessels, nmea.scenario.load(self.path).vessels)
+        self.write('{"vessels": [{"start": [57.0, 11.0], "legs": [[10, 90, 5]], "count": 2}]}')
+        self.assertEquals(2, len(nmea.scenario.load(self.path).vessels))
+
+    def testErrors(self):
+        for text in ('{"vessels": []}', '{"vessels": [{"route": "nowhere"}]}',
+                     '{"vessels": [{"start": [57, 11], "legs": [[-1, 0, 1]]}]}',
+                     '{"vessels": [{"start": [57, 11], "legs": [[1, 0, 1]], "sentences": ["XYZ"]}]}',
+                     'not json'):
+            self.assertRaises(nmea.scenario.ScenarioError,
+                              nmea.scenario.compile_scenario, text)
+
 if __name__ == "__main__":
     unittest.main()
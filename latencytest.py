@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.latency harness """
+
+import nmea.latency
+import nmea.fake
+import unittest, time
+
+rmc = "$GPRMC,073124.000,A,5742.434,N,1141.713,E,1.00,0.00,280511,,,S*46\r\n"
+gga = "$GPGGA,073124.000,5742.434,N,01141.713,E,1,08,1.0,10.0,M,,,,*00\r\n"
+
+class TestLatencyHarness(unittest.TestCase):
+    def testMatch(self):
+        harness = nmea.latency.LatencyHarness()
+        harness.level = 2
+        harness.emitted("/dev/pts/1", rmc, 100.0)
+        harness.emitted("/dev/pts/2", gga, 100.5)
+        harness.received('{"class":"TPV"}\r\n', 100.6)
+        harness.received(gga, 100.75)
+        harness.received(rmc, 101.0)
+        report = harness.report()
+        self.assertEquals(1.0, report[2]["/dev/pts/1"]["p50"])
+        self.assertEquals(0.25, report[2]["/dev/pts/2"]["p50"])
+        self.assertEquals(2, report[2]["all"]["count"])
+        self.assertEquals(0, harness.unmatched)
+
+    def testRepeatedSentence(self):
+        harness = nmea.latency.LatencyHarness()
+        harness.emitted("/dev/pts/1", rmc, 100.0)
+        harness.emitted("/dev/pts/2", rmc, 100.5)
+        harness.received(rmc, 101.0)
+        harness.received(rmc, 101.0)
+        harness.received(rmc, 101.0)
+        report = harness.report()[0]
+        self.assertEquals(1.0, report["/dev/pts/1"]["max"])
+        self.assertEquals(0.5, report["/dev/pts/2"]["max"])
+        self.assertEquals(1, harness.unmatched)
+
+    def testExpiry(self):
+        harness = nmea.latency.LatencyHarness(timeout=5.0)
+        harness.emitted("/dev/pts/1", rmc, 100.0)
+        harness.emitted("/dev/pts/1", gga, 110.0)
+        harness.received(rmc, 110.5)
+        self.assertEquals(1, harness.lost)
+        self.assertEquals(1, harness.unmatched)
+        self.assertEquals({}, harness.report())
+
+    def testPercentiles(self):
+        harness = nmea.latency.LatencyHarness()
+        for n in range(1000):
+            line = "$GPTXT,%d*00\r\n" % n
+            harness.emitted("/dev/pts/1", line, float(n))
+            harness.received(line, n + (n + 1) / 1000.0)
+        s = harness.report()[0]["/dev/pts/1"]
+        self.assertAlmostEquals(0.5, s["p50"])
+        self.assertAlmostEquals(0.99, s["p99"])
+        self.assertAlmostEquals(0.999, s["p999"])
+        self.assertAlmostEquals(1.0, s["max"])
+
+class Client:
+    "Reads lines, or fragments of them (None), as a gps client would."
+    def __init__(self, reads):
+        self.reads = reads
+        self.enqueued = ""
+        self.stats = None
+        self.valid = 0
+        self.response = None
+
+    def waiting(self):
+        return bool(self.reads)
+
+    def poll(self):
+        line = self.reads.pop(0)
+        if line is not None:
+            self.response = line
+        return 0
+
+class TestService(unittest.TestCase):
+    def testFragment(self):
+        harness = nmea.latency.LatencyHarness()
+        session = nmea.fake.TestSession(latency=harness)
+        harness.emitted("/dev/pts/1", rmc, 100.0)
+        client = Client([rmc, None, gga])
+        self.assertTrue(session.service(client))
+        self.assertEquals(1, session.echoes)
+        # The fragment leaves the previous line as the response
+        self.assertEquals([gga], client.reads)
+        session.service(client)
+        self.assertEquals(2, session.echoes)
+        self.assertEquals(1, harness.unmatched)
+        self.assertEquals(1, harness.report()[0]["all"]["count"])
+
+class Device:
+    "Just enough of a fake GPS for nmea.fake._deliver()."
+    def __init__(self, latency):
+        self.byname = "/dev/pts/1"
+        self.latency = latency
+        self.trace = None
+        self.ring = None
+        self.written = []
+
+    def write(self, line):
+        self.written.append(line)
+
+class TestDeliver(unittest.TestCase):
+    def testEpochSentences(self):
+        harness = nmea.latency.LatencyHarness()
+        device = Device(harness)
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, latitude=57.7, longitude=11.7,
+                                     sentences=("RMC", "GGA"))
+        line = sim.step()
+        nmea.fake._deliver(device, line, None)
+        self.assertEquals([line], device.written)
+        for sentence in line.splitlines(True):
+            harness.received(sentence, time.time())
+        self.assertEquals(2, harness.report()[0]["all"]["count"])
+        self.assertEquals(0, harness.unmatched)
+
+if __name__ == "__main__":
+    unittest.main()
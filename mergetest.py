@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+#
+""" Test merging several logs into one replay """
+
+import nmea.fake
+import unittest
+import os, shutil, tempfile
+
+def nmea_sentence(body):
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+    return "$%s*%02X\r\n" % (body, checksum)
+
+def gga(when):
+    return nmea_sentence("GPGGA,%s,5742.434,N,01141.713,E,1,08,1.0,10.0,M,,,," % when)
+
+def rmc(when, date):
+    return nmea_sentence("GPRMC,%s,A,5742.434,N,01141.713,E,1.00,0.00,%s,,,S" % (when, date))
+
+gsv = nmea_sentence("GPGSV,1,1,01,10,63,137,17")
+
+class TestMergedLoad(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, name, sentences):
+        path = os.path.join(self.directory, name)
+        fp = open(path, "w")
+        fp.write("".join(sentences))
+        fp.close()
+        return nmea.fake.TestLoad(path)
+
+    def testSentenceTime(self):
+        self.assertEquals((27083.5, None), nmea.fake.sentence_time(gga("073123.50")))
+        (seconds, day) = nmea.fake.sentence_time(rmc("073123.000", "280511"))
+        self.assertEquals(27083.0, seconds)
+        self.assertEquals(734285, day)
+        self.assertEquals((None, None), nmea.fake.sentence_time(gsv))
+
+    def testInterleave(self):
+        a = self.load("a", [gga("000001"), gsv, gga("000003"), gga("000005")])
+        b = self.load("b", [gga("000002"), gga("000004"), gga("000006")])
+        merged = nmea.fake.MergedLoad([a, b])
+        self.assertEquals(7, len(merged.sentences))
+        self.assertEquals([gga("000001"), gsv, gga("000002"), gga("000003"),
+                           gga("000004"), gga("000005"), gga("000006")],
+                          list(merged.sentences))
+        self.assertEquals([0, 0, 1, 0, 1, 0, 1], [n for (n, s) in merged.merge()])
+
+    def testMidnight(self):
+        a = self.load("a", [rmc("235958", "280511"), gga("235959"), gga("000001")])
+        b = self.load("b", [gga("000000"), rmc("000002", "290511")])
+        merged = nmea.fake.MergedLoad([a, b])
+        self.assertEquals([rmc("235958", "280511"), gga("235959"), gga("000000"),
+                           gga("000001"), rmc("000002", "290511")],
+                          list(merged.sentences))
+
+    def testUndated(self):
+        a = self.load("a", [rmc("235958", "280511"), gga("235959"), gga("000001")])
+        b = self.load("b", [gga("235959.5"), gga("000000.5")])
+        merged = nmea.fake.MergedLoad([b, a])
+        self.assertEquals([rmc("235958", "280511"), gga("235959"), gga("235959.5"),
+                           gga("000000.5"), gga("000001")],
+                          list(merged.sentences))
+
+    def testDateAfterMidnight(self):
+        a = self.load("a", [gsv, gga("235959"), rmc("000001", "290511")])
+        day = nmea.fake.sentence_time(rmc("000001", "290511"))[1]
+        self.assertEquals([(day - 1) * 86400 + 86399, (day - 1) * 86400 + 86399, day * 86400 + 1],
+                          [when for (when, s) in nmea.fake.timed_sentences(a)])
+
+    def testCycles(self):
+        a = self.load("a", [gga("000001"), gga("000003")])
+        b = self.load("b", [gga("000002")])
+        fake = nmea.fake.FakeLogGPS(nmea.fake.MergedLoad([a, b]))
+        (saved, nmea.fake.WRITE_PAD) = (nmea.fake.WRITE_PAD, 0.0)
+        try:
+            fed = [fake.feed() for n in range(7)]
+        finally:
+            nmea.fake.WRITE_PAD = saved
+        self.assertEquals([gga("000001"), gga("000002"), gga("000003")] * 2 + [gga("000001")], fed)
+
+if __name__ == "__main__":
+    unittest.main()
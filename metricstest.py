@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.metrics session statistics """
+
+import nmea.metrics
+import os, socket, tempfile, shutil, json
+import StringIO
+import unittest
+
+class TestHistogram(unittest.TestCase):
+    def testBuckets(self):
+        h = nmea.metrics.Histogram(base=1.0, buckets=8)
+        for v in (0.5, 1.0, 1.5, 3.0, 1000.0):
+            h.add(v)
+        self.assertEquals([2, 1, 1, 0, 0, 0, 0, 1], h.counts)
+        self.assertEquals(5, h.count)
+        self.assertEquals(1000.0, h.max)
+        self.assertEquals(2.0, h.quantile(0.6))
+        self.assertEquals(1000.0, h.quantile(1.0))
+
+class TestSessionMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = nmea.metrics.SessionMetrics()
+        dev = self.metrics.device("/dev/pts/1", period=0.6)
+        dev.emitted(70, 10.0, 10.5, 10.6)
+        dev.emitted(70, 11.0, 11.0, 11.1)
+        dev.dropped()
+        self.metrics.client(1).polled('{"class":"TPV"}\r\n', 11.0, 11.001)
+
+    def testSnapshot(self):
+        snap = self.metrics.snapshot()
+        self.assertEquals(2, snap["sentences"])
+        self.assertEquals(1, snap["reports"])
+        self.assertEquals(1, snap["drops"])
+        dev = snap["devices"]["/dev/pts/1"]
+        self.assertEquals(140, dev["bytes"])
+        self.assertEquals(1, dev["lateness"]["count"])
+        self.assertAlmostEquals(0.4, dev["lateness"]["max"])
+        self.assertEquals(17, snap["clients"]["1"]["bytes"])
+
+    def testSchedule(self):
+        dev = nmea.metrics.DeviceStats("/dev/pts/2", period=1.0)
+        dev.emitted(70, 10.0, 10.0, 10.1)
+        # Visits close together but behind schedule are still late
+        dev.emitted(70, 11.5, 11.5, 11.6)
+        dev.emitted(70, 12.6, 12.6, 12.7)
+        self.assertEquals(2, dev.lateness.count)
+        self.assertAlmostEquals(0.6, dev.lateness.max)
+        # Nothing sent for five seconds is not lateness
+        dev.skipped(5.0)
+        dev.emitted(70, 18.0, 18.0, 18.1)
+        self.assertAlmostEquals(0.6, dev.lateness.max)
+        dev.reschedule(20.0, 0.5)
+        dev.emitted(70, 20.2, 20.2, 20.3)
+        self.assertAlmostEquals(20.5, dev.due)
+        self.assertEquals(4, dev.lateness.count)
+
+    def testDump(self):
+        out = StringIO.StringIO()
+        self.metrics.dump(out)
+        self.assertTrue("/dev/pts/1: 2 sentences 140 bytes 1 drops" in out.getvalue())
+
+    def testServeUnixSocket(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats")
+            self.metrics.serve(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            data = ""
+            while not data.endswith("\n"):
+                data += sock.recv(4096)
+            sock.close()
+            self.assertEquals(2, json.loads(data)["sentences"])
+            self.metrics.shutdown()
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
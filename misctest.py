@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.misc geodesy and time functions """
+
+import nmea.misc as misc
+import random
+import unittest
+
+def randompairs(n, seed=4711):
+    rnd = random.Random(seed)
+    pairs = []
+    for i in range(n):
+        lat1 = rnd.uniform(-89, 89)
+        lon1 = rnd.uniform(-180, 180)
+        # Mix of nearby points and points across the globe
+        if i % 2:
+            lat2 = lat1 + rnd.uniform(-0.1, 0.1)
+            lon2 = lon1 + rnd.uniform(-0.1, 0.1)
+        else:
+            lat2 = rnd.uniform(-89, 89)
+            lon2 = rnd.uniform(-180, 180)
+        pairs.append(((lat1, lon1), (lat2, lon2)))
+    return pairs
+
+def columns(pairs):
+    return (([p[0][0] for p in pairs], [p[0][1] for p in pairs]),
+            ([p[1][0] for p in pairs], [p[1][1] for p in pairs]))
+
+class TestGeodesy(unittest.TestCase):
+    def setUp(self):
+        self.pairs = randompairs(200)
+        (self.first, self.second) = columns(self.pairs)
+
+    def assertClose(self, expected, got, tolerance=1e-9):
+        self.assertEquals(len(expected), len(got))
+        for (e, g) in zip(expected, got):
+            self.assertTrue(abs(e - g) <= tolerance * max(1.0, abs(e)),
+                            "%r != %r" % (e, g))
+
+    def testCalcRad(self):
+        lats = [p[0][0] for p in self.pairs]
+        self.assertClose([misc.CalcRad(lat) for lat in lats],
+                         misc.CalcRadArray(lats))
+
+    def testEarthDistance(self):
+        self.assertClose([misc.EarthDistance(*p) for p in self.pairs],
+                         misc.EarthDistanceArray(self.first, self.second),
+                         tolerance=1e-6)
+
+    def testMeterOffset(self):
+        (dx, dy) = misc.MeterOffsetArray(self.first, self.second)
+        scalar = [misc.MeterOffset(*p) for p in self.pairs]
+        self.assertClose([o[0] for o in scalar], dx, tolerance=1e-6)
+        self.assertClose([o[1] for o in scalar], dy, tolerance=1e-6)
+
+    def testHaversine(self):
+        self.assertClose([misc.HaversineDistance(*p) for p in self.pairs],
+                         misc.HaversineDistanceArray(self.first, self.second))
+
+    def testVincenty(self):
+        self.assertClose([misc.VincentyDistance(*p) for p in self.pairs],
+                         misc.VincentyDistanceArray(self.first, self.second))
+
+    def testVincentyKnownValue(self):
+        # Flinders Peak to Buninyong, from Vincenty's 1975 paper
+        flinders = (-(37 + 57/60.0 + 3.72030/3600), 144 + 25/60.0 + 29.52440/3600)
+        buninyong = (-(37 + 39/60.0 + 10.15610/3600), 143 + 55/60.0 + 35.38390/3600)
+        self.assertAlmostEquals(54972.271, misc.VincentyDistance(flinders, buninyong), 3)
+        self.assertEquals(0.0, misc.VincentyDistance(flinders, flinders))
+        self.assertEquals([0.0], list(misc.VincentyDistanceArray(
+            ([flinders[0]], [flinders[1]]), ([flinders[0]], [flinders[1]]))))
+
+    def testSphereVersusEllipsoid(self):
+        # A sphere is within one percent of the ellipsoid
+        for p in self.pairs[::2]:
+            d = misc.VincentyDistance(*p)
+            self.assertTrue(abs(misc.HaversineDistance(*p) - d) < 0.01 * d)
+
+class TestIsoTime(unittest.TestCase):
+    def testFormat(self):
+        self.assertEquals("2012-03-03T07:31:23", misc.isotime(1330759883))
+        self.assertEquals("2012-03-03T07:31:23.5", misc.isotime(1330759883.5))
+        self.assertEquals("1970-01-01T00:00:00", misc.isotime(0))
+
+    def testParse(self):
+        self.assertEquals(1330759883.5, misc.isotime("2012-03-03T07:31:23.5Z"))
+        self.assertEquals(1330759883.0, misc.isotime("2012-03-03T07:31:23"))
+        # Off the fixed layout, strptime still does the work
+        self.assertEquals(1330759883.0, misc.isotime("2012-3-3T7:31:23Z"))
+        self.assertRaises(ValueError, misc.isotime, "2012-03-03T25:31:23Z")
+
+    def testRoundTrip(self):
+        for when in (1330759883, 1330819199, 1330819200, 1306571270):
+            self.assertEquals(when, misc.isotime(misc.isotime(when)))
+
+    def testArray(self):
+        stamps = ["2012-03-03T07:31:23.000Z", "2012-03-03T23:59:59.990Z",
+                  "2012-03-04T00:00:00.010Z", "2011-05-28T09:27:50.000Z"]
+        self.assertEquals([misc.isotime(s) for s in stamps],
+                          list(misc.isotime_array(stamps)))
+        mixed = ["2012-03-03T07:31:23Z", "2012-03-03T07:31:23.5Z"]
+        self.assertEquals([misc.isotime(s) for s in mixed],
+                          list(misc.isotime_array(mixed)))
+        times = [1330759883.5, 1330819199.25, 1306571270.0]
+        self.assertEquals([misc.isotime(t) for t in times],
+                          misc.isotime_array(times))
+        self.assertEquals(["2012-03-03T07:31:23"], misc.isotime_array([1330759883]))
+        # Longest first, so the shorter one would be padded
+        ragged = ["2012-03-03T07:31:23.5", "2012-03-03T07:31:23"]
+        self.assertEquals([misc.isotime(s) for s in ragged],
+                          list(misc.isotime_array(ragged)))
+
+    if misc.numpy:
+        def testNumPyStrings(self):
+            stamps = ["2012-03-03T07:31:23.000Z", "2012-03-04T00:00:00.010Z"]
+            self.assertEquals([misc.isotime(s) for s in stamps],
+                              list(misc.isotime_array(misc.numpy.array(stamps))))
+            ragged = ["2012-03-03T07:31:23.5", "2012-03-03T07:31:23"]
+            self.assertEquals([misc.isotime(s) for s in ragged],
+                              list(misc.isotime_array(misc.numpy.array(ragged))))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+# capture.py - compressed, indexed recordings of gpsd reports
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A capture file holds every report a client read from the daemon, each
+with the time it was received and the device it came from.
+
+Records are buffered and written as zlib-compressed blocks.  Each block
+has a small header giving its length, record count and time span, and
+closing the file appends an index of the blocks: their offsets, time
+spans and the devices they contain.  A CaptureReader uses the index to
+decompress only the blocks that can hold records for the times and
+device asked for.
+
+Opening an existing capture for writing appends to it.  A capture that
+was never closed has no index; reading or appending to it rebuilds the
+index by walking the block headers, losing only the unflushed tail.
+
+Give a gps client a CaptureWriter as its recorder, or a TestSession one
+as its capture, and every report read gets written.  Run this module on
+a capture to print its records:
+
+    python capture.py [-d device] [-s start] [-e end] capturefile
+"""
+import os, sys, struct, zlib, bisect, exceptions
+from client import json
+
+MAGIC = "NMEACAP1"
+BLOCK = struct.Struct("<IIIdd")     # compressed length, raw length, records, first, last
+RECORD = struct.Struct("<dHI")      # received, device, length
+TRAILER = struct.Struct("<QI8s")    # index offset, index length, magic
+INDEX_MAGIC = "NMEAIDX1"
+
+# A record with this device id names the next device id instead
+NAME_RECORD = 0xffff
+
+def report_device(report):
+    "The device a JSON report is about, or the empty string."
+    start = report.find('"device":"')
+    if start < 0:
+        return ""
+    start += 10
+    return report[start:report.find('"', start)]
+
+class CaptureError(exceptions.Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def _scan(fp, names):
+    "Rebuild the block index of a capture by walking its block headers."
+    blocks = []
+    fp.seek(0, 2)
+    size = fp.tell()
+    offset = len(MAGIC)
+    while offset + BLOCK.size <= size:
+        fp.seek(offset)
+        (clen, rlen, count, first, last) = BLOCK.unpack(fp.read(BLOCK.size))
+        if offset + BLOCK.size + clen > size:
+            break       # A block cut short by a crash
+        try:
+            raw = zlib.decompress(fp.read(clen))
+        except zlib.error:
+            break
+        devices = set()
+        for (when, device, data) in _unpack(raw):
+            if device == NAME_RECORD:
+                names.append(data)
+            else:
+                devices.add(device)
+        blocks.append((offset, first, last, count, sorted(devices)))
+        offset += BLOCK.size + clen
+    return (blocks, offset)
+
+def _index(fp):
+    "Return (names, blocks, end of data) for an open capture."
+    fp.seek(0)
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise CaptureError("%s is not a capture file" % fp.name)
+    fp.seek(0, 2)
+    size = fp.tell()
+    if size >= len(MAGIC) + TRAILER.size:
+        fp.seek(size - TRAILER.size)
+        (offset, length, magic) = TRAILER.unpack(fp.read(TRAILER.size))
+        if magic == INDEX_MAGIC and offset + length + TRAILER.size == size:
+            fp.seek(offset)
+            index = json.loads(zlib.decompress(fp.read(length)))
+            names = [str(name) for name in index["names"]]
+            blocks = [tuple(block) for block in index["blocks"]]
+            return (names, blocks, offset)
+    names = []
+    (blocks, end) = _scan(fp, names)
+    return (names, blocks, end)
+
+def _unpack(raw):
+    "Yield (received, device, data) for each record of a block."
+    offset = 0
+    end = len(raw)
+    while offset < end:
+        (when, device, length) = RECORD.unpack_from(raw, offset)
+        offset += RECORD.size
+        yield (when, device, raw[offset:offset + length])
+        offset += length
+
+class CaptureWriter:
+    "Append received reports to a capture file."
+    def __init__(self, path, blocksize=1 << 20, level=1):
+        self.path = path
+        self.blocksize = blocksize      # Raw bytes buffered per block
+        self.level = level              # zlib compression level
+        if os.path.exists(path):
+            self.fp = open(path, "r+b")
+            (self.names, self.blocks, end) = _index(self.fp)
+            self.fp.seek(end)
+            self.fp.truncate()
+        else:
+            self.fp = open(path, "w+b")
+            self.fp.write(MAGIC)
+            self.names = []
+            self.blocks = []
+        self.ids = dict((name, n) for (n, name) in enumerate(self.names))
+        self.pending = []
+        self.size = 0
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.devices = set()
+
+    def device(self, name):
+        "Return the id for a device name, recording the name if it is new."
+        tid = self.ids.get(name)
+        if tid is None:
+            tid = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.pending.append(RECORD.pack(0.0, NAME_RECORD, len(name)))
+            self.pending.append(name)
+            self.size += RECORD.size + len(name)
+        return tid
+
+    def write(self, received, report, device=None):
+        "Record a report received at the given time."
+        if device is None:
+            device = report_device(report)
+        tid = self.ids.get(device)
+        if tid is None:
+            tid = self.device(device)
+        self.pending.append(RECORD.pack(received, tid, len(report)))
+        self.pending.append(report)
+        self.size += RECORD.size + len(report)
+        self.count += 1
+        if self.first is None:
+            self.first = received
+        self.last = received
+        self.devices.add(tid)
+        if self.size >= self.blocksize:
+            self.flush()
+
+    def flush(self):
+        "Compress and write out the buffered records as one block."
+        if not self.pending:
+            return
+        raw = "".join(self.pending)
+        data = zlib.compress(raw, self.level)
+        if self.first is None:
+            # Only device names, no reports
+            self.first = self.last = 0.0
+        offset = self.fp.tell()
+        self.fp.write(BLOCK.pack(len(data), len(raw), self.count, self.first, self.last))
+        self.fp.write(data)
+        self.blocks.append((offset, self.first, self.last, self.count, sorted(self.devices)))
+        self.pending = []
+        self.size = 0
+        self.count = 0
+        self.first = self.last = None
+        self.devices = set()
+
+    def close(self):
+        "Flush the buffered records and write the index."
+        if self.fp is None:
+            return
+        self.flush()
+        offset = self.fp.tell()
+        index = zlib.compress(json.dumps({"names": self.names, "blocks": self.blocks}))
+        self.fp.write(index)
+        self.fp.write(TRAILER.pack(offset, len(index), INDEX_MAGIC))
+        self.fp.close()
+        self.fp = None
+
+class CaptureReader:
+    "Read records back from a capture file."
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, "rb")
+        (self.names, self.blocks, end) = _index(self.fp)
+        # Receive times only mostly increase, so bound the block search
+        # by the running maximum of block ends and minimum of block starts.
+        self.reach = []
+        latest = float("-inf")
+        for block in self.blocks:
+            if block[3]:
+                latest = max(latest, block[2])
+            self.reach.append(latest)
+        self.floor = [0.0] * len(self.blocks)
+        earliest = float("inf")
+        for n in range(len(self.blocks) - 1, -1, -1):
+            if self.blocks[n][3]:
+                earliest = min(earliest, self.blocks[n][1])
+            self.floor[n] = earliest
+
+    def span(self):
+        "The earliest and latest receive times in the capture."
+        if not self.blocks or not self.reach[-1] > float("-inf"):
+            return (None, None)
+        return (self.floor[0], self.reach[-1])
+
+    def records(self, start=None, end=None, device=None):
+        "Yield (received, device, report) for reports in a time range from a device."
+        if device is not None:
+            if device not in self.names:
+                return
+            want = self.names.index(device)
+        else:
+            want = None
+        n = 0
+        if start is not None:
+            n = bisect.bisect_left(self.reach, start)
+        for n in xrange(n, len(self.blocks)):
+            if end is not None and self.floor[n] > end:
+                break
+            (offset, first, last, count, devices) = self.blocks[n]
+            if not count:
+                continue
+            if want is not None and want not in devices:
+                continue
+            if (start is not None and last < start) or (end is not None and first > end):
+                continue
+            self.fp.seek(offset)
+            (clen, rlen, count, first, last) = BLOCK.unpack(self.fp.read(BLOCK.size))
+            for (when, tid, data) in _unpack(zlib.decompress(self.fp.read(clen))):
+                if tid == NAME_RECORD:
+                    continue
+                if want is not None and tid != want:
+                    continue
+                if (start is not None and when < start) or (end is not None and when > end):
+                    continue
+                yield (when, self.names[tid], data)
+
+    def close(self):
+        self.fp.close()
+
+if __name__ == '__main__':
+    import getopt
+    (options, arguments) = getopt.getopt(sys.argv[1:], "d:e:s:")
+    (device, start, end) = (None, None, None)
+    for (switch, val) in options:
+        if switch == '-d':
+            device = val
+        elif switch == '-s':
+            start = float(val)
+        elif switch == '-e':
+            end = float(val)
+    if len(arguments) != 1:
+        sys.stderr.write("usage: capture.py [-d device] [-s start] [-e end] capturefile\n")
+        sys.exit(1)
+    reader = CaptureReader(arguments[0])
+    for (when, name, report) in reader.records(start, end, device):
+        sys.stdout.write("%.6f %s %s" % (when, name or "-", report))
+    reader.close()
+
+# End
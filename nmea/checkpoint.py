@@ -0,0 +1,78 @@
+# checkpoint.py - save and resume the state of a long TestSession
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Periodic snapshots of a TestSession, so a long soak run can pick up
+where it was after a crash or a daemon restart instead of replaying
+everything from the start.
+
+A snapshot is a small JSON file holding, for each fake GPS, the state
+of its simulator (time, position, course and the offset into its plan)
+or its index into the log, and the commands each client was started
+with.  Devices are matched up on resume by the order they were added in
+and what they were added from, so the session has to be set up the same
+way again (the same logs, scenarios and options) before it resumes.
+
+Snapshots are written to a temporary file and renamed into place, so a
+crash while saving leaves the previous one intact.
+"""
+import os, time, exceptions
+from client import json
+
+VERSION = 1
+
+class CheckpointError(exceptions.Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+class Checkpointer:
+    "Save a session's state to a file every interval seconds."
+    def __init__(self, path, interval=60.0):
+        self.path = path
+        self.interval = interval
+        self.next_save = time.time() + interval
+        self.saves = 0
+
+    def tick(self, session, now=None):
+        "Save the session if the interval has passed."
+        if now is None:
+            now = time.time()
+        if now >= self.next_save:
+            self.save(session)
+            self.next_save = now + self.interval
+
+    def save(self, session):
+        "Write a snapshot of the session."
+        state = session.snapshot()
+        state["version"] = VERSION
+        state["saved"] = time.time()
+        tmp = "%s.%d" % (self.path, os.getpid())
+        fp = open(tmp, "w")
+        try:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+        os.rename(tmp, self.path)
+        self.saves += 1
+
+    def load(self):
+        "The last snapshot saved, or None if there is none."
+        try:
+            fp = open(self.path)
+        except IOError:
+            return None
+        try:
+            try:
+                state = json.load(fp)
+            except ValueError:
+                raise CheckpointError("%s is not a checkpoint" % self.path)
+        finally:
+            fp.close()
+        if state.get("version") != VERSION:
+            raise CheckpointError("%s is a version %s checkpoint" % (self.path, state.get("version")))
+        return state
+
+# End
@@ -0,0 +1,179 @@
+# constellation.py - satellite geometry for simulated GSA and GSV sentences
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A GPS constellation computed from a simple almanac, so simulated
+vessels can report the sky they see instead of only a position.
+
+The almanac puts each satellite on a circular orbit, given by its
+inclination, the longitude of its ascending node and its argument of
+latitude at ALMANAC_TOA.  The default is the nominal 24 slot
+constellation: six planes at 55 degrees, four satellites in each.
+Azimuth, elevation and signal strength are computed with NumPy for all
+satellites and many receiver positions in one go, and GSA (with DOPs
+from the satellites used) and GSV sentences rendered from them.
+
+Satellites move a fraction of a degree per second across the sky and a
+few kilometres hardly change the view, so the geometry is computed per
+epoch (interval seconds of simulated time) and per cell of the
+latitude/longitude grid (cell degrees), and the rendered sentences are
+shared by every vessel in that cell at that epoch.  When an epoch has
+to be computed, the cells of all attached simulators are computed with
+it, so a fleet stepping in lockstep costs one vectorized pass per epoch
+and a dictionary lookup per vessel.
+"""
+import math, operator
+import lazy
+
+numpy = lazy.module("numpy")
+
+ORBIT_RADIUS = 26559.7          # km, semi-major axis of a GPS orbit
+ORBIT_PERIOD = 43082.0          # seconds, half a sidereal day
+EARTH_RADIUS = 6371.0           # km, as the simulator's spherical Earth
+EARTH_ROTATION = 7.2921151467e-5    # rad/s
+ALMANAC_TOA = 1330732800        # 2012-03-03 00:00:00 UTC
+
+def nominal_almanac():
+    "(prn, inclination, node, argument of latitude) for 24 nominal slots."
+    almanac = []
+    for plane in range(6):
+        for slot in range(4):
+            almanac.append((plane * 4 + slot + 1, 55.0,
+                            plane * 60.0, slot * 90.0 + plane * 15.0))
+    return almanac
+
+def _sentence(body):
+    cksum = reduce(operator.xor, (ord(c) for c in body), 0)
+    return "$%s*%02X\r\n" % (body, cksum)
+
+class Constellation:
+    "Satellite geometry and GSA/GSV sentences, cached per epoch and grid cell."
+    def __init__(self, almanac=None, mask=5.0, cell=0.25, interval=1, keep=4):
+        if numpy is None:
+            raise ImportError("the constellation needs NumPy")
+        if almanac is None:
+            almanac = nominal_almanac()
+        self.prn = [int(prn) for (prn, i, node, arg) in almanac]
+        self.inclination = numpy.radians([float(i) for (prn, i, node, arg) in almanac])
+        self.node = numpy.radians([float(node) for (prn, i, node, arg) in almanac])
+        self.argument = numpy.radians([float(arg) for (prn, i, node, arg) in almanac])
+        self.mask = mask            # Elevation mask in degrees
+        self.cell = cell            # Grid cell size in degrees
+        self.interval = interval    # Seconds of simulated time per epoch
+        self.keep = keep            # Epochs to keep cached
+        self.epochs = {}            # epoch -> {cell: {"GSA": text, "GSV": text}}
+        self.order = []             # Cached epochs, oldest first
+        self.vessels = []           # Attached simulators, computed together
+        self.hits = 0
+        self.computed = 0           # Cells computed
+
+    def attach(self, sim):
+        "Compute a simulator's cell along with the others at each new epoch."
+        self.vessels.append(sim)
+
+    def detach(self, sim):
+        "Stop computing cells for a simulator that has gone."
+        if sim in self.vessels:
+            self.vessels.remove(sim)
+
+    def satellites(self, when):
+        "Earth-fixed positions, in km, of all satellites at a time."
+        t = when - ALMANAC_TOA
+        u = self.argument + (2 * math.pi / ORBIT_PERIOD) * t
+        node = self.node - EARTH_ROTATION * t
+        (cu, su) = (numpy.cos(u), numpy.sin(u))
+        (cn, sn) = (numpy.cos(node), numpy.sin(node))
+        ci = numpy.cos(self.inclination)
+        return ORBIT_RADIUS * numpy.column_stack((cu * cn - su * ci * sn,
+                                                  cu * sn + su * ci * cn,
+                                                  su * numpy.sin(self.inclination)))
+
+    def views(self, when, lats, lons):
+        "Azimuth, elevation and SNR arrays, receivers by satellites, and DOPs."
+        lat = numpy.radians(numpy.asarray(lats, dtype=numpy.float64))[:, None]
+        lon = numpy.radians(numpy.asarray(lons, dtype=numpy.float64))[:, None]
+        sats = self.satellites(when)
+        (slat, clat, slon, clon) = (numpy.sin(lat), numpy.cos(lat), numpy.sin(lon), numpy.cos(lon))
+        dx = sats[:, 0] - EARTH_RADIUS * clat * clon
+        dy = sats[:, 1] - EARTH_RADIUS * clat * slon
+        dz = sats[:, 2] - EARTH_RADIUS * slat
+        # Line of sight in local east, north, up
+        east = -slon * dx + clon * dy
+        north = -slat * clon * dx - slat * slon * dy + clat * dz
+        up = clat * clon * dx + clat * slon * dy + slat * dz
+        rng = numpy.sqrt(east * east + north * north + up * up)
+        elevation = numpy.degrees(numpy.arcsin(up / rng))
+        azimuth = numpy.degrees(numpy.arctan2(east, north)) % 360.0
+        snr = numpy.clip(numpy.rint(20.0 + 30.0 * (up / rng)), 0, 99)
+        # DOPs from the (at most) 12 highest satellites above the mask
+        visible = elevation >= self.mask
+        rank = numpy.argsort(numpy.argsort(-elevation, axis=1), axis=1)
+        used = visible & (rank < 12)
+        g = numpy.empty(elevation.shape + (4,))
+        g[..., 0] = east / rng
+        g[..., 1] = north / rng
+        g[..., 2] = up / rng
+        g[..., 3] = 1.0
+        g *= used[..., None]
+        counts = used.sum(axis=1)
+        dops = numpy.zeros((len(counts), 3))
+        fixed = counts >= 4
+        if fixed.any():
+            q = numpy.linalg.inv(numpy.einsum("mni,mnj->mij", g[fixed], g[fixed]))
+            dops[fixed, 0] = numpy.sqrt(q[:, 0, 0] + q[:, 1, 1] + q[:, 2, 2])
+            dops[fixed, 1] = numpy.sqrt(q[:, 0, 0] + q[:, 1, 1])
+            dops[fixed, 2] = numpy.sqrt(q[:, 2, 2])
+        return (azimuth, elevation, snr, used, dops)
+
+    def render(self, azimuth, elevation, snr, used, dops):
+        "GSA and GSV sentences for one receiver's row of views()."
+        visible = [n for n in numpy.argsort(-elevation) if elevation[n] >= self.mask]
+        fields = ["%02d" % self.prn[n] for n in visible if used[n]]
+        if len(fields) >= 4:
+            gsa = "GPGSA,A,3,%s,%.2f,%.2f,%.2f" % (",".join(fields + [""] * (12 - len(fields))),
+                                                   dops[0], dops[1], dops[2])
+        else:
+            gsa = "GPGSA,A,1,%s,,," % ",".join(fields + [""] * (12 - len(fields)))
+        gsv = []
+        total = max((len(visible) + 3) // 4, 1)
+        for part in range(total):
+            sats = ["%02d,%02d,%03d,%02d" % (self.prn[n], elevation[n], azimuth[n], snr[n])
+                    for n in visible[part * 4:part * 4 + 4]]
+            gsv.append(_sentence(",".join(["GPGSV,%d,%d,%02d" % (total, part + 1, len(visible))] + sats)))
+        return {"GSA": _sentence(gsa), "GSV": "".join(gsv)}
+
+    def key(self, lat, lon):
+        "The grid cell a position is in."
+        return (int(math.floor(lat / self.cell + 0.5)), int(math.floor(lon / self.cell + 0.5)))
+
+    def sky(self, when, lat, lon):
+        "The {'GSA': text, 'GSV': text} sentences for a position at a time."
+        epoch = int(when) // self.interval * self.interval
+        key = self.key(lat, lon)
+        cells = self.epochs.get(epoch)
+        if cells is not None and key in cells:
+            self.hits += 1
+            return cells[key]
+        if cells is None:
+            cells = self.epochs[epoch] = {}
+            self.order.append(epoch)
+            if len(self.order) > self.keep:
+                del self.epochs[self.order.pop(0)]
+        wanted = set([key])
+        for sim in self.vessels:
+            wanted.add(self.key(sim._latitude, sim._longitude))
+        wanted = [k for k in wanted if k not in cells]
+        views = self.views(epoch, [k[0] * self.cell for k in wanted],
+                           [k[1] * self.cell for k in wanted])
+        for (i, k) in enumerate(wanted):
+            cells[k] = self.render(*[v[i] for v in views])
+        self.computed += len(wanted)
+        return cells[key]
+
+    def sentences(self, when, lat, lon, wanted=("GSA", "GSV")):
+        "The sentences named in wanted, in that order, for a position at a time."
+        sky = self.sky(when, lat, lon)
+        return "".join([sky[name] for name in wanted if name in sky])
+
+# End
@@ -0,0 +1,140 @@
+# decompress.py - read compressed logs through a pipe
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Open gzip, bzip2, xz and zstd compressed logs as a stream with a real
+file descriptor, so the packet getter can read them like a plain log.
+
+The compression is recognized from the first bytes of the file, not its
+name.  Decompression runs in a separate process writing into a pipe, so
+it proceeds on another core while the packet getter reads, and nothing
+is written to disk.  A parallel decompressor (pigz, lbzip2) is used
+when one is installed, then the standard one (gzip, bzip2, xz, zstd).
+When no command is installed for a format Python has a module for, a
+forked child decompresses with the module instead.
+"""
+import os, errno, exceptions
+
+# Leading bytes of each compressed format
+MAGIC = (
+    ("\x1f\x8b", "gzip"),
+    ("BZh", "bzip2"),
+    ("\xfd7zXZ\x00", "xz"),
+    ("\x28\xb5\x2f\xfd", "zstd"),
+)
+
+# Commands that decompress a file to stdout, best first
+COMMANDS = {
+    "gzip": (("pigz", "-dc"), ("gzip", "-dc")),
+    "bzip2": (("lbzip2", "-dc"), ("bzip2", "-dc")),
+    "xz": (("xz", "-dc"),),
+    "zstd": (("zstd", "-dc"),),
+}
+
+CHUNK = 65536
+
+class DecompressError(exceptions.Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def compression(path):
+    "The compression format of a file, or None if it is not compressed."
+    fp = open(path, "rb")
+    try:
+        head = fp.read(6)
+    finally:
+        fp.close()
+    for (magic, name) in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+def _module(fmt):
+    "A Python module that can decompress fmt, or None."
+    try:
+        if fmt == "gzip":
+            import gzip
+            return lambda path: gzip.open(path, "rb")
+        elif fmt == "bzip2":
+            import bz2
+            return lambda path: bz2.BZ2File(path, "rb")
+        elif fmt == "xz":
+            import lzma
+            return lambda path: lzma.open(path, "rb")
+    except ImportError:
+        pass
+    return None
+
+class Stream:
+    "The decompressed contents of a file, read from a pipe."
+    def __init__(self, path, fmt):
+        self.name = path
+        self.format = fmt
+        self.process = None
+        self.pid = None
+        import subprocess
+        for command in COMMANDS.get(fmt, ()):
+            try:
+                self.process = subprocess.Popen(command + (path,),
+                                                stdout=subprocess.PIPE,
+                                                close_fds=True)
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            self.fd = self.process.stdout.fileno()
+            return
+        opener = _module(fmt)
+        if opener is None:
+            raise DecompressError("no %s decompressor for %s" % (fmt, path))
+        (self.fd, wfd) = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # Whatever goes wrong, the child must not return into the
+            # parent's code; it reports and exits non-zero instead.
+            status = 1
+            try:
+                try:
+                    os.close(self.fd)
+                    source = opener(path)
+                    while True:
+                        data = source.read(CHUNK)
+                        if not data:
+                            break
+                        os.write(wfd, data)
+                    status = 0
+                except Exception, e:
+                    os.write(2, "decompress: %s: %s\n" % (path, e))
+            finally:
+                os._exit(status)
+        os.close(wfd)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, size=CHUNK):
+        return os.read(self.fd, size)
+
+    def close(self):
+        "Stop the decompressor; True if it finished cleanly."
+        if self.process:
+            self.process.stdout.close()
+            status = self.process.wait()
+            self.process = None
+        elif self.pid:
+            os.close(self.fd)
+            status = os.waitpid(self.pid, 0)[1]
+            self.pid = None
+        else:
+            return True
+        return status == 0
+
+def open_log(path):
+    "Open a log, decompressing it on the fly when it is compressed."
+    fmt = compression(path)
+    if fmt is None:
+        return open(path, "r")
+    return Stream(path, fmt)
+
+# End
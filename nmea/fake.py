@@ -65,10 +65,16 @@ run in threaded mode by calling the start() method.  This simply calls
 the run method in a subthread, with locking of critical regions.
 """
 import sys, os, time, signal, pty, termios # fcntl, array, struct
-import operator, math
-import exceptions, threading, socket
-import gps
-import packet as sniffer
+import operator, math, array, cPickle, hashlib, bisect, heapq, datetime
+import exceptions, socket, select, errno, collections
+import gps, tracer, decompress, framer, lazy
+
+# The packet module is a compiled extension; without it logs are
+# framed in Python, which only understands text protocols.  Loading it
+# is slow, so it is left until a log is read.  It may be built into
+# this package or installed as a top-level module.
+sniffer = lazy.module("packet", __name__.rpartition(".")[0] or None) \
+          or lazy.module("packet")
 
 # The two magic numbers below have to be derived from observation.  If
 # they're too high you'll slow the tests down a lot.  If they're too low
@@ -93,16 +99,56 @@ WRITE_PAD = 0.001
 # and *BSD return full precision.)
 CLOSE_DELAY = 1
 
+# Logs smaller than this are not worth splitting between processes
+PARALLEL_LOAD = 16 << 20
+
+# Bytes a TCP subscriber may fall behind by before it is dropped
+TCP_BACKLOG = 1 << 20
+
+# Bytes of small queued sentences a TCP subscriber copies into one send
+TCP_COALESCE = 4096
+
+# Largest UDP payload that fits an Ethernet frame unfragmented; packed
+# sentences are sent before a datagram would grow past it.
+MAX_DATAGRAM = 1472
+
+# Seconds packed sentences may wait for a datagram to fill
+PACK_WAIT = 0.1
+
+# Metres, the radius of the simulator's spherical Earth
+EARTH_RADIUS = 6371000.0
+
+def multicast(ipaddr):
+    "True if an IPv4 address is a multicast group."
+    try:
+        return 224 <= int(ipaddr.split(".")[0]) <= 239
+    except ValueError:
+        return False
+
 class TestLoadError(exceptions.Exception):
     def __init__(self, msg):
         self.msg = msg
 
+def _sniff(logfp):
+    "Yield (type, packet) for the packets of a log, via the packet module."
+    getter = sniffer.new()
+    #gps.packet.register_report(reporter)
+    while True:
+        (len, ptype, packet) = getter.get(logfp.fileno())
+        if len <= 0:
+            break
+        yield (ptype, packet)
+
 class TestLoad:
     "Digest a logfile into a list of sentences we can cycle through."
-    def __init__(self, logfp, predump=False):
+    def __init__(self, logfp, predump=False, bulk=False, workers=1):
         self.sentences = []	# This is the interesting part
         if type(logfp) == type(""):
-            logfp = open(logfp, "r");            
+            # Compressed logs are decompressed through a pipe
+            try:
+                logfp = decompress.open_log(logfp)
+            except decompress.DecompressError, e:
+                raise TestLoadError(e.msg)
         self.name = logfp.name
         self.logfp = logfp
         self.predump = predump
@@ -110,102 +156,423 @@ class TestLoad:
         self.type = None
         self.sourcetype = "pty"
         self.serial = None
-        # Grab the packets
-        getter = sniffer.new()
-        #gps.packet.register_report(reporter)
-        type_latch = None
-        while True:
-            (len, ptype, packet) = getter.get(logfp.fileno())
-            if len <= 0:
-                break
-            elif ptype == sniffer.COMMENT_PACKET:
-                # Some comments are magic
-                if "Serial:" in packet:
-                    # Change serial parameters
-                    packet = packet[1:].strip()
-                    try:
-                        (xx, baud, params) = packet.split()
-                        baud = int(baud)
-                        if params[0] in ('7', '8'):
-                            databits = int(params[0])
-                        else:
-                            raise ValueError
-                        if params[1] in ('N', 'O', 'E'):
-                            parity = params[1]
-                        else:
-                            raise ValueError
-                        if params[2] in ('1', '2'):
-                            stopbits = int(params[2])
-                        else:
-                            raise ValueError
-                    except (ValueError, IndexError):
-                        raise TestLoadError("bad serial-parameter spec in %s"%\
+        # Grab the packets, a block at a time with the bulk framer, and
+        # large plain files in pieces framed by a pool of processes.
+        # The bulk framer only knows text, so unless it was asked for a
+        # log that may be binary goes to the packet module instead.
+        if workers > 1 and not isinstance(logfp, decompress.Stream) \
+               and os.path.isfile(logfp.name) \
+               and os.path.getsize(logfp.name) >= PARALLEL_LOAD \
+               and (bulk or sniffer is None or framer.textual(logfp.name)):
+            source = framer.parallel_packets(logfp.name, workers)
+        elif bulk or sniffer is None:
+            source = framer.read_packets(logfp)
+        else:
+            source = _sniff(logfp)
+        try:
+            type_latch = None
+            for (ptype, packet) in source:
+                if ptype == framer.COMMENT_PACKET:
+                    # Some comments are magic
+                    if "Serial:" in packet:
+                        # Change serial parameters
+                        packet = packet[1:].strip()
+                        try:
+                            (xx, baud, params) = packet.split()
+                            baud = int(baud)
+                            if params[0] in ('7', '8'):
+                                databits = int(params[0])
+                            else:
+                                raise ValueError
+                            if params[1] in ('N', 'O', 'E'):
+                                parity = params[1]
+                            else:
+                                raise ValueError
+                            if params[2] in ('1', '2'):
+                                stopbits = int(params[2])
+                            else:
+                                raise ValueError
+                        except (ValueError, IndexError):
+                            raise TestLoadError("bad serial-parameter spec in %s"%\
+                                                logfp.name)                    
+                        self.serial = (baud, databits, parity, stopbits)
+                    elif "UDP" in packet:
+                        self.sourcetype = "UDP"
+                    elif "TCP" in packet:
+                        self.sourcetype = "TCP"
+                    elif "%" in packet:
+                        # Pass through for later interpretation 
+                        self.sentences.append(packet)
+                else:
+                    if type_latch is None:
+                        type_latch = ptype
+                    if self.predump:
+                        print `packet`
+                    if not packet:
+                        raise TestLoadError("zero-length packet from %s"%\
                                             logfp.name)                    
-                    self.serial = (baud, databits, parity, stopbits)
-                elif "UDP" in packet:
-                    self.sourcetype = "UDP"
-                elif "%" in packet:
-                    # Pass through for later interpretation 
                     self.sentences.append(packet)
-            else:
-                if type_latch is None:
-                    type_latch = ptype
-                if self.predump:
-                    print `packet`
-                if not packet:
-                    raise TestLoadError("zero-length packet from %s"%\
-                                        logfp.name)                    
-                self.sentences.append(packet)
+        except:
+            # Reap the decompressor rather than leave it behind
+            if isinstance(logfp, decompress.Stream):
+                (kind, value, traceback) = sys.exc_info()
+                logfp.close()
+                raise kind, value, traceback
+            raise
+        if isinstance(logfp, decompress.Stream) and not logfp.close():
+            raise TestLoadError("can't decompress %s" % logfp.name)
         # Look at the first packet to grok the GPS type
-        self.textual = (type_latch == sniffer.NMEA_PACKET)
+        self.textual = (type_latch == framer.NMEA_PACKET)
         if self.textual:
             self.legend = "gpsfake: line %d: "
         else:
             self.legend = "gpsfake: packet %d"
 
+# Field holding hhmmss.ss, by sentence type
+TIME_FIELD = {"GGA": 1, "RMC": 1, "ZDA": 1, "GNS": 1, "GST": 1,
+              "GBS": 1, "GRS": 1, "GLL": 5}
+
+def sentence_time(sentence):
+    "Return (seconds into the day, day ordinal or None) of an NMEA sentence."
+    if not sentence.startswith(("$", "!")):
+        return (None, None)
+    fields = sentence.split(",")
+    field = TIME_FIELD.get(fields[0][3:])
+    if field is None or len(fields) <= field or len(fields[field]) < 6:
+        return (None, None)
+    stamp = fields[field]
+    try:
+        seconds = int(stamp[0:2]) * 3600 + int(stamp[2:4]) * 60 + float(stamp[4:])
+    except ValueError:
+        return (None, None)
+    day = None
+    try:
+        if fields[0][3:] == "RMC" and len(fields[9]) == 6:
+            date = fields[9]
+            day = datetime.date(2000 + int(date[4:6]), int(date[2:4]), int(date[0:2])).toordinal()
+        elif fields[0][3:] == "ZDA":
+            day = datetime.date(int(fields[4]), int(fields[3]), int(fields[2])).toordinal()
+    except (ValueError, IndexError):
+        pass
+    return (seconds, day)
+
+def _log_start(load):
+    "Return (day, seconds) a TestLoad starts at, either None when it has none."
+    # The day is the first date in the log, wound back over any
+    # midnights that pass before it.
+    (midnights, first, last) = (0, None, None)
+    for sentence in load.sentences:
+        (seconds, date) = sentence_time(sentence)
+        if seconds is not None:
+            if first is None:
+                first = seconds
+            elif seconds < last - 43200:
+                midnights += 1
+            last = seconds
+        if date is not None:
+            return (date - midnights, first)
+    return (None, first)
+
+def timed_sentences(load, day=0):
+    "Yield (time, sentence) for a TestLoad, giving untimed sentences the time before them."
+    # Sentences ahead of the first timestamp get that timestamp.  A
+    # log without dates is taken to start on the given day.
+    (start, last) = _log_start(load)
+    if start is not None:
+        day = start
+    for sentence in load.sentences:
+        (seconds, date) = sentence_time(sentence)
+        if date is not None:
+            day = date
+        elif seconds is not None and last is not None and seconds < last - 43200:
+            day += 1    # Past midnight
+        if seconds is not None:
+            last = seconds
+        yield (day * 86400 + (last or 0.0), sentence)
+
+class MergedSentences:
+    "The sentences of a MergedLoad, produced lazily in time order."
+    def __init__(self, merged):
+        self.merged = merged
+        self.length = sum(len(load.sentences) for load in merged.loads)
+        self.rewind()
+
+    def rewind(self):
+        self.stream = self.merged.merge()
+        self.position = 0
+        self.current = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, n):
+        if n < 0 or n >= self.length:
+            raise IndexError(n)
+        if n < self.position - 1:
+            self.rewind()
+        while self.position <= n:
+            self.current = self.stream.next()[1]
+            self.position += 1
+        return self.current
+
+    def __iter__(self):
+        for (source, sentence) in self.merged.merge():
+            yield sentence
+
+class MergedLoad:
+    "Several TestLoads replayed as one, in timestamp order."
+    def __init__(self, loads):
+        if not loads:
+            raise TestLoadError("nothing to merge")
+        self.loads = loads
+        self.name = "+".join(load.name for load in loads)
+        self.logfile = self.name
+        self.predump = False
+        self.type = None
+        self.sourcetype = "pty"
+        self.serial = loads[0].serial
+        self.textual = loads[0].textual
+        self.legend = loads[0].legend
+        # Logs without dates are taken to be from the earliest day the
+        # others start on.
+        days = [_log_start(load)[0] for load in loads]
+        days = [day for day in days if day is not None]
+        self.day = min(days or [0])
+        self.sentences = MergedSentences(self)
+
+    def merge(self):
+        "Yield (load index, sentence) pairs from all loads in time order."
+        # One heap entry per load: O(log N) per sentence, and nothing
+        # is buffered beyond the head of each load.
+        heap = []
+        for (n, load) in enumerate(self.loads):
+            stream = timed_sentences(load, self.day)
+            for (when, sentence) in stream:
+                heap.append((when, n, sentence, stream))
+                break
+        heapq.heapify(heap)
+        while heap:
+            (when, n, sentence, stream) = heap[0]
+            yield (n, sentence)
+            for (when, sentence) in stream:
+                heapq.heapreplace(heap, (when, n, sentence, stream))
+                break
+            else:
+                heapq.heappop(heap)
+
 class PacketError(exceptions.Exception):
     def __init__(self, msg):
         self.msg = msg
 
+class EmissionPolicy:
+    "Send a simulated vessel's fix only when it has changed, or to keep alive."
+    def __init__(self, distance=1.0, course=1.0, speed=0.1, keepalive=30):
+        self.distance = distance    # Metres moved
+        self.course = course        # Degrees turned
+        self.speed = speed          # Knots of speed change
+        self.keepalive = keepalive  # Most simulated seconds between fixes sent
+        self.sent = 0
+        self.suppressed = 0
+
+    def changed(self, sim):
+        "True, noting the fix as sent, if the simulator's fix is worth sending."
+        last = sim._sent
+        if last is not None and sim._time - last[4] < self.keepalive:
+            (lat, lon, heading, speed) = last[:4]
+            turn = abs((sim._heading - heading + 180) % 360 - 180)
+            if turn < self.course and abs(sim._speed - speed) < self.speed:
+                north = math.radians(sim._latitude - lat) * EARTH_RADIUS
+                east = math.radians(sim._longitude - lon) * EARTH_RADIUS * math.cos(math.radians(lat))
+                if north * north + east * east < self.distance * self.distance:
+                    self.suppressed += 1
+                    return False
+        sim._sent = (sim._latitude, sim._longitude, sim._heading, sim._speed, sim._time)
+        self.sent += 1
+        return True
+
 class GPSSimulator:
-    def __init__(self, currtime, latitude=0.0, longitude=0.0, course=0, speed=1, shipplan=None):
+    def __init__(self, currtime, latitude=0.0, longitude=0.0, course=0, speed=1, shipplan=None, cache=None, period=1.0, sky=None, sentences=("RMC",), noise=None, policy=None):
         self.setLatLon(latitude, longitude)
         self._starttime = currtime
+        self.period = period        # Wall-clock seconds per simulated second
         self._heading = course
         self._speed = speed
         self.sourcetype = "pty"
         self.serial = None
         self._shipplan = shipplan
         self._setTime(currtime)
+        # Laps after the first can be replayed from a SentenceCache
+        self._lap = None
+        if cache and shipplan and shipplan.isCyclic() and not noise:
+            self._lap = cache.lap(shipplan)
+        # GSA and GSV come from a constellation.Constellation
+        self._sentences = sentences
+        self._sky = None
+        if sky and ("GSA" in sentences or "GSV" in sentences):
+            self._sky = sky
+            sky.attach(self)
+        # Reported fixes are perturbed by a noise.NoiseStream
+        self._noise = noise
+        self._fix = None
+        # With an EmissionPolicy, fixes that have not changed are not sent
+        self._policy = policy
+        self._sent = None           # (lat, lon, heading, speed, time) last sent
 
     def setLatLon(self, lat, lon):
         self._latitude = lat
-        absLat = abs(lat)
-        self._latitudeTxt = "%02d%06.3f" % (math.floor(absLat),  (absLat-math.floor(absLat)) * 60)
-        self._latsign = 'N'
-        if self._latitude < 0:
-            self._latsign = 'S'
         self._longitude = lon
-        absLon = abs(lon)
-        self._longitudeTxt = "%02d%06.3f" % (math.floor(absLon),  (absLon-math.floor(absLon)) * 60)
-        self._longSign = 'E'
-        if self._longitude < 0:
-            self._longSign = 'W'
+        (self._latitudeTxt, self._latsign, self._longitudeTxt, self._longSign) = latlon(lat, lon)
 
     def _setTime(self, newtime):
         if self._shipplan:
             (self._heading, self._speed) = self._shipplan.courseAtTime(newtime - self._starttime, self)
         self._time = newtime
-        postime = time.gmtime(self._time)
-        self._timestr = "%02d%02d%02d.000" % (postime.tm_hour, postime.tm_min, postime.tm_sec)
+        self._timestr = timestamp(self._time)
 
-    def feed(self):
-        time.sleep(1.0)
-        self.nextPos()
-        sentance = "GPRMC,%s,A,%s,%s,%s,%s,%.2f,%.2f,280511,,,S" % (self._timestr, self._latitudeTxt, self._latsign, self._longitudeTxt, self._longSign, self._speed, self._heading)
+    def _fields(self):
+        "The RMC fields that follow the time stamp."
+        return ",A,%s,%s,%s,%s,%.2f,%.2f,280511,,,S" % (self._latitudeTxt, self._latsign, self._longitudeTxt, self._longSign, self._speed, self._heading)
+
+    def _reported(self):
+        "The position a receiver with this fix's noise would report."
+        (north, east, hdop, valid) = self._fix
+        lat = self._latitude + math.degrees(north / EARTH_RADIUS)
+        lon = self._longitude + math.degrees(east / (EARTH_RADIUS * math.cos(math.radians(self._latitude))))
+        return latlon(lat, lon)
+
+    def _noisyFields(self):
+        "The RMC fields after the time stamp, with noise and fix loss."
+        if not self._fix[3]:
+            return ",V,,,,,,,280511,,,N"
+        return ",A,%s,%s,%s,%s,%.2f,%.2f,280511,,,S" % (self._reported() + (self._speed, self._heading))
+
+    def _gga(self):
+        "A GGA sentence for the current fix."
+        if self._fix is None:
+            # The text fields are not kept up to date while replaying a lap
+            sentance = "GPGGA,%s,%s,%s,%s,%s,1,08,1.00,0.0,M,0.0,M,," % (
+                (self._timestr,) + latlon(self._latitude, self._longitude))
+        elif not self._fix[3]:
+            sentance = "GPGGA,%s,,,,,0,00,,,M,,M,," % self._timestr
+        else:
+            sentance = "GPGGA,%s,%s,%s,%s,%s,1,08,%.2f,0.0,M,0.0,M,," % (
+                (self._timestr,) + self._reported() + (self._fix[2],))
         calc_cksum = reduce(operator.xor, (ord(s) for s in sentance), 0)
         return "$%s*%02X\r\n" % (sentance, calc_cksum)
 
+    def feed(self):
+        time.sleep(self.period)
+        return self.step()
+
+    def close(self):
+        "Let go of anything shared with other simulators."
+        if self._sky:
+            self._sky.detach(self)
+            self._sky = None
+
+    def state(self):
+        "The simulator's time, position and course, for a checkpoint."
+        state = {"starttime": self._starttime, "time": self._time,
+                 "latitude": self._latitude, "longitude": self._longitude,
+                 "heading": self._heading, "speed": self._speed}
+        if self._noise:
+            state["noise"] = self._noise.state()
+        return state
+
+    def restore(self, state):
+        "Continue from a state() taken earlier."
+        # The plan offset is time - starttime, so this also puts the
+        # simulator back on the same leg of its plan.
+        self._starttime = state["starttime"]
+        self._time = state["time"]
+        self._timestr = timestamp(self._time)
+        self.setLatLon(state["latitude"], state["longitude"])
+        self._heading = state["heading"]
+        self._speed = state["speed"]
+        if self._noise and "noise" in state:
+            self._noise.restore(state["noise"])
+
+    def idle(self):
+        "Skip the fixes a stationary vessel would not send; return their wall-clock time."
+        policy = self._policy
+        if not policy or self._speed != 0 or self._sent is None:
+            return 0
+        # Up to the fix before the keep-alive is due...
+        skip = self._sent[4] + policy.keepalive - self._time - 1
+        plan = self._shipplan
+        if plan:
+            if not plan.isCyclic():
+                return 0
+            # ...or before the vessel leaves its stationary leg
+            offset = (self._time - self._starttime) % plan._totalLength
+            leg = bisect.bisect_right(plan._ends, offset)
+            skip = min(skip, plan._ends[leg] - 1 - offset)
+        if skip < 1:
+            return 0
+        self._time += skip
+        self._timestr = timestamp(self._time)
+        if self._noise:
+            # The skipped fixes use up their noise, so it does not
+            # depend on when the vessel happened to be parked.
+            for n in range(skip):
+                self._fix = self._noise.next()
+        return skip * self.period
+
+    def seek(self, offset):
+        "Move to a time offset into a cyclic plan, as on any lap after the first."
+        plan = self._shipplan
+        total = plan._totalLength
+        offset %= total
+        (marks, points) = plan.endpoints()
+        i = bisect.bisect_right(marks, offset) - 1
+        (lat, lon) = points[i]
+        # Pretend a full lap has passed so the start position is not
+        # reset again, then step from the nearest mark to the offset.
+        now = self._time
+        self._starttime = now - offset - total
+        self.setLatLon(lat, lon)
+        self._time = now - (offset - marks[i] + 1)
+        while self._time < now:
+            self.nextPos()
+
+    def step(self):
+        "Advance one second and return the sentence for the new position."
+        # The first lap starts from the plan start instead of one step
+        # past it, so only later laps match the rendered one.
+        if self._lap and self._time + 1 - self._starttime >= self._shipplan._totalLength:
+            line = self._replay()
+        else:
+            self.nextPos()
+            if self._noise:
+                self._fix = self._noise.next()
+                sentance = "GPRMC," + self._timestr + self._noisyFields()
+            else:
+                sentance = "GPRMC," + self._timestr + self._fields()
+            calc_cksum = reduce(operator.xor, (ord(s) for s in sentance), 0)
+            line = "$%s*%02X\r\n" % (sentance, calc_cksum)
+        if self._policy and not self._policy.changed(self):
+            return ""
+        if self._sentences != ("RMC",):
+            if "RMC" not in self._sentences:
+                line = ""
+            if "GGA" in self._sentences:
+                line += self._gga()
+            if self._sky and (not self._fix or self._fix[3]):
+                line += self._sky.sentences(self._time, self._latitude, self._longitude, self._sentences)
+        return line
+
+    def _replay(self):
+        self._time += 1
+        self._timestr = timestamp(self._time)
+        lap = self._lap
+        i = int(self._time - self._starttime) % self._shipplan._totalLength
+        self._latitude = lap.latitude[i]
+        self._longitude = lap.longitude[i]
+        self._heading = lap.heading[i]
+        self._speed = lap.speed[i]
+        calc_cksum = reduce(operator.xor, (ord(s) for s in self._timestr), lap.checksums[i])
+        return "$GPRMC,%s%s*%02X\r\n" % (self._timestr, lap.fields[i], calc_cksum)
+
     def nextPos(self):
         self._radiuskm = 6371
         self._radiusM = 6371 / 1.852
@@ -220,6 +587,24 @@ class GPSSimulator:
         lon2R = lon1R + math.atan2(math.sin(brng)*math.sin(dist_deg)*math.cos(lat1R), math.cos(dist_deg)-math.sin(lat1R)*math.sin(lat2R))
         lon2R = (lon2R+3*math.pi) % (2*math.pi) - math.pi
         self.setLatLon( math.degrees(lat2R), math.degrees(lon2R))
+
+def latlon(lat, lon):
+    "NMEA (latitude, N/S, longitude, E/W) fields for a position in degrees."
+    absLat = abs(lat)
+    absLon = abs(lon)
+    latsign = 'N'
+    if lat < 0:
+        latsign = 'S'
+    lonsign = 'E'
+    if lon < 0:
+        lonsign = 'W'
+    return ("%02d%06.3f" % (math.floor(absLat),  (absLat-math.floor(absLat)) * 60), latsign,
+            "%02d%06.3f" % (math.floor(absLon),  (absLon-math.floor(absLon)) * 60), lonsign)
+
+def timestamp(when):
+    "NMEA hhmmss.sss time field for a Unix time."
+    secs = int(when) % 86400
+    return "%02d%02d%02d.000" % (secs // 3600, secs // 60 % 60, secs % 60)
     
 class ShipPlan:
     def __init__(self, latitude=0.0, longitude=0.0):
@@ -227,35 +612,213 @@ class ShipPlan:
         self._totalLength = 0
         self.startlatitude = latitude
         self.startlongitude = longitude
+        self._ends = []         # Cumulative end times of the legs
+        self._open = None       # Index of the first open-ended leg
+        self._endpoints = None
 
     def addLeg(self, length, course, speed):
         self._legs.append([length, course, speed])
         self._totalLength += length
+        if self._open is None:
+            if length < 0:
+                self._open = len(self._legs) - 1
+            elif self._ends:
+                self._ends.append(self._ends[-1] + length)
+            else:
+                self._ends.append(length)
+        self._endpoints = None
+
+    def isCyclic(self):
+        "True if the plan has no open-ended leg, so it repeats."
+        return len(self._legs) > 0 and min(leg[0] for leg in self._legs) > 0
+
+    def signature(self):
+        "A digest identifying the legs and start position of the plan."
+        legs = [(int(length), float(course), float(speed)) for (length, course, speed) in self._legs]
+        return hashlib.sha1(repr((legs, float(self.startlatitude), float(self.startlongitude)))).hexdigest()
 
     def courseAtTime(self, when, sim=None):
         when = when % self._totalLength
         if when == 0 and sim:
             sim.setLatLon(self.startlatitude, self.startlongitude)
-        totalLength = 0
-        for (length, course, speed) in self._legs:
-            if length < 0:
-                return (course,speed)
-            totalLength += length
-            if(when < totalLength):
-                return (course,speed)
+        leg = bisect.bisect_right(self._ends, when)
+        if leg < len(self._ends):
+            (length, course, speed) = self._legs[leg]
+        elif self._open is not None:
+            (length, course, speed) = self._legs[self._open]
+        else:
+            (length, course, speed) = self._legs[-1]
         return (course,speed)
 
+    def endpoints(self):
+        "Steady-state positions where the legs of a cyclic plan begin."
+        # Returns (marks, points): points[i] is where the simulator is
+        # as the second at offset marks[i] begins.  Besides the leg
+        # boundaries there is a mark every ENDPOINT_STRIDE seconds, so
+        # GPSSimulator.seek() never has far to step.
+        if self._endpoints is None:
+            marks = sorted(set(self._ends[:-1]) |
+                           set(range(0, self._totalLength, ENDPOINT_STRIDE)))
+            points = []
+            # Stepped as in RenderedLap.render()
+            sim = GPSSimulator(currtime=-1, shipplan=self)
+            sim._starttime = 0
+            for mark in marks:
+                if mark == 0:
+                    points.append((self.startlatitude, self.startlongitude))
+                    continue
+                while sim._time < mark - 1:
+                    sim.nextPos()
+                points.append((sim._latitude, sim._longitude))
+            self._endpoints = (marks, points)
+        return self._endpoints
+
+# Seconds between the positions ShipPlan.endpoints() precomputes
+ENDPOINT_STRIDE = 16
+
+BUILTIN_START = (58.1388066666, 11.83308166666)
+BUILTIN_LEGS = (
+    # (length, course, speed)
+    (50, 180, 5.0),
+    (103, 134, 8.0),
+    (40, 107, 10.0),
+    (4, 107, 5.0),
+    (8, 107, 2.5),
+    (2, 10, 0.0),
+    (54, 289, 8.0),
+    (105, 316, 8.0),
+    (22, 354, 8.0),
+    (4, 354, 4.0),
+    (2, 354, 2.0),
+    (2, 354, 1.0),
+    (1, 348, 0.0),
+    )
+
+_builtin_plan = None
+
+def builtin_plan():
+    "The round trip the simulator sails when no scenario is given."
+    global _builtin_plan
+    if _builtin_plan is None:
+        plan = ShipPlan(latitude=BUILTIN_START[0], longitude=BUILTIN_START[1])
+        for (length, course, speed) in BUILTIN_LEGS:
+            plan.addLeg(length=length, course=course, speed=speed)
+        _builtin_plan = plan
+    return _builtin_plan
+
+class RenderedLap:
+    "One lap of a cyclic ShipPlan, pre-rendered as RMC sentences."
+    def __init__(self, plan=None):
+        self.fields = []                    # Sentence text after the time stamp
+        self.checksums = array.array('B')   # XOR over "GPRMC," and the fields
+        self.latitude = array.array('d')
+        self.longitude = array.array('d')
+        self.heading = array.array('d')
+        self.speed = array.array('d')
+        if plan:
+            self.render(plan)
+
+    def render(self, plan):
+        "Step a scratch simulator through one steady-state lap of the plan."
+        # Started one second before a lap boundary, the simulator is
+        # reset to the plan start and stepped, as on every later lap.
+        sim = GPSSimulator(currtime=-1, shipplan=plan)
+        sim._starttime = 0
+        head = reduce(operator.xor, (ord(s) for s in "GPRMC,"), 0)
+        for i in range(plan._totalLength):
+            sim.nextPos()
+            fields = sim._fields()
+            self.fields.append(fields)
+            self.checksums.append(reduce(operator.xor, (ord(s) for s in fields), head))
+            self.latitude.append(sim._latitude)
+            self.longitude.append(sim._longitude)
+            self.heading.append(sim._heading)
+            self.speed.append(sim._speed)
+
+    def dump(self, fp):
+        cPickle.dump((self.fields, self.checksums.tostring(),
+                      self.latitude.tostring(), self.longitude.tostring(),
+                      self.heading.tostring(), self.speed.tostring()),
+                     fp, cPickle.HIGHEST_PROTOCOL)
+
+    def load(self, fp):
+        (self.fields, checksums, latitude, longitude, heading, speed) = cPickle.load(fp)
+        self.checksums.fromstring(checksums)
+        self.latitude.fromstring(latitude)
+        self.longitude.fromstring(longitude)
+        self.heading.fromstring(heading)
+        self.speed.fromstring(speed)
+
+class SentenceCache:
+    "Rendered laps of cyclic ShipPlans, kept in memory and optionally on disk."
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.laps = {}
+
+    def path(self, plan):
+        return os.path.join(self.directory, "nmeafake-%s.lap" % plan.signature())
+
+    def lap(self, plan):
+        "Return the rendered lap for a plan, rendering it only if needed."
+        key = plan.signature()
+        if key in self.laps:
+            return self.laps[key]
+        lap = None
+        if self.directory:
+            try:
+                fp = open(self.path(plan), "rb")
+                try:
+                    lap = RenderedLap()
+                    lap.load(fp)
+                finally:
+                    fp.close()
+            except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+                lap = None
+        if lap is None:
+            lap = RenderedLap(plan)
+            if self.directory:
+                # Write to a temporary name so readers never see a partial file
+                tmp = self.path(plan) + ".%d" % os.getpid()
+                fp = open(tmp, "wb")
+                try:
+                    lap.dump(fp)
+                finally:
+                    fp.close()
+                os.rename(tmp, self.path(plan))
+        self.laps[key] = lap
+        return lap
+
 class FakeLogGPS:
     def __init__(self, testload, progress=None):
         self.testload = testload
         self.progress = progress
+        self.period = WRITE_PAD     # Wall-clock seconds between lines
         self.go_predicate = lambda: True
         self.readers = 0
         self.index = 0
-        self.progress("gpsfake: %s provides %d sentences\n" % (self.testload.name, len(self.testload.sentences)))
+        if self.progress:
+            self.progress("gpsfake: %s provides %d sentences\n" % (self.testload.name, len(self.testload.sentences)))
 
     def feed(self):
         "Feed a line from the contents of the GPS log to the daemon."
+        line = self.step()
+        time.sleep(WRITE_PAD)
+        return line
+
+    def idle(self):
+        "A log has something to send every time."
+        return 0
+
+    def state(self):
+        "The position in the log, for a checkpoint."
+        return {"index": self.index}
+
+    def restore(self, state):
+        "Continue from a state() taken earlier."
+        self.index = state["index"]
+
+    def step(self):
+        "Return the next line of the GPS log, without the pause after it."
         line = self.testload.sentences[self.index % len(self.testload.sentences)]
         if "%Delay:" in line:
             # Delay specified number of seconds
@@ -265,10 +828,51 @@ class FakeLogGPS:
         #self.write(line)
         if self.progress:
             self.progress("gpsfake: %s feeds %d=%s\n" % (self.testload.name, len(line), `line`))
-        time.sleep(WRITE_PAD)
         self.index += 1
         return line
 
+def split_sentences(line):
+    "The sentences in what a fake GPS wrote in one go."
+    if not line:
+        return []
+    if line.startswith(("$", "!")):
+        return line.splitlines(True)
+    # Binary packets may hold line ends of their own
+    return [line]
+
+def _deliver(device, line, start, report=True):
+    "Write a line a fake GPS produced, and tell its observers about it."
+    # start is when the device began producing the line, if anyone
+    # is timing it
+    if start is None:
+        device.write(line)
+    else:
+        wrote = time.time()
+        device.write(line)
+        done = time.time()
+        if device.stats:
+            device.stats.emitted(len(line), start, wrote, done,
+                                 len(split_sentences(line)))
+        if device.timers:
+            device.timers.add("feed", wrote - start)
+            device.timers.add("write", done - wrote)
+    if report:
+        _report(device, line)
+    return line
+
+def _report(device, line):
+    "Tell a fake GPS's observers it has sent line."
+    if device.latency or device.trace or device.ring:
+        # A simulator's epoch may hold several sentences; clients see
+        # them one at a time, so that is how they are reported.
+        for sentence in split_sentences(line):
+            if device.latency:
+                device.latency.emitted(device.byname, sentence, time.time())
+            if device.trace:
+                device.trace.record(tracer.EVENT_FEED, device.tid, len(sentence))
+            if device.ring:
+                device.ring.write(sentence, device.rid)
+
 class FakePTY:
     "A FakePTY is a pty with a test log ready to be cycled to it."
     def __init__(self, gpsSimulator,
@@ -277,6 +881,13 @@ class FakePTY:
         # Allow Serial: header to be overridden by explicit spped.
         self.index=0
         self._gpsSimulator = gpsSimulator
+        self.stats = None       # metrics.DeviceStats, if the session keeps them
+        self.trace = None       # tracer.TraceBuffer, if the session keeps one
+        self.tid = 0
+        self.latency = None     # latency.LatencyHarness, if the session has one
+        self.ring = None        # ring.RingWriter, if the session has one
+        self.rid = 0
+        self.timers = None      # profiler.Timers, if the session is profiled
         #if self._gpsSimulator.testload.serial:
         #            (speed, databits, parity, stopbits) = self._gpsSimulator.testload.serial
         self.speed = speed
@@ -345,32 +956,251 @@ class FakePTY:
     def drain(self):
         "Wait for the associated device to drain (e.g. before closing)."
         termios.tcdrain(self.fd)
-    def feed(self):
-        line = self._gpsSimulator.feed()
-        self.write(line)
-        return line
+    def state(self):
+        return self._gpsSimulator.state()
+    def restore(self, state):
+        self._gpsSimulator.restore(state)
+    def feed(self, paced=True):
+        "Write the next sentence; unless paced, without the simulator's pause."
+        start = None
+        if self.stats or self.timers:
+            start = time.time()
+        if paced:
+            line = self._gpsSimulator.feed()
+        else:
+            line = self._gpsSimulator.step()
+        if not line:
+            if self.stats:
+                self.stats.skipped(self.stats.period)
+            return line
+        return _deliver(self, line, start)
+    def idle(self):
+        "Seconds until the fake GPS has something to send."
+        return self._gpsSimulator.idle()
 
 class FakeUDP(FakeLogGPS):
     "A UDP broadcaster with a test log ready to be cycled to it."
     def __init__(self, testload,
                  ipaddr, port,
-                 progress=None):
+                 progress=None,
+                 ttl=1, broadcast=False, sndbuf=None, pack=1):
         FakeLogGPS.__init__(self, testload, progress)
         self.ipaddr = ipaddr
         self.port = port
         self.byname = "udp://" + ipaddr + ":" + port
+        self.address = (ipaddr, int(port))
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if multicast(ipaddr):
+            # One datagram to the group reaches every listener in it
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if broadcast:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if sndbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        self.pack = pack        # Sentences sent per datagram
+        self.pending = []
+        self.size = 0
+        self.queued = 0         # When the oldest pending sentence was queued
+        self.stats = None
+        self.trace = None
+        self.tid = 0
+        self.latency = None
+        self.ring = None
+        self.rid = 0
+        self.timers = None
 
     def read(self):
-        "Discard control strings written by gpsd."
-        pass
+        "Discard control strings written by gpsd, and send sentences kept waiting."
+        if self.pending and time.time() - self.queued >= PACK_WAIT:
+            self.flush()
 
     def write(self, line):
-        self.sock.sendto(line, (self.ipaddr, int(self.port)))
+        if self.pack <= 1:
+            self.sock.sendto(line, self.address)
+            return
+        if self.size + len(line) > MAX_DATAGRAM:
+            self.flush()
+        if not self.pending:
+            self.queued = time.time()
+        self.pending.append(line)
+        self.size += len(line)
+        if len(self.pending) >= self.pack or time.time() - self.queued >= PACK_WAIT:
+            self.flush()
+
+    def flush(self):
+        "Send the sentences packed so far as one datagram."
+        if self.pending:
+            self.sock.sendto("".join(self.pending), self.address)
+            # Packed sentences count as sent when the datagram goes
+            for line in self.pending:
+                _report(self, line)
+            self.pending = []
+            self.size = 0
+
+    def feed(self, paced=True):
+        "Send the next line of the log as a datagram."
+        start = None
+        if self.stats or self.timers:
+            start = time.time()
+        if paced:
+            line = FakeLogGPS.feed(self)
+        else:
+            line = FakeLogGPS.step(self)
+        return _deliver(self, line, start, self.pack <= 1)
 
     def drain(self):
         "Wait for the associated device to drain (e.g. before closing)."
-        pass	# shutdown() fails on UDP
+        self.flush()	# shutdown() fails on UDP
+
+class TCPSubscriber:
+    "One connection to a FakeTCP, and the bytes it has yet to be sent."
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.queue = collections.deque()    # Shared strings, oldest first
+        self.offset = 0                     # Bytes of queue[0] already sent
+        self.backlog = 0                    # Bytes queued and not yet sent
+
+    def send(self):
+        "Send as much of the queue as the socket takes without blocking."
+        queue = self.queue
+        while queue:
+            if len(queue) > 1 and len(queue[0]) - self.offset < TCP_COALESCE:
+                # Catch up on small sentences a few at a time; the copy
+                # is bounded, larger strings are sent from where they are
+                parts = [queue.popleft()[self.offset:]]
+                size = len(parts[0])
+                while queue and size + len(queue[0]) <= TCP_COALESCE:
+                    size += len(queue[0])
+                    parts.append(queue.popleft())
+                queue.appendleft("".join(parts))
+                self.offset = 0
+            try:
+                n = self.sock.send(buffer(queue[0], self.offset))
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                return False
+            self.backlog -= n
+            self.offset += n
+            if self.offset == len(queue[0]):
+                queue.popleft()
+                self.offset = 0
+        return True
+
+class FakeTCP:
+    "A TCP server with a test log ready to be cycled to all its subscribers."
+    def __init__(self, gpsSimulator, ipaddr="127.0.0.1", port=0, backlog=TCP_BACKLOG):
+        self.index = 0
+        self._gpsSimulator = gpsSimulator
+        self.limit = backlog    # Bytes a subscriber may fall behind by
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((ipaddr, int(port)))
+        self.listener.listen(64)
+        self.listener.setblocking(0)
+        self.ipaddr = ipaddr
+        self.port = self.listener.getsockname()[1]
+        self.byname = "tcp://%s:%d" % (ipaddr, self.port)
+        self.subscribers = []
+        self.dropped = 0        # Subscribers dropped for falling behind
+        self.stats = None
+        self.trace = None
+        self.tid = 0
+        self.latency = None
+        self.ring = None
+        self.rid = 0
+        self.timers = None
+
+    def accept(self):
+        "Take on any subscribers waiting to connect."
+        while True:
+            try:
+                (sock, address) = self.listener.accept()
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.subscribers.append(TCPSubscriber(sock, address))
+
+    def drop(self, subscriber):
+        "Disconnect a subscriber, discarding what it has not been sent."
+        subscriber.sock.close()
+        self.subscribers.remove(subscriber)
+        if subscriber.backlog:
+            if self.stats:
+                self.stats.dropped()
+            if self.trace:
+                self.trace.record(tracer.EVENT_DROP, self.tid, subscriber.backlog)
+
+    def read(self):
+        "Take on new subscribers and discard what the subscribers send."
+        self.accept()
+        for subscriber in self.subscribers[:]:
+            try:
+                if not subscriber.sock.recv(65536):
+                    self.drop(subscriber)
+            except socket.error, e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.drop(subscriber)
+
+    def write(self, line):
+        "Queue the one copy of a line to every subscriber and send what fits."
+        self.accept()
+        for subscriber in self.subscribers[:]:
+            subscriber.queue.append(line)
+            subscriber.backlog += len(line)
+            if not subscriber.send():
+                self.drop(subscriber)
+            elif subscriber.backlog > self.limit:
+                self.dropped += 1
+                self.drop(subscriber)
+
+    def drain(self):
+        "Wait for the subscribers to be sent what they have queued."
+        deadline = time.time() + CLOSE_DELAY
+        while time.time() < deadline:
+            waiting = [s for s in self.subscribers if s.queue]
+            if not waiting:
+                break
+            select.select([], [s.sock for s in waiting], [], deadline - time.time())
+            for subscriber in waiting:
+                if not subscriber.send():
+                    self.drop(subscriber)
+
+    def state(self):
+        return self._gpsSimulator.state()
+
+    def restore(self, state):
+        self._gpsSimulator.restore(state)
+
+    def close(self):
+        "Disconnect every subscriber and stop listening."
+        for subscriber in self.subscribers:
+            subscriber.sock.close()
+        self.subscribers = []
+        self.listener.close()
+
+    def feed(self, paced=True):
+        "Send the next sentence to the subscribers."
+        start = None
+        if self.stats or self.timers:
+            start = time.time()
+        if paced:
+            line = self._gpsSimulator.feed()
+        else:
+            line = self._gpsSimulator.step()
+        if not line:
+            if self.stats:
+                self.stats.skipped(self.stats.period)
+            return line
+        return _deliver(self, line, start)
+    def idle(self):
+        "Seconds until the fake GPS has something to send."
+        return self._gpsSimulator.idle()
 
 class DaemonError(exceptions.Exception):
     def __init__(self, msg):
@@ -488,9 +1318,34 @@ class TestSessionError(exceptions.Exception):
     def __init__(self, msg):
         self.msg = msg
 
+def udp_sink(spec):
+    "Parse host[:port][,option=value...] into TestSession udpsink options."
+    fields = spec.split(",")
+    sink = {}
+    if fields[0]:
+        address = fields[0].split(":")
+        sink["ipaddr"] = address[0]
+        if len(address) > 1:
+            try:
+                sink["port"] = int(address[1])
+            except ValueError:
+                raise TestSessionError("bad UDP sink port %s" % address[1])
+    for field in fields[1:]:
+        (name, eq, value) = field.partition("=")
+        if name == "broadcast":
+            sink[name] = value.lower() not in ("0", "false", "no")
+        elif name in ("ttl", "sndbuf", "pack", "stride"):
+            try:
+                sink[name] = int(value)
+            except ValueError:
+                raise TestSessionError("bad UDP sink option %s" % field)
+        else:
+            raise TestSessionError("unknown UDP sink option %s" % name)
+    return sink
+
 class TestSession:
     "Manage a session including a daemon with fake GPSes and clients."
-    def __init__(self, prefix=None, port=None, options=None, verbose=0, predump=True, udp=False, simulator=False):
+    def __init__(self, prefix=None, port=None, options=None, verbose=0, predump=True, udp=False, simulator=False, cache=None, metrics=None, trace=None, capture=None, latency=None, workers=1, tcp=False, udpsink=None, ring=None, checkpoint=None, profiler=None, policy=None, traffic=None):
         "Initialize the test session by launching the daemon."
         self.prefix = prefix
         self.port = port
@@ -498,14 +1353,34 @@ class TestSession:
         self.verbose = verbose
         self.predump = predump
         self.udp = udp
+        self.tcp = tcp              # Serve fake GPSes over TCP instead of ptys
+        self.udpsink = udpsink      # FakeUDP address and options, see udp_sink()
+        self.udpcount = 0
+        self.ring = ring            # ring.RingWriter all fake GPSes also write to, or None
+        self.checkpoint = checkpoint    # checkpoint.Checkpointer, or None
+        self.registered = 0         # Fake GPSes ever added, to key checkpoints by
+        self.profiler = None        # profiler.Profiler, or None
+        self.timers = None
         self.daemon = DaemonInstance()
         self.fakegpslist = {}
         self.client_id = 0
         self.readers = 0
         self.writers = 0
         self.runqueue = []
+        self.rotation = []          # The part of the runqueue not parked
+        self.parked = []            # Heap of (wake time, count, fake GPS)
+        self.parks = 0
         self.index = 0
         self._simulator = simulator
+        self.policy = policy        # EmissionPolicy for simulated GPSes, or None
+        self.cache = cache          # SentenceCache for simulated GPSes
+        self.metrics = metrics      # metrics.SessionMetrics, or None
+        self.trace = trace          # tracer.TraceBuffer, or None
+        self.capture = capture      # capture.CaptureWriter for client reports, or None
+        self.latency = latency      # latency.LatencyHarness, or None
+        self.workers = workers      # Processes to frame large logs with
+        self.echoes = 0             # Sentences clients have read back
+        self.traffic = traffic      # traffic.VesselIndex of scenario vessels, or None
         if port:
             self.port = port
         else:
@@ -515,6 +1390,8 @@ class TestSession:
         self.default_predicate = None
         self.fd_set = []
         self.threadlock = None
+        if profiler:
+            self.set_profiler(profiler)
     def spawn(self):
         for sig in (signal.SIGQUIT, signal.SIGINT, signal.SIGTERM):
             signal.signal(sig, lambda signal, frame: self.cleanup())
@@ -527,53 +1404,117 @@ class TestSession:
         "Add a simulated GPS being fed by the specified logfile."
         self.progress("gpsfake: gps_add(%s, %d)\n" % (logfile, speed))
         if logfile not in self.fakegpslist:
-            testload = TestLoad(logfile, predump=self.predump)
+            testload = TestLoad(logfile, predump=self.predump, workers=self.workers)
+            # Per-sentence progress strings are only worth building
+            # when someone reads them; the trace covers the rest.
+            progress = None
+            if self.verbose:
+                progress = self.progress
             if testload.sourcetype == "UDP" or self.udp:
-                newgps = FakeUDP(testload, ipaddr="127.0.0.1", port="5000",
-                                   progress=self.progress)
-            elif self._simulator:
-                plan = ShipPlan(latitude=58.1388066666, longitude=11.83308166666 )
-                plan.addLeg(length=50, course=180, speed=5.0)
-                plan.addLeg(length=103, course=134, speed=8.0)
-                plan.addLeg(length=40, course=107, speed=10.0)
-                plan.addLeg(length=4, course=107, speed=5.0)
-                plan.addLeg(length=8, course=107, speed=2.5)
-                plan.addLeg(length=2, course=10, speed=0.0)
-                plan.addLeg(length=54, course=289, speed=8.0)
-                plan.addLeg(length=105, course=316, speed=8.0)
-                plan.addLeg(length=22, course=354, speed=8.0)
-                plan.addLeg(length=4, course=354, speed=4.0)
-                plan.addLeg(length=2, course=354, speed=2.0)
-                plan.addLeg(length=2, course=354, speed=1.0)
-                plan.addLeg(length=1, course=348, speed=0.0)
-                gpsSim = GPSSimulator(currtime=1330759883, shipplan=plan)
-                newgps = FakePTY(gpsSim, speed=speed)
+                options = dict(self.udpsink or {})
+                ipaddr = options.pop("ipaddr", "127.0.0.1")
+                # With a stride each device gets its own port
+                port = int(options.pop("port", 5000)) + options.pop("stride", 0) * self.udpcount
+                newgps = FakeUDP(testload, ipaddr=ipaddr, port=str(port),
+                                   progress=progress, **options)
+                self.udpcount += 1
             else:
-                gpsSim = FakeLogGPS(testload, progress=self.progress)
-                newgps = FakePTY(gpsSim, speed=speed)
-            if pred:
-                newgps.go_predicate = pred
-            elif self.default_predicate:
-                newgps.go_predicate = self.default_predicate
-            self.fakegpslist[newgps.byname] = newgps
-            self.append(newgps)
-            newgps.exhausted = 0
+                if self._simulator:
+                    gpsSim = GPSSimulator(currtime=1330759883, shipplan=builtin_plan(), cache=self.cache, policy=self.policy)
+                else:
+                    gpsSim = FakeLogGPS(testload, progress=progress)
+                if testload.sourcetype == "TCP" or self.tcp:
+                    newgps = FakeTCP(gpsSim)
+                else:
+                    newgps = FakePTY(gpsSim, speed=speed)
+            self.__register(newgps, pred, logfile)
         self.daemon.add_device(newgps.byname)
         return newgps.byname
+    def merge_add(self, logfiles, speed=19200, pred=None):
+        "Add one simulated GPS replaying several logfiles in timestamp order."
+        self.progress("gpsfake: merge_add(%s, %d)\n" % (",".join(logfiles), speed))
+        merged = MergedLoad([TestLoad(logfile, predump=self.predump, workers=self.workers)
+                             for logfile in logfiles])
+        progress = None
+        if self.verbose:
+            progress = self.progress
+        newgps = FakePTY(FakeLogGPS(merged, progress=progress), speed=speed)
+        self.__register(newgps, pred, merged.name)
+        self.daemon.add_device(newgps.byname)
+        return newgps.byname
+    def scenario_add(self, path, speed=19200, pred=None):
+        "Add a simulated GPS for every vessel in a scenario file."
+        import scenario
+        self.progress("gpsfake: scenario_add(%s)\n" % path)
+        names = []
+        for (vessel, gpsSim) in scenario.load(path).simulators(cache=self.cache, policy=self.policy):
+            newgps = FakePTY(gpsSim, speed=speed)
+            newgps.vessel = vessel
+            self.__register(newgps, pred, "%s:%s" % (path, vessel))
+            if self.traffic:
+                self.traffic.add(newgps.byname, gpsSim)
+            self.daemon.add_device(newgps.byname)
+            names.append(newgps.byname)
+        return names
+    def __register(self, newgps, pred, source):
+        "Put a new fake GPS in the run queue."
+        newgps.key = "%d:%s" % (self.registered, source)
+        self.registered += 1
+        if pred:
+            newgps.go_predicate = pred
+        elif self.default_predicate:
+            newgps.go_predicate = self.default_predicate
+        if self.metrics:
+            source = getattr(newgps, "_gpsSimulator", newgps)
+            newgps.stats = self.metrics.device(newgps.byname, source.period)
+        if self.trace:
+            newgps.trace = self.trace
+            newgps.tid = self.trace.device(newgps.byname)
+            self.trace.record(tracer.EVENT_ADD, newgps.tid)
+        self.fakegpslist[newgps.byname] = newgps
+        self.append(newgps)
+        newgps.exhausted = 0
+        if self.latency:
+            newgps.latency = self.latency
+            self.latency.level = len(self.fakegpslist)
+        if self.ring:
+            newgps.ring = self.ring
+            newgps.rid = self.ring.device(newgps.byname)
+        newgps.timers = self.timers
     def gps_remove(self, name):
         "Remove a simulated GPS from the daemon's search list."
         self.progress("gpsfake: gps_remove(%s)\n" % name)
         self.fakegpslist[name].drain()
+        if self.trace:
+            self.trace.record(tracer.EVENT_REMOVE, self.fakegpslist[name].tid)
         self.remove(self.fakegpslist[name])
         self.daemon.remove_device(name)
+        if isinstance(self.fakegpslist[name], FakeTCP):
+            self.fakegpslist[name].close()
+        source = getattr(self.fakegpslist[name], "_gpsSimulator", None)
+        if isinstance(source, GPSSimulator):
+            source.close()
+            if self.traffic and name in self.traffic.slots:
+                self.traffic.remove(name)
         del self.fakegpslist[name]
+        if self.latency:
+            self.latency.level = len(self.fakegpslist)
     def client_add(self, commands):
         "Initiate a client session and force connection to a fake GPS."
         self.progress("gpsfake: client_add()\n")
-        newclient = gps.gps(port=self.port, verbose=self.verbose)
+        newclient = gps.gps(port=self.port, verbose=self.verbose, recorder=self.capture)
         self.append(newclient)
         newclient.id = self.client_id + 1 
         self.client_id += 1
+        newclient.commands = commands
+        newclient.timers = self.timers
+        newclient.stats = None
+        if self.metrics:
+            newclient.stats = self.metrics.client(newclient.id)
+        newclient.tid = 0
+        if self.trace:
+            newclient.tid = self.trace.device("client%d" % newclient.id)
+            self.trace.record(tracer.EVENT_ADD, newclient.tid)
         self.progress("gpsfake: client %d has %s\n" % (self.client_id,newclient.device))
         if commands:
             self.initialize(newclient, commands) 
@@ -583,6 +1524,8 @@ class TestSession:
         self.progress("gpsfake: client_remove(%d)\n" % cid)
         for obj in self.runqueue:
             if isinstance(obj, gps.gps) and obj.id == cid:
+                if self.trace:
+                    self.trace.record(tracer.EVENT_REMOVE, obj.tid)
                 self.remove(obj)
                 return True
         else:
@@ -602,6 +1545,18 @@ class TestSession:
         "We're done, kill the daemon."
         self.progress("gpsfake: cleanup()\n")
         if self.daemon:
+            if self.metrics:
+                if self.metrics.interval:
+                    self.metrics.dump()
+                self.metrics.shutdown()
+            if self.latency:
+                self.latency.dump()
+            if self.checkpoint:
+                self.checkpoint.save(self)
+            if self.profiler:
+                self.profiler.save()
+                self.profiler.report()
+                self.timers.dump()
             self.daemon.kill()
             self.daemon = None
     def run(self):
@@ -609,35 +1564,51 @@ class TestSession:
         try:
             self.progress("gpsfake: test loop begins\n")
             while self.daemon:
+                if self.parked:
+                    if len(self.rotation) == self.readers:
+                        # Every fake GPS is parked; wait for one to wake
+                        # or for a client to have something to read.
+                        wait = self.parked[0][0] - time.time()
+                        if wait > 0:
+                            select.select([client.sock for client in self.rotation], [], [], wait)
+                    self.wake()
+                    if not self.rotation:
+                        continue
                 # We have to read anything that gpsd might have tried
                 # to send to the GPS here -- under OpenBSD the
                 # TIOCDRAIN will hang, otherwise.
-                for device in self.runqueue:
-                    if isinstance(device, FakeLogGPS):
+                for device in self.rotation:
+                    if isinstance(device, (FakeLogGPS, FakeTCP)):
                         device.read()
                 had_output = False
                 chosen = self.choose()
-                if isinstance(chosen, FakePTY):
+                if isinstance(chosen, (FakePTY, FakeUDP, FakeTCP)):
                     if chosen.exhausted and (time.time() - chosen.exhausted > CLOSE_DELAY):
                         self.gps_remove(chosen.byname)
                         self.progress("gpsfake: GPS %s removed\n" % chosen.byname)
                     elif not chosen.go_predicate(chosen.index, chosen):
                         if chosen.exhausted == 0:
                             chosen.exhausted = time.time()
+                            if self.trace:
+                                self.trace.record(tracer.EVENT_EXHAUSTED, chosen.tid)
                             self.progress("gpsfake: GPS %s ran out of input\n" % chosen.byname)
                     else:
                         chosen.feed()
+                        idle = chosen.idle()
+                        if idle:
+                            if chosen.stats:
+                                chosen.stats.skipped(idle)
+                            self.park(chosen, time.time() + idle)
                 elif isinstance(chosen, gps.gps):
-                    if chosen.enqueued:
-                        chosen.send(chosen.enqueued)
-                        chosen.enqueued = ""
-                    while chosen.waiting():
-                        chosen.poll()
-                        if chosen.valid & gps.PACKET_SET:
-                            self.reporter(chosen.response)
-                        had_output = True
+                    had_output = self.service(chosen)
                 else:
                     raise TestSessionError("test object of unknown type")
+                if self.metrics:
+                    self.metrics.tick()
+                if self.traffic:
+                    self.traffic.tick()
+                if self.checkpoint:
+                    self.checkpoint.tick(self)
                 if not self.writers and not had_output:
                     self.progress("gpsfake: no writers %s and no output %s\n"
                             %(self.writers, had_output))
@@ -645,6 +1616,135 @@ class TestSession:
             self.progress("gpsfake: test loop ends\n")
         finally:
             self.cleanup()
+    def set_profiler(self, profiler):
+        "Profile the session, and time the parts of the run loop."
+        self.profiler = profiler
+        self.timers = profiler.timers
+        for obj in self.runqueue:
+            obj.timers = self.timers
+    def snapshot(self):
+        "The state of the fake GPSes and clients, for a checkpoint."
+        devices = {}
+        clients = []
+        for obj in self.runqueue:
+            if isinstance(obj, (FakePTY, FakeUDP, FakeTCP)):
+                devices[obj.key] = obj.state()
+            elif isinstance(obj, gps.gps):
+                clients.append(obj.commands)
+        return {"devices": devices, "clients": clients}
+    def restore(self, state):
+        "Resume the fake GPSes and clients from a snapshot(); return devices restored."
+        restored = 0
+        commands = []
+        for obj in self.runqueue:
+            if isinstance(obj, (FakePTY, FakeUDP, FakeTCP)):
+                if obj.key in state["devices"]:
+                    obj.restore(state["devices"][obj.key])
+                    restored += 1
+                else:
+                    self.progress("gpsfake: no checkpoint for %s\n" % obj.key)
+            elif isinstance(obj, gps.gps):
+                commands.append(obj.commands)
+        # Start the clients the session does not have yet
+        for client in state["clients"]:
+            if client in commands:
+                commands.remove(client)
+            else:
+                self.client_add(client)
+        return restored
+    def service(self, client):
+        "Send a client its queued commands and read what it has waiting."
+        had_output = False
+        if client.enqueued:
+            client.send(client.enqueued)
+            client.enqueued = ""
+        while client.waiting():
+            before = getattr(client, "response", None)
+            if client.stats or self.timers:
+                start = time.time()
+                status = client.poll()
+                done = time.time()
+                if self.timers:
+                    self.timers.add("poll", done - start)
+            else:
+                status = client.poll()
+            # Only part of a line has come in, or the daemon has gone;
+            # either way the response is still the last one.
+            if status < 0 or client.response is before:
+                break
+            if client.stats:
+                client.stats.polled(client.response, start, done)
+            if self.latency:
+                self.latency.received(client.response, time.time())
+            if self.trace:
+                self.trace.record(tracer.EVENT_POLL, client.tid, len(client.response))
+            if client.response.startswith(("$", "!")):
+                self.echoes += 1
+            if client.valid & gps.PACKET_SET:
+                self.reporter(client.response)
+            had_output = True
+        return had_output
+    def ramp(self, ramp):
+        "Step the sentence rate over the fake GPSes up until the clients fall behind."
+        devices = [obj for obj in self.runqueue if isinstance(obj, (FakePTY, FakeUDP, FakeTCP))]
+        clients = [obj for obj in self.runqueue if isinstance(obj, gps.gps)]
+        if not devices or not clients:
+            raise TestSessionError("a ramp needs fake GPSes and clients")
+        sockets = [client.sock for client in clients]
+        try:
+            self.progress("gpsfake: ramp begins\n")
+            for rate in ramp.rates():
+                if self.latency:
+                    self.latency.level = rate
+                period = len(devices) / rate
+                now = time.time()
+                # Stagger the devices over a period to spread the load
+                # evenly; the list is in due order, so already a heap.
+                due = [(now + n * period / len(devices), n) for n in range(len(devices))]
+                for (when, n) in due:
+                    if devices[n].stats:
+                        devices[n].stats.reschedule(when, period)
+                measure = now + ramp.settle
+                end = measure + ramp.dwell
+                emitted = 0
+                mark = None
+                while self.daemon:
+                    now = time.time()
+                    if mark is None and now >= measure:
+                        mark = (emitted, self.echoes, now)
+                    if now >= end:
+                        break
+                    (when, n) = due[0]
+                    wait = min(when, end, mark is None and measure or end) - now
+                    # Clients are read on every turn, or they would fall
+                    # behind whenever the devices do.
+                    select.select(sockets, [], [], max(wait, 0))
+                    for client in clients:
+                        self.service(client)
+                    for device in devices:
+                        if isinstance(device, (FakeLogGPS, FakeTCP)):
+                            device.read()
+                    if when <= time.time():
+                        emitted += len(split_sentences(devices[n].feed(False)))
+                        heapq.heapreplace(due, (when + period, n))
+                    if self.metrics:
+                        self.metrics.tick()
+                    if self.traffic:
+                        self.traffic.tick()
+                    if self.checkpoint:
+                        self.checkpoint.tick(self)
+                if not self.daemon or mark is None:
+                    break
+                latency = None
+                if self.latency:
+                    latency = self.latency.report().get(rate, {}).get("all")
+                level = ramp.record(rate, emitted - mark[0], self.echoes - mark[1],
+                                    now - mark[2], latency)
+                self.progress("gpsfake: ramp %.1f/s received %.1f/s\n"
+                              % (rate, level["received"]))
+            self.progress("gpsfake: ramp ends\n")
+        finally:
+            self.cleanup()
 
     # All knowledge about locks and threading is below this line,
     # except for the bare fact that self.threadlock is set to None
@@ -655,9 +1755,10 @@ class TestSession:
         if self.threadlock:
             self.threadlock.acquire()
         self.runqueue.append(obj)
+        self.rotation.append(obj)
         if isinstance(obj, FakeLogGPS):
             self.writers += 1
-        elif isinstance(obj, FakePTY):
+        elif isinstance(obj, (FakePTY, FakeTCP)):
             self.writers += 1
         elif isinstance(obj, gps.gps):
             self.readers += 1
@@ -668,11 +1769,16 @@ class TestSession:
         if self.threadlock:
             self.threadlock.acquire()
         self.runqueue.remove(obj)
+        if obj in self.rotation:
+            self.rotation.remove(obj)
+        else:
+            self.parked = [entry for entry in self.parked if entry[2] is not obj]
+            heapq.heapify(self.parked)
         if isinstance(obj, FakeLogGPS):
             self.writers -= 1
         elif isinstance(obj, gps.gps):
             self.readers -= 1
-        self.index = min(len(self.runqueue)-1, self.index)
+        self.index = min(len(self.rotation)-1, self.index)
         if self.threadlock:
             self.threadlock.release()
     def choose(self):
@@ -681,10 +1787,33 @@ class TestSession:
             self.threadlock.acquire()
         chosen = self.index
         self.index += 1
-        self.index %= len(self.runqueue)
+        self.index %= len(self.rotation)
+        if self.threadlock:
+            self.threadlock.release()
+        return self.rotation[chosen]
+    def park(self, device, until):
+        "Take an idle fake GPS out of the rotation until a given time."
+        if self.threadlock:
+            self.threadlock.acquire()
+        n = self.rotation.index(device)
+        del self.rotation[n]
+        if n < self.index:
+            self.index -= 1
+        if self.index >= len(self.rotation):
+            self.index = 0
+        self.parks += 1
+        heapq.heappush(self.parked, (until, self.parks, device))
+        if self.threadlock:
+            self.threadlock.release()
+    def wake(self):
+        "Put the parked fake GPSes that are due back in the rotation."
+        if self.threadlock:
+            self.threadlock.acquire()
+        now = time.time()
+        while self.parked and self.parked[0][0] <= now:
+            self.rotation.append(heapq.heappop(self.parked)[2])
         if self.threadlock:
             self.threadlock.release()
-        return self.runqueue[chosen]
     def initialize(self, client, commands):
         "Arrange for client to ship specified commands when it goes active."
         client.enqueued = ""
@@ -693,6 +1822,7 @@ class TestSession:
         else:
             client.enqueued = commands
     def start(self):
+        import threading
         self.threadlock = threading.Lock()
         threading.Thread(target=self.run)
 
@@ -0,0 +1,320 @@
+# framer.py - split text GPS logs into packets without the packet module
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A bulk framer for text logs: NMEA sentences, AIVDM/AIVDO sentences and
+#-comments.  It frames a whole block of a log at a time and returns the
+packet offsets in the block, where the packet module reads and frames
+one packet per call.
+
+The framing follows the packet module's lexer for text:
+
+- a sentence starts with $ and a talker it knows (GP, GL, GN, II, IN,
+  AI, C? or the proprietary P?), or with !AI and a letter, continues
+  with printable characters and ends with \\n, optionally after \\r's;
+- a comment is # and printable characters ending with \\n;
+- anything else between packets is skipped silently, as are packets
+  longer than MAX_PACKET;
+- a trailing checksum that is two upper-case hex digits must match,
+  otherwise the sentence is a BAD_PACKET.
+
+Binary protocols (SiRF, UBX, TSIP, ...) are not recognized; logs of
+those still need the packet module.
+
+With NumPy the lines of a block are classified and checksummed with
+array operations, using a running XOR over the block; without it each
+packet is found and checked by itself.
+"""
+import os, re, array, operator
+import lazy
+
+numpy = lazy.module("numpy")
+
+# Packet types, numbered as the packet module numbers them
+BAD_PACKET = -1
+COMMENT_PACKET = 0
+NMEA_PACKET = 1
+AIVDM_PACKET = 2
+
+# Longest packet the packet module's lexer accepts
+MAX_PACKET = 1032
+
+BLOCKSIZE = 1 << 20
+
+# Bytes at the start of a log looked at to tell whether it is text
+SAMPLE = 1 << 16
+
+# What a text log is made of: printable characters and line ends
+TEXT = "".join(chr(c) for c in range(0x20, 0x7f)) + "\r\n"
+
+PACKET = re.compile(r"(#[\x20-\x7e]*\n)"
+                    r"|(\$(?:GP|GL|GN|II|IN|AI|C[A-Z]|P[A-Z])[\x20-\x7e]*\r*\n)"
+                    r"|(!AI[A-Z][\x20-\x7e]*\r*\n)")
+
+HEX = "0123456789ABCDEF"
+
+def _checksum_ok(data, start, stop):
+    "Check a sentence's checksum the way the packet module does."
+    # Back up over trailing space, then over upper-case hex digits; a
+    # checksum is only checked if that lands on a '*'.
+    body = data[start:stop].rstrip()
+    star = len(body.rstrip(HEX)) - 1
+    if star < 0 or body[star] != "*":
+        return True
+    crc = reduce(operator.xor, bytearray(body[1:star]), 0)
+    return body[star + 1:star + 3].upper() == "%02X" % crc
+
+def _search(data, pos, endpos, frames):
+    "Frame data[pos:endpos] with the regular expression."
+    search = PACKET.search
+    last = pos
+    while True:
+        m = search(data, pos, endpos)
+        if m is None:
+            break
+        (start, stop) = m.span()
+        if stop - start > MAX_PACKET:
+            pos = start + 1
+            continue
+        kind = m.lastindex
+        if kind == 1:
+            ptype = COMMENT_PACKET
+        elif not _checksum_ok(data, start, stop):
+            ptype = BAD_PACKET
+        elif kind == 3 and data.startswith("!AIVDM", start):
+            ptype = AIVDM_PACKET
+        else:
+            ptype = NMEA_PACKET
+        frames.append((ptype, start, stop))
+        pos = last = stop
+    return last
+
+_tables = None
+
+def _lookup():
+    "The talker and hex digit tables of _frame_lines(), made on first use."
+    global _tables
+    if _tables is None:
+        _tables = (numpy.array([ord(a) * 256 + ord(b) for (a, b) in
+                                ("GP", "GL", "GN", "II", "IN", "AI")]),
+                   numpy.frombuffer(HEX, dtype=numpy.uint8))
+    return _tables
+
+def _back(arr, pos, floor, test):
+    "Step each position back while test() holds for its byte, not below floor."
+    pos = pos.copy()
+    active = numpy.flatnonzero((pos >= floor) & test(arr[numpy.maximum(pos, 0)]))
+    while len(active):
+        pos[active] -= 1
+        p = pos[active]
+        active = active[(p >= floor[active]) & test(arr[numpy.maximum(p, 0)])]
+    return pos
+
+def _cr(c):
+    return c == 13
+
+def _space(c):
+    return (c == 32) | ((c >= 9) & (c <= 13))
+
+def _hexdigit(c):
+    return ((c >= 48) & (c <= 57)) | ((c >= 65) & (c <= 70))
+
+def _frame_lines(data):
+    "Frame a block line by line with array operations."
+    # Every packet ends at the first \n after its start, so each line
+    # holds at most one packet.  Lines that are a packet from their
+    # first byte are recognized and checksummed here all at once; the
+    # few others are left to the regular expression.
+    (talkers, digits) = _lookup()
+    arr = numpy.frombuffer(data, dtype=numpy.uint8)
+    n = len(arr)
+    ends = numpy.flatnonzero(arr == 10)
+    if not len(ends):
+        return ([], 0)
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    def at(offsets):
+        return arr[numpy.minimum(offsets, n - 1)]
+    def upper(c):
+        return (c >= 65) & (c <= 90)
+    # Counting unprintable bytes and packet starts per line by searching
+    # their (few) positions is quicker than a running count of every byte
+    unprintable = numpy.flatnonzero((arr < 0x20) | (arr > 0x7e))
+    inside = unprintable.searchsorted(ends) - unprintable.searchsorted(starts)
+    trailing = ends - 1 - _back(arr, ends - 1, starts, _cr)
+    first = arr[starts]
+    second = at(starts + 1)
+    third = at(starts + 2)
+    comment = (first == 35) & (inside == 0)
+    sentence = inside == trailing
+    talker = second.astype(numpy.int32) * 256 + third
+    nmea = sentence & (first == 36) & (numpy.in1d(talker, talkers)
+                                        | (((second == 67) | (second == 80)) & upper(third)))
+    ais = sentence & (first == 33) & (second == 65) & (third == 73) & upper(at(starts + 3))
+    fast = (comment | nmea | ais) & (ends + 1 - starts <= MAX_PACKET)
+    # The checksum test of _checksum_ok(), on every line at once
+    star = _back(arr, _back(arr, ends, starts, _space), starts, _hexdigit)
+    starred = (star > starts) & (at(numpy.maximum(star, 0)) == 42)
+    # XOR of each sentence between the $ and the *
+    bounds = numpy.empty(2 * len(ends), dtype=ends.dtype)
+    bounds[0::2] = numpy.minimum(starts + 1, n - 1)
+    bounds[1::2] = numpy.where(starred, star, bounds[0::2])
+    crc = numpy.bitwise_xor.reduceat(arr, bounds)[0::2]
+    c1 = at(star + 1)
+    c2 = at(star + 2)
+    c1 = numpy.where((c1 >= 97) & (c1 <= 122), c1 - 32, c1)
+    c2 = numpy.where((c2 >= 97) & (c2 <= 122), c2 - 32, c2)
+    good = ~starred | ((c1 == digits[crc >> 4]) & (c2 == digits[crc & 15]))
+    aivdm = ais & (at(starts + 3) == 86) & (at(starts + 4) == 68) & (at(starts + 5) == 77)
+    types = numpy.where(comment, COMMENT_PACKET,
+                        numpy.where(good, numpy.where(aivdm, AIVDM_PACKET, NMEA_PACKET),
+                                    BAD_PACKET))
+    frames = zip(types[fast].tolist(), starts[fast].tolist(), (ends[fast] + 1).tolist())
+    # Lines with a packet start somewhere other than their first byte
+    begins = numpy.flatnonzero((arr == 35) | (arr == 36) | (arr == 33))
+    slow = ~fast & (begins.searchsorted(ends) > begins.searchsorted(starts))
+    if slow.any():
+        for (start, stop) in zip(starts[slow].tolist(), (ends[slow] + 1).tolist()):
+            _search(data, start, stop, frames)
+        frames.sort(key=lambda f: f[1])
+    return (frames, int(ends[-1]) + 1)
+
+def frame(data):
+    "Return ([(type, start, end), ...], end of the last complete line) for a block."
+    if numpy is not None:
+        return _frame_lines(data)
+    frames = []
+    last = _search(data, 0, len(data), frames)
+    return (frames, last)
+
+def packets(data):
+    "Yield (type, packet) for every packet in a string."
+    (frames, last) = frame(data)
+    if not frames and data:
+        # The packet module reports input with no packets in it as bad
+        yield (BAD_PACKET, "")
+        return
+    for (ptype, start, stop) in frames:
+        yield (ptype, data[start:stop])
+
+def textual(path, size=SAMPLE):
+    "True if the start of a file holds nothing but text."
+    fp = open(path, "rb")
+    try:
+        sample = fp.read(size)
+    finally:
+        fp.close()
+    return not sample.translate(None, TEXT)
+
+def _framed_blocks(fp, blocksize, limit=None):
+    "Yield (data, offset of data in the file read, frames) a block at a time."
+    carry = ""
+    offset = 0
+    while limit is None or limit > 0:
+        if limit is None:
+            block = fp.read(blocksize)
+        else:
+            block = fp.read(min(blocksize, limit))
+            limit -= len(block)
+        if not block:
+            break
+        data = carry + block
+        (frames, last) = frame(data)
+        yield (data, offset, frames)
+        # Whatever follows the last packet may be the start of the next
+        if len(data) - last > MAX_PACKET:
+            last = len(data) - MAX_PACKET
+        carry = data[last:]
+        offset += last
+
+def read_packets(fp, blocksize=BLOCKSIZE):
+    "Yield (type, packet) for every packet read from a file, a block at a time."
+    found = seen = False
+    for (data, offset, frames) in _framed_blocks(fp, blocksize):
+        seen = True
+        for (ptype, start, stop) in frames:
+            yield (ptype, data[start:stop])
+        if frames:
+            found = True
+    if seen and not found:
+        # The packet module reports input with no packets in it as bad
+        yield (BAD_PACKET, "")
+
+def _frame_chunk(job):
+    "Frame bytes start to stop of a file; return [(offset, types, starts, stops)]."
+    (path, start, stop, blocksize) = job
+    blocks = []
+    fp = open(path, "rb")
+    try:
+        fp.seek(start)
+        for (data, offset, frames) in _framed_blocks(fp, blocksize, stop - start):
+            if frames:
+                (types, starts, stops) = zip(*frames)
+                # Strings pickle far quicker than lists or arrays
+                blocks.append((start + offset, array.array('b', types).tostring(),
+                               array.array('l', starts).tostring(),
+                               array.array('l', stops).tostring()))
+    finally:
+        fp.close()
+    return blocks
+
+def chunks(path, count):
+    "Split a file into about count pieces, each ending just after a \\n."
+    size = os.path.getsize(path)
+    bounds = [0]
+    fp = open(path, "rb")
+    try:
+        for n in range(1, count):
+            pos = max(size * n // count, bounds[-1])
+            fp.seek(pos)
+            # No packet spans a \n, so a piece may end after any of them
+            while True:
+                block = fp.read(65536)
+                if not block:
+                    pos = size
+                    break
+                eol = block.find("\n")
+                if eol >= 0:
+                    pos += eol + 1
+                    break
+                pos += len(block)
+            if pos >= size:
+                break
+            bounds.append(pos)
+    finally:
+        fp.close()
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+def parallel_packets(path, workers, blocksize=BLOCKSIZE):
+    "Yield (type, packet) for a file, framing pieces of it in a process pool."
+    import multiprocessing, mmap
+    jobs = [(path, start, stop, blocksize) for (start, stop) in chunks(path, workers * 4)]
+    if not jobs or jobs[-1][2] == 0:
+        return
+    fp = open(path, "rb")
+    mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    pool = multiprocessing.Pool(workers)
+    try:
+        found = False
+        # imap() hands the pieces back in file order
+        for blocks in pool.imap(_frame_chunk, jobs):
+            for (offset, types, starts, stops) in blocks:
+                (t, a, b) = (array.array('b'), array.array('l'), array.array('l'))
+                t.fromstring(types)
+                a.fromstring(starts)
+                b.fromstring(stops)
+                for (ptype, start, stop) in zip(t, a, b):
+                    yield (ptype, mm[offset + start:offset + stop])
+                found = True
+        if not found:
+            yield (BAD_PACKET, "")
+    finally:
+        pool.terminate()
+        pool.join()
+        mm.close()
+        fp.close()
+
+# End
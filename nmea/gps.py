@@ -14,8 +14,12 @@
 # The JSON parts of this (which will be reused by any new interface)
 # now live in a different module.
 #
-import time
+import time, socket, select, sys
 from client import *
+from misc import isotime
+import lazy
+
+numpy = lazy.module("numpy")
 
 NaN = float('nan')
 def isnan(x): return str(x) == 'nan'
@@ -83,6 +87,82 @@ class gpsfix:
         self.eps = NaN
         self.epc = NaN
 
+class fixhistory:
+    "Fixed-capacity ring buffer of recent fixes, kept as NumPy columns."
+
+    columns = ("time", "latitude", "longitude", "altitude", "speed",
+               "track", "climb", "ept", "epx", "epy", "epv", "epd",
+               "eps", "epc", "mode")
+
+    def __init__(self, capacity):
+        if numpy is None:
+            raise ImportError("fix history needs NumPy")
+        if capacity <= 0:
+            raise ValueError("fix history capacity must be positive")
+        self.capacity = capacity
+        self.head = 0           # Slot the next fix goes into
+        self.count = 0
+        self.data = numpy.empty((len(self.columns), capacity))
+        self.data.fill(NaN)
+
+    def __len__(self):
+        return self.count
+
+    def push(self, fix):
+        "Copy the members of a gpsfix into the next slot."
+        t = fix.time
+        if type(t) == type(""):
+            t = isotime(t)
+        row = self.data[:, self.head]
+        row[0] = t
+        row[1] = fix.latitude
+        row[2] = fix.longitude
+        row[3] = fix.altitude
+        row[4] = fix.speed
+        row[5] = fix.track
+        row[6] = fix.climb
+        row[7] = fix.ept
+        row[8] = fix.epx
+        row[9] = fix.epy
+        row[10] = fix.epv
+        row[11] = fix.epd
+        row[12] = fix.eps
+        row[13] = fix.epc
+        row[14] = fix.mode
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.data.fill(NaN)
+
+    def __order(self):
+        # Slot indices from oldest to newest
+        return (numpy.arange(self.count) + self.head - self.count) % self.capacity
+
+    def column(self, name):
+        "Return one column, oldest fix first."
+        return self.data[self.columns.index(name)].take(self.__order())
+
+    def window(self, start=None, end=None):
+        "Return a dict of columns for fixes with start <= time < end."
+        table = self.data.take(self.__order(), axis=1)
+        mask = numpy.ones(self.count, dtype=bool)
+        if start is not None:
+            mask &= table[0] >= start
+        if end is not None:
+            mask &= table[0] < end
+        table = table[:, mask]
+        return dict(zip(self.columns, table))
+
+    def last(self, seconds):
+        "Return the columns for the fixes in the final seconds of the buffer."
+        if not self.count:
+            return self.window()
+        return self.window(start=numpy.nanmax(self.data[0]) - seconds)
+
 class gpsdata:
     "Position, track, velocity and status information returned by a GPS."
 
@@ -154,11 +234,19 @@ class gpsdata:
 
 class gps(gpsdata, gpsjson):
     "Client interface to a running gpsd instance."
-    def __init__(self, host="127.0.0.1", port=GPSD_PORT, verbose=0, mode=0):
+    def __init__(self, host="127.0.0.1", port=GPSD_PORT, verbose=0, mode=0, history=0, recorder=None):
         gpscommon.__init__(self, host, port, verbose)
         gpsdata.__init__(self)
         self.raw_hook = None
         self.newstyle = False
+        # Optional ring buffer of the last `history' fixes
+        self.history = None
+        if history:
+            self.history = fixhistory(history)
+        # Optional capture.CaptureWriter for every report read
+        self.recorder = recorder
+        # Optional profiler.Timers to charge report decoding to
+        self.timers = None
         if mode:
             self.stream(mode)
 
@@ -226,6 +314,8 @@ class gps(gpsdata, gpsjson):
                             else:
                                 self.fix.mode = MODE_3D
                             self.valid |= MODE_SET
+                        if self.history is not None:
+                            self.history.push(self.fix)
                 elif cmd == 'X':
                     self.online = float(data)
                     self.valid |= ONLINE_SET
@@ -280,6 +370,8 @@ class gps(gpsdata, gpsjson):
             self.fix.eps =       default("eps",   NaN, SPEEDERR_SET)
             self.fix.epc =       default("epc",   NaN, CLIMBERR_SET)
             self.fix.mode =      default("mode",  0,   MODE_SET)
+            if self.history is not None:
+                self.history.push(self.fix)
         elif self.data.get("class") == "SKY":
             for attrp in "xyvhpg":
                 setattr(self, attrp+"dop", default(attrp+"dop", NaN, DOP_SET))
@@ -304,9 +396,15 @@ class gps(gpsdata, gpsjson):
             return status
         if self.raw_hook:
             self.raw_hook(self.response);
+        if self.recorder is not None:
+            self.recorder.write(self.received, self.response)
         if self.response.startswith("{") and self.response.endswith("}\r\n"):
+            if self.timers:
+                start = time.time()
             self.json_unpack(self.response)
             self.__oldstyle_shim()
+            if self.timers:
+                self.timers.add("decode", time.time() - start)
             self.newstyle = True
             self.valid |= PACKET_SET
         elif self.response.startswith("GPSD"):
@@ -347,6 +445,117 @@ class gps(gpsdata, gpsjson):
         else: # flags & WATCH_NEWSTYLE:
             gpsjson.stream(self, flags)
 
+class gpsmux:
+    "Multiplex the report streams of several gpsd instances over one select()."
+    def __init__(self, verbose=0, retry=5.0):
+        self.verbose = verbose
+        self.retry = retry      # Seconds to wait before reconnecting
+        self.endpoints = {}     # tag -> (host, port, mode, gps() options)
+        self.sessions = {}      # tag -> connected gps instance
+        self.retries = {}       # tag -> time of next connection attempt
+        self.pending = []       # Reports read but not yet handed out
+
+    def add(self, tag, host="127.0.0.1", port=GPSD_PORT,
+            mode=WATCH_ENABLE|WATCH_JSON, **kwargs):
+        "Add a daemon to the pool; its reports will carry the given tag."
+        self.endpoints[tag] = (host, port, mode, kwargs)
+        return self.__connect(tag)
+
+    def remove(self, tag):
+        "Drop a daemon from the pool."
+        del self.endpoints[tag]
+        self.retries.pop(tag, None)
+        session = self.sessions.pop(tag, None)
+        if session:
+            session.close()
+
+    def __connect(self, tag):
+        (host, port, mode, kwargs) = self.endpoints[tag]
+        try:
+            session = gps(host=host, port=port, verbose=self.verbose,
+                          mode=mode, **kwargs)
+        except socket.error:
+            self.retries[tag] = time.time() + self.retry
+            return None
+        session.tag = tag
+        self.sessions[tag] = session
+        self.retries.pop(tag, None)
+        return session
+
+    def __drop(self, tag):
+        self.sessions.pop(tag).close()
+        self.retries[tag] = time.time() + self.retry
+        if self.verbose:
+            sys.stderr.write("gpsmux: lost %s, retrying in %.1f sec\n"
+                             % (tag, self.retry))
+
+    def reconnect(self):
+        "Retry dropped connections whose back-off has expired."
+        now = time.time()
+        for (tag, when) in self.retries.items():
+            if when <= now:
+                self.__connect(tag)
+
+    def send(self, tag, commands):
+        "Ship commands to one daemon in the pool."
+        self.sessions[tag].send(commands)
+
+    def __unpack(self, session):
+        # Interpret one line; return False when the connection is gone.
+        session.response = None
+        buffered = len(session.linebuffer)
+        try:
+            status = session.poll()
+        except socket.error:
+            return False
+        # A readable socket that adds nothing to a partial line has closed.
+        if status < 0 or (session.response is None
+                          and len(session.linebuffer) == buffered):
+            return False
+        if session.response is not None:
+            if session.response.startswith("{"):
+                self.pending.append((session.tag, session.data))
+            else:
+                self.pending.append((session.tag, session.response))
+        return True
+
+    def poll(self, timeout=None):
+        "Wait for reports, returning a list of (tag, report) pairs."
+        self.reconnect()
+        bysock = {}
+        for session in self.sessions.values():
+            bysock[session.sock] = session
+        if not bysock:
+            if self.retries:
+                time.sleep(min(timeout or self.retry, self.retry))
+            return []
+        (ready, _, _) = select.select(bysock.keys(), (), (), timeout)
+        for sock in ready:
+            session = bysock[sock]
+            # The first call reads the socket, the rest drain its buffer.
+            alive = self.__unpack(session)
+            while alive and session.linebuffer.find('\n') != -1:
+                alive = self.__unpack(session)
+            if not alive:
+                self.__drop(session.tag)
+        reports = self.pending
+        self.pending = []
+        return reports
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self.pending:
+            if not self.endpoints:
+                raise StopIteration
+            self.pending = self.poll(self.retry)
+        return self.pending.pop(0)
+
+    def close(self):
+        for tag in self.endpoints.keys():
+            self.remove(tag)
+
 if __name__ == '__main__':
     import readline, getopt, sys
     (options, arguments) = getopt.getopt(sys.argv[1:], "v")
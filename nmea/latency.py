@@ -0,0 +1,113 @@
+# latency.py - emission to client decode latency for a TestSession
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Measure how long a sentence takes to get from a fake GPS, through the
+daemon, to a client.
+
+The fake devices tell a LatencyHarness when each sentence was written,
+and the session tells it when a client has read and decoded a report.
+A client watching with "nmea":true gets each sentence back verbatim, so
+the sentence text is the key that ties the two together.  Identical
+sentences are matched first in, first out; sentences that never come
+back are forgotten after a timeout and counted as lost.
+
+Samples are kept per device and per load level.  The level is whatever
+label the harness was last given, by default the number of fake devices
+in the session, so a run that adds devices as it goes reports how the
+latency grows with the load.
+"""
+import sys, time, array, collections
+
+def percentile(ordered, q):
+    "The q-quantile of a sorted sequence, by nearest rank."
+    if not ordered:
+        return 0.0
+    rank = int(q * len(ordered) + 0.5)
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+class LatencyHarness:
+    "Tie sentence writes to the reports they turn into."
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout      # Seconds before an unmatched sentence is lost
+        self.level = 0
+        self.pending = {}           # Sentence -> deque of (device, written)
+        self.order = collections.deque()    # (written, sentence), oldest first
+        self.samples = {}           # (level, device) -> array of latencies
+        self.lost = 0
+        self.unmatched = 0          # Sentences read that were never written
+
+    def emitted(self, device, line, written):
+        "Note that device wrote line at the given time."
+        key = line.rstrip("\r\n")
+        queue = self.pending.get(key)
+        if queue is None:
+            queue = self.pending[key] = collections.deque()
+        queue.append((device, written))
+        self.order.append((written, key))
+        self.expire(written)
+
+    def received(self, response, decoded):
+        "Match a report a client decoded at the given time."
+        if not response.startswith(("$", "!")):
+            return
+        key = response.rstrip("\r\n")
+        queue = self.pending.get(key)
+        if not queue:
+            self.unmatched += 1
+            return
+        (device, written) = queue.popleft()
+        if not queue:
+            del self.pending[key]
+        sample = (self.level, device)
+        if sample not in self.samples:
+            self.samples[sample] = array.array('d')
+        self.samples[sample].append(decoded - written)
+
+    def expire(self, now):
+        "Forget sentences written more than timeout seconds before now."
+        order = self.order
+        limit = now - self.timeout
+        while order and order[0][0] < limit:
+            (written, key) = order.popleft()
+            queue = self.pending.get(key)
+            # The oldest entry for a sentence is the one being expired,
+            # unless it has been matched already.
+            if queue and queue[0][1] == written:
+                queue.popleft()
+                self.lost += 1
+                if not queue:
+                    del self.pending[key]
+
+    def report(self):
+        "Percentiles as {level: {device: {...}}}, with an 'all' device per level."
+        levels = {}
+        merged = {}
+        for ((level, device), samples) in self.samples.items():
+            levels.setdefault(level, {})[device] = self.summary(samples)
+            merged.setdefault(level, array.array('d')).extend(samples)
+        for (level, samples) in merged.items():
+            levels[level]["all"] = self.summary(samples)
+        return levels
+
+    def summary(self, samples):
+        ordered = sorted(samples)
+        return {"count": len(ordered),
+                "p50": percentile(ordered, 0.5),
+                "p99": percentile(ordered, 0.99),
+                "p999": percentile(ordered, 0.999),
+                "max": ordered and ordered[-1] or 0.0}
+
+    def dump(self, stream=sys.stderr):
+        "Write the percentiles, one line per device per load level."
+        levels = self.report()
+        for level in sorted(levels):
+            for device in sorted(levels[level]):
+                s = levels[level][device]
+                stream.write("gpsfake: latency %s %s: %d samples p50 %.6f p99 %.6f p999 %.6f max %.6f\n"
+                             % (level, device, s["count"], s["p50"], s["p99"], s["p999"], s["max"]))
+        stream.write("gpsfake: latency: %d sentences lost, %d unmatched\n"
+                     % (self.lost, self.unmatched))
+
+# End
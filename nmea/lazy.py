@@ -0,0 +1,54 @@
+# lazy.py - import heavy optional modules when they are first used
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Importing NumPy costs more than the rest of the package together, and
+most runs of gpsfake never touch it.  module() finds out whether a
+module is installed without importing it and returns a stand-in that
+does the import on first attribute access, so
+
+    numpy = lazy.module("numpy")
+
+still leaves numpy None when NumPy is missing, and costs nothing until
+numpy.something is used.
+"""
+import sys, imp
+
+class LazyModule:
+    "A stand-in for a module that imports it when first used."
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            # Keep repr(), truth tests and the like from importing
+            raise AttributeError(attr)
+        __import__(self._name)
+        module = sys.modules[self._name]
+        # Later lookups find the module's names here directly
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self._name
+
+def module(name, package=None):
+    "A module to import when first used, or None if it is not installed."
+    # With a package name, look for the module in that package
+    path = None
+    full = name
+    if package:
+        path = sys.modules[package].__path__
+        full = package + "." + name
+    if full in sys.modules:
+        return sys.modules[full]
+    try:
+        (fp, path, description) = imp.find_module(name, path)
+    except ImportError:
+        return None
+    if fp:
+        fp.close()
+    return LazyModule(full)
+
+# End
@@ -0,0 +1,240 @@
+# metrics.py - counters and histograms for a TestSession
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Structured statistics for the fake devices and clients of a TestSession.
+
+Give a TestSession a SessionMetrics instance and it will keep a
+DeviceStats for every fake GPS and a ClientStats for every client:
+
+sentences, bytes, drops
+    What a fake device has emitted, and how many writes it gave up on.
+    Only a TCP sink drops, counting the slow subscribers it cuts off.
+
+lateness
+    How far behind its schedule a device started each emission, the
+    schedule being one emission every period seconds from the first.
+    Fixes a simulator suppresses or skips while parked move the
+    schedule on.  When this grows the session has more devices than
+    it can cycle through.
+
+blocked
+    Time spent inside the write call, i.e. waiting on the pty or socket.
+
+reports, bytes, decode
+    Reports a client has read from the daemon and the time poll() took.
+
+SessionMetrics.snapshot() returns everything as a dictionary.  A
+SessionMetrics can also dump a text summary to a stream every few
+seconds, and serve its snapshot as JSON on a Unix socket, or as HTTP
+on a local TCP port.
+"""
+import sys, os, time, math
+from client import json
+
+class Histogram:
+    "Observations counted in power-of-two buckets above a base value."
+    def __init__(self, base=1e-6, buckets=32):
+        self.base = base
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value <= self.base:
+            self.counts[0] += 1
+        else:
+            # frexp() gives the binary exponent without calling log()
+            bucket = math.frexp(value / self.base)[1]
+            self.counts[min(bucket, len(self.counts) - 1)] += 1
+
+    def quantile(self, q):
+        "Upper bound of the bucket holding the q-quantile."
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for (bucket, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                if bucket == len(self.counts) - 1:
+                    break       # The overflow bucket has no upper bound
+                return min(self.base * 2 ** bucket, self.max)
+        return self.max
+
+    def snapshot(self):
+        if self.count:
+            mean = self.total / self.count
+        else:
+            mean = 0.0
+        return {"count": self.count, "mean": mean, "max": self.max,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+class DeviceStats:
+    "What one fake GPS has emitted."
+    def __init__(self, name, period=1.0):
+        self.name = name
+        self.period = period    # Seconds between scheduled emissions
+        self.due = None         # When the next emission is due
+        self.sentences = 0
+        self.bytes = 0
+        self.drops = 0
+        self.lateness = Histogram()
+        self.blocked = Histogram()
+
+    def emitted(self, length, start, wrote, done, sentences=1):
+        "Record an emission that began at start and was written from wrote to done."
+        self.sentences += sentences
+        self.bytes += length
+        if self.due is None:
+            self.due = start + self.period
+        else:
+            self.lateness.add(max(0.0, start - self.due))
+            self.due += self.period
+        self.blocked.add(done - wrote)
+
+    def skipped(self, seconds):
+        "Move the schedule on over time the device had nothing to send."
+        if self.due is not None:
+            self.due += seconds
+
+    def reschedule(self, due, period):
+        "Put the device on a new schedule, with its next emission due at due."
+        self.due = due
+        self.period = period
+
+    def dropped(self, n=1):
+        self.drops += n
+
+    def snapshot(self):
+        return {"sentences": self.sentences, "bytes": self.bytes,
+                "drops": self.drops, "lateness": self.lateness.snapshot(),
+                "blocked": self.blocked.snapshot()}
+
+class ClientStats:
+    "What one client has read from the daemon."
+    def __init__(self, cid):
+        self.cid = cid
+        self.reports = 0
+        self.bytes = 0
+        self.decode = Histogram()
+
+    def polled(self, response, start, done):
+        "Record a report read and decoded between start and done."
+        self.reports += 1
+        self.bytes += len(response)
+        self.decode.add(done - start)
+
+    def snapshot(self):
+        return {"reports": self.reports, "bytes": self.bytes,
+                "decode": self.decode.snapshot()}
+
+class SessionMetrics:
+    "Statistics for every device and client in a TestSession."
+    def __init__(self, interval=None, stream=sys.stderr):
+        self.devices = {}
+        self.clients = {}
+        self.started = time.time()
+        self.interval = interval    # Seconds between dumps, None for never
+        self.stream = stream
+        self.next_dump = self.started + (interval or 0)
+        self.server = None
+
+    def device(self, name, period=1.0):
+        if name not in self.devices:
+            self.devices[name] = DeviceStats(name, period)
+        return self.devices[name]
+
+    def client(self, cid):
+        if cid not in self.clients:
+            self.clients[cid] = ClientStats(cid)
+        return self.clients[cid]
+
+    def snapshot(self):
+        "All counters as a dictionary, with totals and rates."
+        now = time.time()
+        elapsed = max(now - self.started, 1e-9)
+        # items() copies, so a serving thread can't trip over new entries
+        devices = dict((name, d.snapshot()) for (name, d) in self.devices.items())
+        clients = dict((str(cid), c.snapshot()) for (cid, c) in self.clients.items())
+        sentences = sum(d["sentences"] for d in devices.values())
+        reports = sum(c["reports"] for c in clients.values())
+        return {"time": now, "elapsed": elapsed,
+                "sentences": sentences, "sentence_rate": sentences / elapsed,
+                "reports": reports, "report_rate": reports / elapsed,
+                "drops": sum(d["drops"] for d in devices.values()),
+                "devices": devices, "clients": clients}
+
+    def dump(self, stream=None):
+        "Write a one-line-per-object text summary."
+        if stream is None:
+            stream = self.stream
+        snap = self.snapshot()
+        stream.write("gpsfake: stats %.1fs: %d sentences (%.1f/s), %d reports (%.1f/s), %d drops\n"
+                     % (snap["elapsed"], snap["sentences"], snap["sentence_rate"],
+                        snap["reports"], snap["report_rate"], snap["drops"]))
+        for name in sorted(snap["devices"]):
+            d = snap["devices"][name]
+            stream.write("gpsfake:   %s: %d sentences %d bytes %d drops late p50 %.4f p99 %.4f blocked p99 %.4f\n"
+                         % (name, d["sentences"], d["bytes"], d["drops"],
+                            d["lateness"]["p50"], d["lateness"]["p99"], d["blocked"]["p99"]))
+        for cid in sorted(snap["clients"]):
+            c = snap["clients"][cid]
+            stream.write("gpsfake:   client %s: %d reports %d bytes decode p50 %.4f p99 %.4f\n"
+                         % (cid, c["reports"], c["bytes"],
+                            c["decode"]["p50"], c["decode"]["p99"]))
+
+    def tick(self, now=None):
+        "Dump the statistics if the dump interval has passed."
+        if self.interval:
+            if now is None:
+                now = time.time()
+            if now >= self.next_dump:
+                self.dump()
+                self.next_dump = now + self.interval
+
+    def serve(self, address):
+        "Serve snapshots from a thread: a path is a Unix socket, host:port is HTTP."
+        import threading, SocketServer
+        metrics = self
+        if ":" in address:
+            (host, port) = address.rsplit(":", 1)
+            class Handler(SocketServer.StreamRequestHandler):
+                def handle(self):
+                    self.rfile.readline()       # The request line is all we need
+                    body = json.dumps(metrics.snapshot())
+                    self.wfile.write("HTTP/1.0 200 OK\r\n"
+                                     "Content-Type: application/json\r\n"
+                                     "Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            server = SocketServer.TCPServer((host or "127.0.0.1", int(port)), Handler)
+        else:
+            class Handler(SocketServer.StreamRequestHandler):
+                def handle(self):
+                    self.wfile.write(json.dumps(metrics.snapshot()) + "\n")
+            if os.path.exists(address):
+                os.remove(address)
+            server = SocketServer.UnixStreamServer(address, Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.server = server
+        return server
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server.server_address, str):
+                try:
+                    os.remove(self.server.server_address)
+                except OSError:
+                    pass
+            self.server = None
+
+# End
@@ -4,6 +4,9 @@
 # BSD terms apply: see the file COPYING in the distribution root for details.
 
 import time, calendar, math
+import lazy
+
+numpy = lazy.module("numpy")
 
 # some multipliers for interpreting GPS output
 METERS_TO_FEET	= 3.2808399	# Meters to U.S./British feet
@@ -15,6 +18,12 @@ MPS_TO_KPH	= 3.6		# Meters per second to klicks/hr
 MPS_TO_MPH	= 2.2369363	# Meters/second to miles per hour
 MPS_TO_KNOTS	= 1.9438445	# Meters per second to knots
 
+# Earth models for the distance functions
+EARTH_MEAN_RADIUS = 6371008.8	# Meters, IUGG mean radius
+WGS84A = 6378137.0		# Meters, WGS84 equatorial radius
+WGS84F = 1 / 298.257223563	# WGS84 flattening
+WGS84B = WGS84A * (1 - WGS84F)	# Meters, WGS84 polar radius
+
 # EarthDistance code swiped from Kismet and corrected
 
 def Deg2Rad(x):
@@ -52,20 +61,23 @@ def CalcRad(lat):
 
 def EarthDistance((lat1, lon1), (lat2, lon2)):
     "Distance in meters between two points specified in degrees."
-    x1 = CalcRad(lat1) * math.cos(Deg2Rad(lon1)) * math.sin(Deg2Rad(90-lat1))
-    x2 = CalcRad(lat2) * math.cos(Deg2Rad(lon2)) * math.sin(Deg2Rad(90-lat2))
-    y1 = CalcRad(lat1) * math.sin(Deg2Rad(lon1)) * math.sin(Deg2Rad(90-lat1))
-    y2 = CalcRad(lat2) * math.sin(Deg2Rad(lon2)) * math.sin(Deg2Rad(90-lat2))
-    z1 = CalcRad(lat1) * math.cos(Deg2Rad(90-lat1))
-    z2 = CalcRad(lat2) * math.cos(Deg2Rad(90-lat2))
-    a = (x1*x2 + y1*y2 + z1*z2)/pow(CalcRad((lat1+lat2)/2), 2)
+    r1 = CalcRad(lat1)
+    r2 = CalcRad(lat2)
+    rm = CalcRad((lat1+lat2) / 2)
+    x1 = r1 * math.cos(Deg2Rad(lon1)) * math.sin(Deg2Rad(90-lat1))
+    x2 = r2 * math.cos(Deg2Rad(lon2)) * math.sin(Deg2Rad(90-lat2))
+    y1 = r1 * math.sin(Deg2Rad(lon1)) * math.sin(Deg2Rad(90-lat1))
+    y2 = r2 * math.sin(Deg2Rad(lon2)) * math.sin(Deg2Rad(90-lat2))
+    z1 = r1 * math.cos(Deg2Rad(90-lat1))
+    z2 = r2 * math.cos(Deg2Rad(90-lat2))
+    a = (x1*x2 + y1*y2 + z1*z2)/pow(rm, 2)
     # a should be in [1, -1] but can sometimes fall outside it by
     # a very small amount due to rounding errors in the preceding
     # calculations (this is prone to happen when the argument points
     # are very close together).  Thus we constrain it here.
-    if abs(a) > 1: a = 1
+    if a > 1: a = 1
     elif a < -1: a = -1
-    return CalcRad((lat1+lat2) / 2) * math.acos(a)
+    return rm * math.acos(a)
 
 def MeterOffset((lat1, lon1), (lat2, lon2)):
     "Return offset in meters of second arg from first."
@@ -75,15 +87,206 @@ def MeterOffset((lat1, lon1), (lat2, lon2)):
     if lon1 < lon2: dx *= -1
     return (dx, dy)
 
+def HaversineDistance((lat1, lon1), (lat2, lon2)):
+    "Great-circle distance in meters on a spherical Earth."
+    dlat = Deg2Rad(lat2 - lat1)
+    dlon = Deg2Rad(lon2 - lon1)
+    h = math.sin(dlat/2)**2 + \
+        math.cos(Deg2Rad(lat1)) * math.cos(Deg2Rad(lat2)) * math.sin(dlon/2)**2
+    return 2 * EARTH_MEAN_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+def VincentyDistance((lat1, lon1), (lat2, lon2), tolerance=1e-12, iterations=200):
+    "Distance in meters on the WGS84 ellipsoid (Vincenty inverse formula)."
+    # Returns NaN for the nearly antipodal pairs where the iteration
+    # fails to converge.
+    L = Deg2Rad(lon2 - lon1)
+    U1 = math.atan((1 - WGS84F) * math.tan(Deg2Rad(lat1)))
+    U2 = math.atan((1 - WGS84F) * math.tan(Deg2Rad(lat2)))
+    sinU1 = math.sin(U1); cosU1 = math.cos(U1)
+    sinU2 = math.sin(U2); cosU2 = math.cos(U2)
+    lam = L
+    for i in range(iterations):
+        sinLam = math.sin(lam)
+        cosLam = math.cos(lam)
+        sinSigma = math.sqrt((cosU2*sinLam)**2 +
+                             (cosU1*sinU2 - sinU1*cosU2*cosLam)**2)
+        if sinSigma == 0:
+            return 0.0          # Coincident points
+        cosSigma = sinU1*sinU2 + cosU1*cosU2*cosLam
+        sigma = math.atan2(sinSigma, cosSigma)
+        sinAlpha = cosU1*cosU2*sinLam / sinSigma
+        cos2Alpha = 1 - sinAlpha**2
+        if cos2Alpha == 0:
+            cos2SigmaM = 0.0    # Both points on the equator
+        else:
+            cos2SigmaM = cosSigma - 2*sinU1*sinU2/cos2Alpha
+        C = WGS84F/16 * cos2Alpha * (4 + WGS84F*(4 - 3*cos2Alpha))
+        prev = lam
+        lam = L + (1-C) * WGS84F * sinAlpha * (sigma + C*sinSigma*(
+            cos2SigmaM + C*cosSigma*(-1 + 2*cos2SigmaM**2)))
+        if abs(lam - prev) <= tolerance:
+            break
+    else:
+        return float('nan')
+    u2 = cos2Alpha * (WGS84A**2 - WGS84B**2) / WGS84B**2
+    A = 1 + u2/16384 * (4096 + u2*(-768 + u2*(320 - 175*u2)))
+    B = u2/1024 * (256 + u2*(-128 + u2*(74 - 47*u2)))
+    dSigma = B*sinSigma*(cos2SigmaM + B/4*(cosSigma*(-1 + 2*cos2SigmaM**2) -
+        B/6*cos2SigmaM*(-3 + 4*sinSigma**2)*(-3 + 4*cos2SigmaM**2)))
+    return WGS84B * A * (sigma - dSigma)
+
+# Array versions of the above.  These take NumPy arrays (or anything
+# numpy.asarray() accepts) of coordinates in degrees and evaluate all
+# pairs in one call.  Results agree with the scalar versions to within
+# floating-point rounding.
+
+def _asarrays(*args):
+    if numpy is None:
+        raise ImportError("array geodesy needs NumPy")
+    return [numpy.asarray(x, dtype=numpy.float64) for x in args]
+
+def CalcRadArray(lat):
+    "Radius of curvature in meters at each of an array of latitudes."
+    (lat,) = _asarrays(lat)
+    a = 6378.137
+    e2 = 0.081082 * 0.081082
+    sc = numpy.sin(lat * (math.pi/180))
+    return a * (1.0 - e2) / (1.0 - e2 * sc * sc) ** 1.5 * 1000.0
+
+def EarthDistanceArray((lat1, lon1), (lat2, lon2)):
+    "Distances in meters between arrays of points specified in degrees."
+    (lat1, lon1, lat2, lon2) = _asarrays(lat1, lon1, lat2, lon2)
+    d2r = math.pi/180
+    r1 = CalcRadArray(lat1)
+    r2 = CalcRadArray(lat2)
+    rm = CalcRadArray((lat1+lat2) / 2)
+    colat1 = (90-lat1) * d2r
+    colat2 = (90-lat2) * d2r
+    x1 = r1 * numpy.cos(lon1 * d2r) * numpy.sin(colat1)
+    x2 = r2 * numpy.cos(lon2 * d2r) * numpy.sin(colat2)
+    y1 = r1 * numpy.sin(lon1 * d2r) * numpy.sin(colat1)
+    y2 = r2 * numpy.sin(lon2 * d2r) * numpy.sin(colat2)
+    z1 = r1 * numpy.cos(colat1)
+    z2 = r2 * numpy.cos(colat2)
+    a = numpy.clip((x1*x2 + y1*y2 + z1*z2) / rm**2, -1, 1)
+    return rm * numpy.arccos(a)
+
+def MeterOffsetArray((lat1, lon1), (lat2, lon2), distance=EarthDistanceArray):
+    "Return (dx, dy) arrays, the offsets in meters of the second points from the first."
+    (lat1, lon1, lat2, lon2) = _asarrays(lat1, lon1, lat2, lon2)
+    dx = distance((lat1, lon1), (lat1, lon2))
+    dy = distance((lat1, lon1), (lat2, lon1))
+    dy = numpy.where(lat1 < lat2, -dy, dy)
+    dx = numpy.where(lon1 < lon2, -dx, dx)
+    return (dx, dy)
+
+def HaversineDistanceArray((lat1, lon1), (lat2, lon2)):
+    "Great-circle distances in meters on a spherical Earth."
+    (lat1, lon1, lat2, lon2) = _asarrays(lat1, lon1, lat2, lon2)
+    d2r = math.pi/180
+    h = numpy.sin((lat2 - lat1) * d2r / 2)**2 + \
+        numpy.cos(lat1 * d2r) * numpy.cos(lat2 * d2r) * \
+        numpy.sin((lon2 - lon1) * d2r / 2)**2
+    return 2 * EARTH_MEAN_RADIUS * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(h)))
+
+def VincentyDistanceArray((lat1, lon1), (lat2, lon2), tolerance=1e-12, iterations=200):
+    "Distances in meters on the WGS84 ellipsoid (Vincenty inverse formula)."
+    (lat1, lon1, lat2, lon2) = _asarrays(lat1, lon1, lat2, lon2)
+    d2r = math.pi/180
+    L = (lon2 - lon1) * d2r
+    U1 = numpy.arctan((1 - WGS84F) * numpy.tan(lat1 * d2r))
+    U2 = numpy.arctan((1 - WGS84F) * numpy.tan(lat2 * d2r))
+    sinU1 = numpy.sin(U1); cosU1 = numpy.cos(U1)
+    sinU2 = numpy.sin(U2); cosU2 = numpy.cos(U2)
+    lam = L
+    # Pairs stop being updated once they converge, so each one ends
+    # up with the same value the scalar version computes.
+    active = numpy.ones(numpy.broadcast(L, U1, U2).shape, dtype=bool)
+    olderr = numpy.seterr(invalid='ignore', divide='ignore')
+    try:
+        for i in range(iterations):
+            sinLam = numpy.sin(lam)
+            cosLam = numpy.cos(lam)
+            sinSigma = numpy.sqrt((cosU2*sinLam)**2 +
+                                  (cosU1*sinU2 - sinU1*cosU2*cosLam)**2)
+            cosSigma = sinU1*sinU2 + cosU1*cosU2*cosLam
+            sigma = numpy.arctan2(sinSigma, cosSigma)
+            sinAlpha = numpy.where(sinSigma == 0, 0.0,
+                                   cosU1*cosU2*sinLam / sinSigma)
+            cos2Alpha = 1 - sinAlpha**2
+            cos2SigmaM = numpy.where(cos2Alpha == 0, 0.0,
+                                     cosSigma - 2*sinU1*sinU2/cos2Alpha)
+            C = WGS84F/16 * cos2Alpha * (4 + WGS84F*(4 - 3*cos2Alpha))
+            step = L + (1-C) * WGS84F * sinAlpha * (sigma + C*sinSigma*(
+                cos2SigmaM + C*cosSigma*(-1 + 2*cos2SigmaM**2)))
+            if i == 0:
+                terms = (sinSigma, cosSigma, sigma, cos2Alpha, cos2SigmaM)
+            else:
+                terms = tuple(numpy.where(active, new, old) for (new, old) in
+                              zip((sinSigma, cosSigma, sigma, cos2Alpha, cos2SigmaM), terms))
+            done = (sinSigma == 0) | (numpy.abs(step - lam) <= tolerance)
+            lam = numpy.where(active, step, lam)
+            active = active & ~done
+            if not active.any():
+                break
+        (sinSigma, cosSigma, sigma, cos2Alpha, cos2SigmaM) = terms
+        u2 = cos2Alpha * (WGS84A**2 - WGS84B**2) / WGS84B**2
+        A = 1 + u2/16384 * (4096 + u2*(-768 + u2*(320 - 175*u2)))
+        B = u2/1024 * (256 + u2*(-128 + u2*(74 - 47*u2)))
+        dSigma = B*sinSigma*(cos2SigmaM + B/4*(cosSigma*(-1 + 2*cos2SigmaM**2) -
+            B/6*cos2SigmaM*(-3 + 4*sinSigma**2)*(-3 + 4*cos2SigmaM**2)))
+        s = WGS84B * A * (sigma - dSigma)
+    finally:
+        numpy.seterr(**olderr)
+    s = numpy.where(sinSigma == 0, 0.0, s)
+    return numpy.where(active, numpy.nan, s)
+
+# isotime() caches the date part of its conversions, since successive
+# timestamps from a GPS nearly always fall on the same day.
+_isodays = {}		# Days since the epoch -> "YYYY-MM-DDT"
+_isoepochs = {}		# "YYYY-MM-DD" -> Unix time of its midnight
+_ISOCACHE_MAX = 1024
+
+_isodigits = ["%02d" % n for n in range(60)]
+_isolast = (None, None)	# Most recently formatted day and its prefix
+
+def _isoday(day):
+    "Date prefix for a day number, cached."
+    prefix = _isodays.get(day)
+    if prefix is None:
+        if len(_isodays) >= _ISOCACHE_MAX:
+            _isodays.clear()
+        prefix = _isodays[day] = time.strftime("%Y-%m-%dT", time.gmtime(day * 86400))
+    return prefix
+
+def _isoepoch(date):
+    "Unix time of midnight on an ISO8601 date, cached."
+    midnight = _isoepochs.get(date)
+    if midnight is None:
+        if len(_isoepochs) >= _ISOCACHE_MAX:
+            _isoepochs.clear()
+        midnight = _isoepochs[date] = calendar.timegm(time.strptime(date, "%Y-%m-%d"))
+    return midnight
+
+def _isoformat(secs):
+    global _isolast
+    day = secs // 86400
+    (last, prefix) = _isolast
+    if day != last:
+        prefix = _isoday(day)
+        _isolast = (day, prefix)
+    secs -= day * 86400
+    return prefix + _isodigits[secs // 3600] + ":" \
+           + _isodigits[secs // 60 % 60] + ":" + _isodigits[secs % 60]
+
 def isotime(s):
     "Convert timestamps in ISO8661 format to and from Unix time."
     if type(s) == type(1):
-        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(s))
+        return _isoformat(s)
     elif type(s) == type(1.0):
         date = int(s)
         msec = s - date
-        date = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(s))
-        return date + "." + `msec`[2:]
+        return _isoformat(date) + "." + repr(msec)[2:]
     elif type(s) == type(""):
         if s[-1] == "Z":
             s = s[:-1]
@@ -93,9 +296,69 @@ def isotime(s):
             date = s
             msec = "0"
         # Note: no leap-second correction! 
+        if len(date) == 19 and date[10] == "T" and date[13] == ":" \
+               and date[16] == ":" and (date[11:13] + date[14:16] + date[17:]).isdigit():
+            # Fixed layout, as gpsd emits it; only the date needs parsing
+            (hour, minute, second) = (int(date[11:13]), int(date[14:16]), int(date[17:]))
+            if hour < 24 and minute < 60 and second < 62:
+                return _isoepoch(date[:10]) + hour * 3600 + minute * 60 \
+                       + second + float("0." + msec)
         return calendar.timegm(time.strptime(date, "%Y-%m-%dT%H:%M:%S")) + float("0." + msec)
     else:
         raise TypeError
 
+def isotime_array(values):
+    "Convert a sequence of timestamps with isotime() in one call."
+    # ISO8601 strings in gpsd's fixed layout, all of one length, are
+    # parsed with array arithmetic into a NumPy array of Unix times.
+    # Anything else is handed to isotime() one element at a time.
+    if numpy is None or not len(values):
+        return [isotime(v) for v in values]
+    if isinstance(values[0], basestring):
+        width = len(values[0])
+        tail = int(values[0].endswith("Z"))
+        layout = width >= 19 and (width == 19 + tail or values[0][19] == ".")
+        if layout:
+            chars = numpy.asarray(values)
+            # Shorter strings would be padded with NULs to the width
+            if chars.dtype.kind != "S" or chars.dtype.itemsize != width \
+                   or not (numpy.char.str_len(chars) == width).all():
+                layout = False
+        if layout:
+            grid = chars.view(numpy.uint8).reshape(len(values), width)
+            digits = grid[:, 11:19].astype(numpy.int64) - ord("0")
+            clock = digits[:, [0, 1, 3, 4, 6, 7]]
+            layout = ((grid[:, 10] == ord("T")) & (grid[:, 13] == ord(":"))
+                      & (grid[:, 16] == ord(":"))).all() \
+                     and ((clock >= 0) & (clock <= 9)).all()
+            if tail:
+                layout = layout and (grid[:, -1] == ord("Z")).all()
+        if not layout:
+            return numpy.array([isotime(str(v)) for v in values])
+        def field(start, end):
+            n = numpy.zeros(len(values), dtype=numpy.int64)
+            for col in range(start, end):
+                n = n * 10 + digits[:, col]
+            return n
+        (hour, minute, second) = (field(0, 2), field(3, 5), field(6, 8))
+        if not ((hour < 24) & (minute < 60) & (second < 62)).all():
+            return numpy.array([isotime(str(v)) for v in values])
+        # Each distinct date goes through the per-day cache once
+        dates = grid[:, :10].copy().view("S10").ravel()
+        (dates, which) = numpy.unique(dates, return_inverse=True)
+        midnights = numpy.array([_isoepoch(d) for d in dates.tolist()], dtype=numpy.int64)
+        secs = midnights[which] + hour * 3600 + minute * 60 + second
+        if width - tail > 19:
+            # float() on ".fff" and "0.fff" gives the same result
+            frac = grid[:, 19:width - tail].copy().view("S%d" % (width - tail - 19))
+            return secs + frac.ravel().astype(numpy.float64)
+        return secs + 0.0
+    values = numpy.asarray(values)
+    if values.dtype.kind == "f":
+        whole = numpy.trunc(values).astype(numpy.int64)
+        fracs = (values - whole).tolist()
+        return [_isoformat(d) + "." + repr(f)[2:] for (d, f) in zip(whole.tolist(), fracs)]
+    return [_isoformat(d) for d in values.tolist()]
+
 # End
 
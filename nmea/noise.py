@@ -0,0 +1,151 @@
+# noise.py - seeded sensor noise and fix loss for simulated vessels
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Make simulated fixes look like they came from a real receiver.
+
+A NoiseModel describes the error budget; each vessel draws from its own
+NoiseStream, seeded from the model's seed and the vessel's name, so a
+run with the same seed produces the same noise whatever else changes
+and however the vessels are interleaved.  Each fix gets:
+
+ - white Gaussian jitter of sigma metres per axis,
+ - a slowly wandering bias: a random walk of walk metres per fix that
+   decays back to zero with a time constant of tau fixes (tau=None
+   for a plain random walk),
+ - an HDOP that wanders the same way around hdop, scaling the jitter,
+ - now and then a multipath jump, of exponentially distributed size
+   with mean multipath_error metres, that also raises the HDOP,
+ - and fix-loss intervals, starting with probability dropout per fix
+   and lasting outage fixes on average.
+
+The noise is drawn with NumPy batch fixes at a time, so a fix costs a
+few list lookups.  next() returns (north, east, hdop, valid): the
+offsets in metres to add to the true position, the HDOP to report and
+whether the receiver has a fix at all.
+"""
+import math, zlib
+import lazy
+
+numpy = lazy.module("numpy")
+
+class NoiseModel:
+    "An error budget, and seeded per-vessel noise streams drawing from it."
+    def __init__(self, seed=0, sigma=2.5, walk=0.3, tau=120.0, hdop=1.0,
+                 hdop_walk=0.02, multipath=0.002, multipath_error=15.0,
+                 dropout=0.0005, outage=20.0, batch=256):
+        if numpy is None:
+            raise ImportError("the noise model needs NumPy")
+        self.seed = seed
+        self.sigma = sigma                      # Metres of jitter per axis
+        self.walk = walk                        # Metres of bias drift per fix
+        self.tau = tau                          # Fixes for the bias to decay, or None
+        self.hdop = hdop                        # Typical HDOP
+        self.hdop_walk = hdop_walk              # Drift of log(HDOP) per fix
+        self.multipath = multipath              # Chance of a multipath jump per fix
+        self.multipath_error = multipath_error  # Mean size of a jump in metres
+        self.dropout = dropout                  # Chance of losing the fix per fix
+        self.outage = outage                    # Mean fixes a loss lasts
+        self.batch = batch
+
+    def stream(self, name):
+        "The noise stream for one vessel."
+        return NoiseStream(self, numpy.random.RandomState([self.seed & 0xffffffff,
+                                                           zlib.crc32(str(name)) & 0xffffffff]))
+
+def _drift(rng, sigma, decay, start, shape):
+    "A random walk of sigma per step decaying by decay per step, from start."
+    steps = rng.normal(0.0, sigma, shape)
+    if decay == 1.0:
+        return start + numpy.cumsum(steps, axis=0)
+    # x[k] = decay**k * (start + sum(steps[i] / decay**i for i <= k))
+    powers = decay ** numpy.arange(1, shape[0] + 1)
+    if len(shape) > 1:
+        powers = powers[:, None]
+    return powers * (start + numpy.cumsum(steps / powers, axis=0))
+
+class NoiseStream:
+    "One vessel's noise, drawn a batch at a time."
+    def __init__(self, model, rng):
+        self.model = model
+        self.rng = rng
+        self.bias = numpy.zeros(2)      # Wandering north, east error
+        self.loghdop = 0.0              # log(HDOP / model.hdop)
+        self.lost = 0                   # Fixes left of a fix-loss interval
+        self.fixes = []
+        self.index = 0
+        self.mark = None                # What the batch was drawn from
+
+    def _where(self):
+        "The generator's state and the drifts, as plain lists and numbers."
+        (name, keys, pos, has_gauss, cached) = self.rng.get_state()
+        return [[name, keys.tolist(), pos, has_gauss, cached],
+                self.bias.tolist(), float(self.loghdop), int(self.lost)]
+
+    def state(self):
+        "Where the stream is, for a checkpoint."
+        # The batch is not saved; restore() draws it again instead.
+        if self.mark is None:
+            return {"drawn": False, "from": self._where(), "index": 0}
+        return {"drawn": True, "from": self.mark, "index": self.index}
+
+    def restore(self, state):
+        "Continue from a state() taken earlier."
+        (rng, bias, loghdop, lost) = state["from"]
+        self.rng.set_state((str(rng[0]), numpy.array(rng[1], dtype=numpy.uint32)) + tuple(rng[2:]))
+        self.bias = numpy.array(bias)
+        self.loghdop = loghdop
+        self.lost = lost
+        self.fixes = []
+        self.mark = None
+        if state["drawn"]:
+            self.refill()
+        self.index = state["index"]
+
+    def refill(self):
+        "Draw the next batch of noise."
+        self.mark = self._where()
+        model = self.model
+        rng = self.rng
+        n = model.batch
+        if model.tau:
+            decay = math.exp(-1.0 / model.tau)
+        else:
+            decay = 1.0
+        bias = _drift(rng, model.walk, decay, self.bias, (n, 2))
+        loghdop = _drift(rng, model.hdop_walk, decay, self.loghdop, (n,))
+        self.bias = bias[-1]
+        self.loghdop = loghdop[-1]
+        hdop = model.hdop * numpy.exp(loghdop)
+        jump = rng.random_sample(n) < model.multipath
+        hdop[jump] *= 1.5
+        error = bias + rng.normal(0.0, model.sigma, (n, 2)) * (hdop / model.hdop)[:, None]
+        if jump.any():
+            size = rng.exponential(model.multipath_error, jump.sum())
+            angle = rng.uniform(0.0, 2 * math.pi, jump.sum())
+            error[jump, 0] += size * numpy.cos(angle)
+            error[jump, 1] += size * numpy.sin(angle)
+        valid = numpy.ones(n, dtype=bool)
+        if self.lost:
+            valid[:self.lost] = False
+            self.lost = max(self.lost - n, 0)
+        starts = numpy.nonzero(rng.random_sample(n) < model.dropout)[0]
+        if len(starts):
+            lengths = rng.geometric(1.0 / max(model.outage, 1.0), len(starts))
+            for (start, length) in zip(starts, lengths):
+                valid[start:start + length] = False
+                self.lost = max(self.lost, start + length - n)
+        self.fixes = zip(error[:, 0].tolist(), error[:, 1].tolist(),
+                         numpy.round(hdop, 2).tolist(), valid.tolist())
+        self.index = 0
+
+    def next(self):
+        "(north metres, east metres, hdop, valid) for the next fix."
+        if self.index >= len(self.fixes):
+            self.refill()
+        fix = self.fixes[self.index]
+        self.index += 1
+        return fix
+
+# End
@@ -0,0 +1,137 @@
+# profiler.py - find where a TestSession spends its time
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Two ways to see where a session's time goes.
+
+Timers keeps a running total of the time spent in each part of the run
+loop, at the cost of a couple of clock reads per call: "feed" is the
+devices producing sentences (including their own pacing sleeps),
+"write" writing them out, "poll" the clients reading reports and
+"decode" the part of poll spent decoding JSON.  The totals are printed
+when the session ends.
+
+A Profiler runs either cProfile over the run loop or, with sampling, a
+statistical profiler that records the Python stack on every SIGPROF
+tick of CPU time.  A sampled profile is saved as collapsed stacks, one
+"outer;...;inner count" line per stack, ready for flame graph tools;
+a cProfile one is saved in pstats format.  toggle() turns profiling on
+and off, so a signal handler can profile part of a live session.
+"""
+import sys, time, signal
+
+class Timers:
+    "Cumulative time and call counts for the parts of a run loop."
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.started = time.time()
+
+    def add(self, name, seconds):
+        "Charge seconds to a part of the run loop."
+        if name in self.totals:
+            self.totals[name] += seconds
+            self.counts[name] += 1
+        else:
+            self.totals[name] = seconds
+            self.counts[name] = 1
+
+    def dump(self, stream=sys.stderr):
+        "Write the totals, largest first, with their share of the wall time."
+        elapsed = max(time.time() - self.started, 1e-9)
+        for name in sorted(self.totals, key=self.totals.get, reverse=True):
+            total = self.totals[name]
+            count = self.counts[name]
+            stream.write("gpsfake: time %-8s %10.3f s %5.1f%% %9d calls %9.1f us/call\n"
+                         % (name, total, 100.0 * total / elapsed, count, 1e6 * total / count))
+
+class Profiler:
+    "cProfile or a sampling profiler over the run loop, switched on and off."
+    def __init__(self, path, sampling=False, interval=0.001):
+        self.path = path
+        self.sampling = sampling
+        self.interval = interval    # CPU seconds between samples
+        self.running = False
+        self.used = False
+        self.timers = Timers()
+        self.profile = None
+        self.stacks = {}            # Collapsed stack -> samples
+
+    def start(self):
+        if self.running:
+            return
+        if self.sampling:
+            signal.signal(signal.SIGPROF, self.sample)
+            # Let writes and reads the tick lands in carry on
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            if self.profile is None:
+                import cProfile
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.running = True
+        self.used = True
+
+    def stop(self):
+        if not self.running:
+            return
+        if self.sampling:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        else:
+            self.profile.disable()
+        self.running = False
+
+    def toggle(self, *args):
+        "Start profiling if stopped, otherwise stop; usable as a signal handler."
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def sample(self, signum, frame):
+        "Count the stack the process was running when the tick came."
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s:%s:%d" % (code.co_filename.rsplit("/", 1)[-1],
+                                       code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        names.reverse()
+        stack = ";".join(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def save(self):
+        "Write the profile to the profile file, if there is one to write."
+        if not self.used:
+            return
+        self.stop()
+        if self.sampling:
+            fp = open(self.path, "w")
+            try:
+                for (stack, count) in sorted(self.stacks.items()):
+                    fp.write("%s %d\n" % (stack, count))
+            finally:
+                fp.close()
+        else:
+            self.profile.dump_stats(self.path)
+
+    def report(self, stream=sys.stderr, limit=15):
+        "Write the most expensive functions, or the most sampled stacks."
+        if not self.used:
+            return
+        if self.sampling:
+            total = sum(self.stacks.values()) or 1
+            leaves = {}
+            for (stack, count) in self.stacks.items():
+                leaf = stack.rsplit(";", 1)[-1]
+                leaves[leaf] = leaves.get(leaf, 0) + count
+            for leaf in sorted(leaves, key=leaves.get, reverse=True)[:limit]:
+                stream.write("gpsfake: profile %5.1f%% %s\n" % (100.0 * leaves[leaf] / total, leaf))
+        else:
+            import pstats
+            pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+
+# End
@@ -0,0 +1,92 @@
+# ramp.py - find the sentence rate a daemon and its clients can sustain
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+Step the rate sentences are offered at up until the consumer saturates.
+
+A TestSession driven by a Ramp writes sentences round the fake GPSes at
+a fixed aggregate rate, each device in turn when it falls due, instead
+of each at its own pace.  After a settling time it counts, for the
+dwell time of the step, the sentences written and the ones its clients
+got back with "nmea":true.  A step is sustained if the devices managed
+to write at (nearly) the offered rate, the clients got (nearly) all of
+it back and, with a latency limit, the p99 latency stayed under it.
+The rate is multiplied by the factor for the next step; the first step
+that is not sustained is the knee and ends the ramp.
+
+The result is the highest rate the clients received at on a sustained
+step, and per step the rates and, with a LatencyHarness on the session,
+the latency percentiles, which together are the latency curve.
+"""
+import sys
+
+class Ramp:
+    "Offered rates for a load ramp, and how each step went."
+    def __init__(self, start=50.0, factor=1.5, dwell=5.0, settle=1.0,
+                 tolerance=0.95, limit=None, ceiling=None):
+        self.start = start          # Sentences per second, all devices together
+        self.factor = factor        # Rate multiplier from one step to the next
+        self.dwell = dwell          # Seconds measured per step
+        self.settle = settle        # Seconds run before measuring each step
+        self.tolerance = tolerance  # Fraction of the offered rate to keep up with
+        self.limit = limit          # p99 latency that fails a step, or None
+        self.ceiling = ceiling      # Highest rate to try, or None
+        self.levels = []
+        self.knee = None
+
+    def rates(self):
+        "Yield the offered rate of each step until one is not sustained."
+        rate = float(self.start)
+        while self.knee is None and (self.ceiling is None or rate <= self.ceiling):
+            yield rate
+            rate *= self.factor
+
+    def record(self, rate, emitted, received, elapsed, latency=None):
+        "Judge a step from the sentences written and echoed in elapsed seconds."
+        level = {"rate": rate,
+                 "emitted": emitted / elapsed,
+                 "received": received / elapsed,
+                 "lost": max(emitted - received, 0),
+                 "p50": None,
+                 "p99": None}
+        if latency:
+            level["p50"] = latency["p50"]
+            level["p99"] = latency["p99"]
+        level["sustained"] = (level["emitted"] >= self.tolerance * rate
+                              and received >= self.tolerance * emitted
+                              and (self.limit is None or level["p99"] is None
+                                   or level["p99"] <= self.limit))
+        self.levels.append(level)
+        if not level["sustained"]:
+            self.knee = level
+        return level
+
+    def sustained(self):
+        "The highest rate received on a sustained step, or 0.0."
+        return max([level["received"] for level in self.levels if level["sustained"]] or [0.0])
+
+    def report(self):
+        "The result as {'sustained': rate, 'knee': rate or None, 'levels': [...]}."
+        return {"sustained": self.sustained(),
+                "knee": self.knee and self.knee["rate"],
+                "levels": self.levels}
+
+    def dump(self, stream=sys.stderr):
+        "Write one line per step and the result."
+        for level in self.levels:
+            if level["p99"] is None:
+                latency = ""
+            else:
+                latency = " p50 %.6f p99 %.6f" % (level["p50"], level["p99"])
+            stream.write("gpsfake: ramp %.1f/s: wrote %.1f/s received %.1f/s lost %d%s%s\n"
+                         % (level["rate"], level["emitted"], level["received"],
+                            level["lost"], latency,
+                            (not level["sustained"]) and " (knee)" or ""))
+        if self.knee is None:
+            stream.write("gpsfake: ramp: no knee found, sustained %.1f/s\n" % self.sustained())
+        else:
+            stream.write("gpsfake: ramp: sustained %.1f/s, knee at %.1f/s\n"
+                         % (self.sustained(), self.knee["rate"]))
+
+# End
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# ring.py - a shared-memory ring of sentences for same-host consumers
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A ring buffer of sentences in a memory-mapped file, written by one
+process and read by any number of others, without locks or syscalls
+per sentence.  By default the file lives in /dev/shm, so it is plain
+shared memory.
+
+The file starts with a header holding the ring's capacity and the head,
+the running count of bytes ever written, followed by a table of device
+names and then the ring itself.  Each record is an 8-byte header (the
+sentence length and device id) and the sentence, padded to a multiple
+of 8 bytes.  A record that would not fit before the end of the ring is
+preceded by a wrap marker and written at the start instead.
+
+The writer first moves a reserve mark past the record it is about to
+store, then stores it, then moves the head past it, so every record
+before the head is complete.  A reader keeps its own position, reads up
+to the head and then checks against the reserve that the writer has not
+come round and overwritten what it read; records it lost that way, or
+by falling more than a ring behind, are counted and skipped.
+
+Readers get records as buffers on the mapped ring, not copies.  A
+buffer is only good until the writer comes round the ring again, so use
+or copy it before then.  Run this module on a ring to follow it:
+
+    python ring.py [-c] ringfile
+"""
+import os, sys, time, mmap, struct, exceptions
+from client import json
+
+MAGIC = "NMEARNG1"
+HEADER = struct.Struct("<8sQQQQ")   # magic, capacity, head, reserve, names length
+HEAD_OFFSET = 16
+RESERVE_OFFSET = 24
+NAMES_LENGTH_OFFSET = 32
+NAMES_OFFSET = 64
+DATA_OFFSET = 4096
+RECORD = struct.Struct("<II")       # sentence length, device id
+WRAP = 0xffffffff                   # A length that means "continue at the start"
+
+def _align(n):
+    return (n + 7) & ~7
+
+class RingError(exceptions.Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+class RingWriter:
+    "Write sentences into a shared-memory ring."
+    def __init__(self, path, capacity=1 << 24):
+        if capacity % 8 or capacity < 64:
+            raise RingError("ring capacity must be a multiple of 8, at least 64")
+        if not os.path.dirname(path) and os.path.isdir("/dev/shm"):
+            path = os.path.join("/dev/shm", path)
+        self.path = path
+        self.capacity = capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, DATA_OFFSET + capacity)
+            self.mm = mmap.mmap(fd, DATA_OFFSET + capacity)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.mm, 0, MAGIC, capacity, 0, 0, 0)
+        self.head = 0
+        self.names = []
+
+    def device(self, name):
+        "Return the id for a device name, adding it to the name table."
+        if name in self.names:
+            return self.names.index(name)
+        names = json.dumps(self.names + [name])
+        if NAMES_OFFSET + len(names) > DATA_OFFSET:
+            raise RingError("too many devices for the ring's name table")
+        self.mm[NAMES_OFFSET:NAMES_OFFSET + len(names)] = names
+        struct.pack_into("<Q", self.mm, NAMES_LENGTH_OFFSET, len(names))
+        self.names.append(name)
+        return len(self.names) - 1
+
+    def write(self, line, device=0):
+        "Append a sentence to the ring."
+        size = _align(RECORD.size + len(line))
+        capacity = self.capacity
+        if size > capacity:
+            raise RingError("a %d byte sentence does not fit the ring" % len(line))
+        mm = self.mm
+        head = self.head
+        offset = head % capacity
+        wrap = offset + size > capacity
+        if wrap:
+            head += capacity - offset
+        # Tell readers what is about to be overwritten, store the
+        # record, and only then publish it.
+        struct.pack_into("<Q", mm, RESERVE_OFFSET, head + size)
+        if wrap:
+            RECORD.pack_into(mm, DATA_OFFSET + offset, WRAP, 0)
+            offset = 0
+        self.head = head + size
+        start = DATA_OFFSET + offset
+        RECORD.pack_into(mm, start, len(line), device)
+        mm[start + RECORD.size:start + RECORD.size + len(line)] = line
+        struct.pack_into("<Q", mm, HEAD_OFFSET, self.head)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+class RingReader:
+    "Read sentences from a shared-memory ring, following the writer."
+    def __init__(self, path, oldest=False):
+        if not os.path.exists(path) and os.path.exists(os.path.join("/dev/shm", path)):
+            path = os.path.join("/dev/shm", path)
+        self.path = path
+        fp = open(path, "rb")
+        try:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        (magic, self.capacity, head, reserve, length) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise RingError("%s is not a sentence ring" % path)
+        # Records can only be found from the start or from the head
+        if oldest and head <= self.capacity:
+            self.tail = 0
+        else:
+            self.tail = head
+        self.lost = 0       # Bytes of records skipped for being overwritten
+
+    def head(self, offset=HEAD_OFFSET):
+        "The writer's head (or reserve), read until two reads agree."
+        mm = self.mm
+        while True:
+            head = struct.unpack_from("<Q", mm, offset)[0]
+            if struct.unpack_from("<Q", mm, offset)[0] == head:
+                return head
+
+    def names(self):
+        "The device names, indexed by device id."
+        length = struct.unpack_from("<Q", self.mm, NAMES_LENGTH_OFFSET)[0]
+        return json.loads(self.mm[NAMES_OFFSET:NAMES_OFFSET + length])
+
+    def records(self):
+        "Return [(device, sentence buffer), ...] for everything written since the last call."
+        mm = self.mm
+        capacity = self.capacity
+        unpack = RECORD.unpack_from
+        head = self.head()
+        pos = self.tail
+        if head - pos > capacity:
+            self.lost += head - pos
+            pos = head
+        found = []
+        starts = []
+        while pos < head:
+            offset = pos % capacity
+            (length, device) = unpack(mm, DATA_OFFSET + offset)
+            if length == WRAP:
+                pos += capacity - offset
+                continue
+            if length > capacity - offset - RECORD.size:
+                # Overwritten under us
+                self.lost += head - pos
+                pos = head
+                break
+            starts.append(pos)
+            found.append((device, buffer(mm, DATA_OFFSET + offset + RECORD.size, length)))
+            pos += _align(RECORD.size + length)
+        # Anything the writer came round to while we read is suspect
+        floor = self.head(RESERVE_OFFSET) - capacity
+        if starts and starts[0] < floor:
+            keep = 0
+            while keep < len(starts) and starts[keep] < floor:
+                keep += 1
+            if keep < len(starts):
+                self.lost += starts[keep] - starts[0]
+            else:
+                self.lost += pos - starts[0]
+            found = found[keep:]
+        self.tail = pos
+        return found
+
+    def follow(self, interval=0.001):
+        "Yield (device, sentence buffer) forever, polling for new records."
+        while True:
+            found = self.records()
+            if not found:
+                time.sleep(interval)
+            for record in found:
+                yield record
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+if __name__ == '__main__':
+    import getopt
+    (options, arguments) = getopt.getopt(sys.argv[1:], "c")
+    count = False
+    for (switch, val) in options:
+        if switch == '-c':
+            count = True
+    if len(arguments) != 1:
+        sys.stderr.write("usage: ring.py [-c] ringfile\n")
+        sys.exit(1)
+    reader = RingReader(arguments[0])
+    try:
+        if count:
+            # Print the sentence rate once a second
+            (total, mark) = (0, time.time())
+            while True:
+                total += len(reader.records())
+                now = time.time()
+                if now - mark >= 1.0:
+                    sys.stdout.write("%.0f sentences/s, %d bytes lost\n" % (total / (now - mark), reader.lost))
+                    sys.stdout.flush()
+                    (total, mark) = (0, now)
+                time.sleep(0.001)
+        else:
+            names = reader.names()
+            for (device, sentence) in reader.follow():
+                if device >= len(names):
+                    names = reader.names()
+                sys.stdout.write("%s %s" % (names[device], sentence))
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+
+# End
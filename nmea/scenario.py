@@ -0,0 +1,182 @@
+# scenario.py - load fleets of simulated vessels from scenario files
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A scenario file is a JSON object describing routes and the vessels
+sailing them:
+
+{
+    "routes": {
+        "roundtrip": {"start": [58.1388066666, 11.83308166666],
+                      "legs": [[50, 180, 5.0], [103, 134, 8.0], ...]}
+    },
+    "vessels": [
+        {"name": "pilot", "route": "roundtrip", "time": 1330759883,
+         "offset": 0, "sentences": ["RMC"], "rate": 1.0},
+        {"name": "ferry", "route": "roundtrip", "count": 100, "stagger": 30}
+    ]
+}
+
+Each leg is [length in seconds, course in degrees, speed in knots].  A
+vessel may give "start" and "legs" itself instead of naming a route.
+"time" is the simulated Unix time the vessel starts at, "offset" how
+many seconds into its route it starts, "sentences" the sentence profile
+it emits ("RMC", "GGA", and "GSA" and "GSV" from a simulated
+constellation) and "rate" how many fixes it emits per wall-clock
+second.  Every fix is still one simulated second on, so a rate above 1
+runs the vessel's clock faster than real time.  "count"
+launches that many copies of the vessel, each "stagger" seconds further
+along the route than the one before it.  "noise", an object of
+noise.NoiseModel parameters such as {"seed": 1, "sigma": 3.0}, adds
+receiver noise and fix loss; every copy gets its own stream.
+
+Loading a scenario compiles it: routes become ShipPlans with their leg
+index and leg endpoints precomputed, and vessels become plain tuples.
+The compiled form is pickled next to the scenario file and reused for
+as long as the scenario file is unchanged.
+"""
+import os, exceptions, hashlib, cPickle
+from client import json
+from fake import ShipPlan, GPSSimulator
+
+# Sentences the simulator knows how to emit
+SENTENCES = ("RMC", "GGA", "GSA", "GSV")
+
+# Parameters a vessel's "noise" may set, as for noise.NoiseModel
+NOISE = ("seed", "sigma", "walk", "tau", "hdop", "hdop_walk", "multipath",
+         "multipath_error", "dropout", "outage")
+
+# Bumped whenever the pickled layout changes
+CACHE_VERSION = 2
+
+class ScenarioError(exceptions.Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+class Scenario:
+    "A compiled scenario: shared route plans plus one record per vessel."
+    def __init__(self, name):
+        self.name = name
+        self.plans = []         # ShipPlans, shared between vessels
+        # (name, plan index, start time, offset, sentences, period, noise)
+        self.vessels = []
+
+    def simulators(self, cache=None, sky=None, policy=None):
+        "Yield a (name, GPSSimulator) pair for each vessel."
+        for (name, plan, when, offset, sentences, period, noise) in self.vessels:
+            if sky is None and ("GSA" in sentences or "GSV" in sentences):
+                # One constellation for the fleet, so vessels share its sky
+                import constellation
+                sky = constellation.Constellation()
+            if noise is not None:
+                import noise as sensor
+                noise = sensor.NoiseModel(**noise).stream(name)
+            sim = GPSSimulator(currtime=when, shipplan=self.plans[plan],
+                               cache=cache, period=period, sky=sky,
+                               sentences=sentences, noise=noise, policy=policy)
+            if offset:
+                sim.seek(offset)
+            yield (name, sim)
+
+def _plan(name, spec):
+    try:
+        (lat, lon) = spec["start"]
+        plan = ShipPlan(latitude=float(lat), longitude=float(lon))
+        for (length, course, speed) in spec["legs"]:
+            plan.addLeg(length=int(length), course=float(course), speed=float(speed))
+    except (KeyError, TypeError, ValueError):
+        raise ScenarioError("bad route %s" % name)
+    if not plan.isCyclic():
+        raise ScenarioError("route %s needs legs of positive length" % name)
+    plan.endpoints()
+    return plan
+
+def compile_scenario(text, name="scenario"):
+    "Compile the JSON text of a scenario."
+    try:
+        spec = json.loads(text)
+    except ValueError, e:
+        raise ScenarioError("%s: %s" % (name, e))
+    scenario = Scenario(name)
+    routes = {}
+    for (route, routespec) in spec.get("routes", {}).items():
+        routes[route] = len(scenario.plans)
+        scenario.plans.append(_plan(route, routespec))
+    for (i, vessel) in enumerate(spec.get("vessels", [])):
+        vname = str(vessel.get("name", "vessel%d" % i))
+        if "route" in vessel:
+            if vessel["route"] not in routes:
+                raise ScenarioError("vessel %s sails unknown route %s" % (vname, vessel["route"]))
+            plan = routes[vessel["route"]]
+        else:
+            plan = len(scenario.plans)
+            scenario.plans.append(_plan(vname, vessel))
+        sentences = tuple(str(s) for s in vessel.get("sentences", ["RMC"]))
+        for s in sentences:
+            if s not in SENTENCES:
+                raise ScenarioError("vessel %s wants unsupported sentence %s" % (vname, s))
+        try:
+            when = int(vessel.get("time", 1330759883))
+            offset = int(vessel.get("offset", 0))
+            period = 1.0 / float(vessel.get("rate", 1.0))
+            count = int(vessel.get("count", 1))
+            stagger = int(vessel.get("stagger", 0))
+            noise = vessel.get("noise")
+            if noise is not None:
+                noise = dict((str(k), v) for (k, v) in noise.items())
+                for k in noise:
+                    if k not in NOISE:
+                        raise ScenarioError("vessel %s has unknown noise parameter %s" % (vname, k))
+                    if k == "seed":
+                        noise[k] = int(noise[k])
+                    elif k != "tau" or noise[k] is not None:
+                        # A null tau asks for a plain random walk
+                        noise[k] = float(noise[k])
+        except (TypeError, ValueError, ZeroDivisionError, AttributeError):
+            raise ScenarioError("bad parameters for vessel %s" % vname)
+        for n in range(count):
+            if count > 1:
+                copy = "%s-%d" % (vname, n)
+            else:
+                copy = vname
+            scenario.vessels.append((copy, plan, when, offset + n * stagger, sentences, period, noise))
+    if not scenario.vessels:
+        raise ScenarioError("%s has no vessels" % name)
+    return scenario
+
+def load(path, cachepath=None):
+    "Load a scenario file, through its compiled cache when that is current."
+    if cachepath is None:
+        cachepath = path + ".cache"
+    try:
+        fp = open(path, "rb")
+        text = fp.read()
+        fp.close()
+    except IOError:
+        raise ScenarioError("can't read %s" % path)
+    digest = hashlib.sha1(text).hexdigest()
+    try:
+        fp = open(cachepath, "rb")
+        try:
+            (version, cached, scenario) = cPickle.load(fp)
+        finally:
+            fp.close()
+        if version == CACHE_VERSION and cached == digest:
+            return scenario
+    except (IOError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+        pass
+    scenario = compile_scenario(text, path)
+    try:
+        tmp = cachepath + ".%d" % os.getpid()
+        fp = open(tmp, "wb")
+        try:
+            cPickle.dump((CACHE_VERSION, digest, scenario), fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp, cachepath)
+    except (IOError, OSError):
+        pass        # A read-only scenario directory just means no cache
+    return scenario
+
+# End
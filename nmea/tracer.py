@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# tracer.py - binary event trace for TestSession runs
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A TraceBuffer records fixed-size binary events into a preallocated ring:
+a timestamp, a small device id, an event type and a length.  Recording
+does no string formatting, so it can stay on during load tests; the
+ring just keeps the most recent events once it is full.
+
+Save the ring with TraceBuffer.save() and run this module on the file
+to decode it:
+
+    python tracer.py [-t] [-s step] tracefile
+
+prints one line per event, or with -t a timeline of events per device
+per step seconds.
+
+Timestamps come from time.monotonic() where the interpreter has it and
+from time.time() otherwise.
+"""
+import sys, time, struct
+from client import json
+
+# Event types
+EVENT_FEED = 1          # A fake GPS emitted a sentence of the given length
+EVENT_POLL = 2          # A client read a report of the given length
+EVENT_ADD = 3           # A fake GPS or client was added
+EVENT_REMOVE = 4        # A fake GPS or client was removed
+EVENT_EXHAUSTED = 5     # A fake GPS ran out of input
+EVENT_DROP = 6          # A sink discarded data of the given length
+
+EVENT_NAMES = {
+    EVENT_FEED: "feed",
+    EVENT_POLL: "poll",
+    EVENT_ADD: "add",
+    EVENT_REMOVE: "remove",
+    EVENT_EXHAUSTED: "exhausted",
+    EVENT_DROP: "drop",
+}
+
+RECORD = struct.Struct("<dHHI")     # time, device, event, length
+MAGIC = "NMEATRC1"
+HEADER = struct.Struct("<8sQQI")    # magic, records, dropped, names length
+
+clock = getattr(time, "monotonic", time.time)
+
+class TraceBuffer:
+    "Ring buffer of binary trace records."
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0          # Records ever written, including overwritten ones
+        self.names = []         # Device id -> name
+        self.ids = {}
+
+    def device(self, name):
+        "Return the id for a device or client name, assigning one if needed."
+        tid = self.ids.get(name)
+        if tid is None:
+            tid = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return tid
+
+    def record(self, event, device, length=0):
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size,
+                         clock(), device, event, length)
+        self.count += 1
+
+    def records(self):
+        "Yield (time, device, event, length) tuples, oldest first."
+        first = max(0, self.count - self.capacity)
+        for n in xrange(first, self.count):
+            yield RECORD.unpack_from(self.buffer, (n % self.capacity) * RECORD.size)
+
+    def save(self, path):
+        "Write the ring, oldest record first, to a trace file."
+        kept = min(self.count, self.capacity)
+        names = json.dumps(self.names)
+        fp = open(path, "wb")
+        try:
+            fp.write(HEADER.pack(MAGIC, kept, self.count - kept, len(names)))
+            fp.write(names)
+            start = (self.count - kept) % self.capacity * RECORD.size
+            # The ring is in two pieces once it has wrapped
+            if self.count > self.capacity:
+                fp.write(buffer(self.buffer, start))
+                fp.write(buffer(self.buffer, 0, start))
+            else:
+                fp.write(buffer(self.buffer, 0, kept * RECORD.size))
+        finally:
+            fp.close()
+
+def load(path):
+    "Read a trace file, returning (names, dropped, records)."
+    fp = open(path, "rb")
+    try:
+        (magic, kept, dropped, namelen) = HEADER.unpack(fp.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a trace file" % path)
+        names = json.loads(fp.read(namelen))
+        data = fp.read(kept * RECORD.size)
+    finally:
+        fp.close()
+    records = [RECORD.unpack_from(data, n * RECORD.size) for n in xrange(len(data) // RECORD.size)]
+    return (names, dropped, records)
+
+def text(names, records, out):
+    "One line per event, times relative to the first."
+    if not records:
+        return
+    origin = records[0][0]
+    for (when, device, event, length) in records:
+        out.write("%12.6f %-9s %5d %s\n" % (when - origin, EVENT_NAMES.get(event, event),
+                                           length, names[device]))
+
+def timeline(names, records, out, step=1.0):
+    "Events per device for each step seconds, one row per step."
+    if not records:
+        return
+    origin = records[0][0]
+    rows = {}
+    for (when, device, event, length) in records:
+        if event in (EVENT_FEED, EVENT_POLL):
+            row = rows.setdefault(int((when - origin) / step), {})
+            row[device] = row.get(device, 0) + 1
+    if not rows:
+        return
+    devices = sorted(set(d for row in rows.values() for d in row))
+    out.write("%10s %s\n" % ("time", " ".join("%10s" % names[d][-10:] for d in devices)))
+    for n in range(max(rows) + 1):
+        row = rows.get(n, {})
+        out.write("%10.1f %s\n" % (n * step, " ".join("%10d" % row.get(d, 0) for d in devices)))
+
+if __name__ == '__main__':
+    import getopt
+    (options, arguments) = getopt.getopt(sys.argv[1:], "ts:")
+    show = text
+    step = 1.0
+    for (switch, val) in options:
+        if switch == '-t':
+            show = timeline
+        elif switch == '-s':
+            step = float(val)
+    if len(arguments) != 1:
+        sys.stderr.write("usage: tracer.py [-t] [-s step] tracefile\n")
+        sys.exit(1)
+    (names, dropped, records) = load(arguments[0])
+    if dropped:
+        sys.stderr.write("tracer: %d earlier records were overwritten\n" % dropped)
+    if show == timeline:
+        timeline(names, records, sys.stdout, step)
+    else:
+        text(names, records, sys.stdout)
+
+# End
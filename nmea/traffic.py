@@ -0,0 +1,236 @@
+# traffic.py - proximity and closest-point-of-approach queries over a fleet
+#
+# This file is Copyright (c) 2012 by Anders Arnholm
+# BSD terms apply: see the file COPYING in the distribution root for details.
+"""
+A spatial index over the current positions of simulated vessels, for
+building traffic scenarios and checking collision alerts against them.
+
+Positions are put on a sphere of the Earth's mean radius and binned
+into cubes of cell metres of Earth-centred coordinates.  The straight
+line between two points is never longer than the great circle, so
+vessels within d metres of each other are never more than ceil(d/cell)
+cubes apart on any axis, and a query only compares vessels in nearby
+cubes.  This works the same at the poles and across the date line.
+Candidate pairs are then measured with the misc geodesy in one NumPy
+call, so finding all close pairs in a fleet costs roughly linear time
+instead of comparing every vessel with every other.
+
+Adding and removing vessels is cheap; the index catches up on the next
+query.  update() reads the positions, courses and speeds of the vessels again
+and moves only the vessels that changed cube, so it is cheap to call
+every tick.  A TestSession given an index puts its scenario vessels in
+it, under their device names, and keeps it up to date with tick().  cpa() widens the search by the distance the fastest vessel
+can cover in the time horizon, and computes closest approach on a local
+flat projection with courses and speeds held constant.
+"""
+import math, time
+import lazy
+from misc import EARTH_MEAN_RADIUS, KNOTS_TO_MPS, HaversineDistanceArray
+
+numpy = lazy.module("numpy")
+
+class VesselIndex:
+    "A grid of vessels by position, answering proximity and CPA queries."
+    def __init__(self, cell=1000.0, interval=1.0):
+        if numpy is None:
+            raise ImportError("the vessel index needs NumPy")
+        self.cell = float(cell)     # Cube size in metres
+        self.interval = interval    # Seconds between updates on tick()
+        self.next_update = 0
+        self.names = []             # Slot -> vessel name
+        self.sims = []              # Slot -> GPSSimulator
+        self.slots = {}             # Vessel name -> slot
+        self.keys = []              # Slot -> cube
+        self.cubes = {}             # Cube -> set of slots
+        self.latitude = numpy.zeros(0)
+        self.longitude = numpy.zeros(0)
+        self.heading = numpy.zeros(0)
+        self.speed = numpy.zeros(0)
+        self.moved = 0              # Vessels that changed cube on update()
+        self.stale = False          # Vessels added or removed since update()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, sim):
+        "Index a vessel; sim is a GPSSimulator, or anything with its position."
+        if name in self.slots:
+            self.remove(name)
+        self.slots[name] = len(self.names)
+        self.names.append(name)
+        self.sims.append(sim)
+        self.keys.append(None)
+        self.stale = True
+
+    def remove(self, name):
+        "Stop indexing a vessel."
+        slot = self.slots.pop(name)
+        # Vessels added since the last update() are in no cube yet
+        key = self.keys[slot]
+        if key is not None:
+            self.cubes[key].discard(slot)
+            if not self.cubes[key]:
+                del self.cubes[key]
+        last = len(self.names) - 1
+        if slot != last:
+            # Move the last vessel into the freed slot
+            moved = self.names[last]
+            if self.keys[last] is not None:
+                self.cubes[self.keys[last]].discard(last)
+                self.cubes[self.keys[last]].add(slot)
+            self.names[slot] = moved
+            self.sims[slot] = self.sims[last]
+            self.keys[slot] = self.keys[last]
+            self.slots[moved] = slot
+        del self.names[last]
+        del self.sims[last]
+        del self.keys[last]
+        self.stale = True
+
+    def _cubes(self, lat, lon):
+        "The cubes of arrays of positions, as an (n, 3) integer array."
+        lat = numpy.radians(lat)
+        lon = numpy.radians(lon)
+        xyz = numpy.column_stack((numpy.cos(lat) * numpy.cos(lon),
+                                  numpy.cos(lat) * numpy.sin(lon),
+                                  numpy.sin(lat)))
+        return numpy.floor(xyz * (EARTH_MEAN_RADIUS / self.cell)).astype(numpy.int64)
+
+    def update(self):
+        "Read the vessels' positions again and move the ones that changed cube."
+        sims = self.sims
+        self.latitude = numpy.array([sim._latitude for sim in sims], dtype=numpy.float64)
+        self.longitude = numpy.array([sim._longitude for sim in sims], dtype=numpy.float64)
+        self.heading = numpy.array([sim._heading for sim in sims], dtype=numpy.float64)
+        self.speed = numpy.array([sim._speed for sim in sims], dtype=numpy.float64)
+        moved = 0
+        if sims:
+            keys = self.keys
+            cubes = self.cubes
+            for (slot, key) in enumerate(map(tuple, self._cubes(self.latitude, self.longitude).tolist())):
+                old = keys[slot]
+                if key != old:
+                    if old is not None:
+                        cubes[old].discard(slot)
+                        if not cubes[old]:
+                            del cubes[old]
+                    cubes.setdefault(key, set()).add(slot)
+                    keys[slot] = key
+                    moved += 1
+        self.moved = moved
+        self.stale = False
+
+    def tick(self, now=None):
+        "Update the index if the update interval has passed."
+        if now is None:
+            now = time.time()
+        if now >= self.next_update:
+            self.update()
+            self.next_update = now + self.interval
+
+    def _binned(self, reach):
+        "The cubes, binned reach times larger for a search reach cells wide."
+        if reach <= 1:
+            return self.cubes
+        cubes = {}
+        for (key, members) in self.cubes.iteritems():
+            (x, y, z) = key
+            cubes.setdefault((x // reach, y // reach, z // reach), set()).update(members)
+        return cubes
+
+    def _candidates(self, distance):
+        "Arrays (i, j), i < j, of the slots in cubes near enough to be within distance."
+        cubes = self._binned(int(math.ceil(distance / self.cell)))
+        # Each pair of cubes once: offsets after (0, 0, 0) in lexical order
+        offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                   if (dx, dy, dz) > (0, 0, 0)]
+        firsts = []
+        seconds = []
+        for (key, members) in cubes.iteritems():
+            here = list(members)
+            if len(here) > 1:
+                for (n, i) in enumerate(here):
+                    firsts.extend([i] * (len(here) - n - 1))
+                    seconds.extend(here[n + 1:])
+            (x, y, z) = key
+            for (dx, dy, dz) in offsets:
+                there = cubes.get((x + dx, y + dy, z + dz))
+                if there:
+                    for i in here:
+                        firsts.extend([i] * len(there))
+                        seconds.extend(there)
+        i = numpy.array(firsts, dtype=numpy.int64)
+        j = numpy.array(seconds, dtype=numpy.int64)
+        return (numpy.minimum(i, j), numpy.maximum(i, j))
+
+    def pairs(self, distance):
+        "[(name, name, metres), ...] for all vessels within distance of each other."
+        if self.stale:
+            self.update()
+        (i, j) = self._candidates(distance)
+        if not len(i):
+            return []
+        lat = self.latitude
+        lon = self.longitude
+        d = HaversineDistanceArray((lat[i], lon[i]), (lat[j], lon[j]))
+        close = numpy.nonzero(d <= distance)[0]
+        names = self.names
+        return sorted([(names[i[n]], names[j[n]], float(d[n])) for n in close],
+                      key=lambda pair: pair[2])
+
+    def near(self, latitude, longitude, distance):
+        "[(name, metres), ...] for the vessels within distance of a point."
+        if self.stale:
+            self.update()
+        reach = max(int(math.ceil(distance / self.cell)), 1)
+        cubes = self._binned(reach)
+        (x, y, z) = self._cubes(numpy.array([latitude]), numpy.array([longitude]))[0]
+        (x, y, z) = (x // reach, y // reach, z // reach)
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    found.extend(cubes.get((x + dx, y + dy, z + dz), ()))
+        if not found:
+            return []
+        found = numpy.array(found, dtype=numpy.int64)
+        d = HaversineDistanceArray((latitude, longitude), (self.latitude[found], self.longitude[found]))
+        return sorted([(self.names[found[n]], float(d[n])) for n in numpy.nonzero(d <= distance)[0]],
+                      key=lambda hit: hit[1])
+
+    def cpa(self, distance, horizon):
+        "[(name, name, cpa metres, tcpa seconds), ...] for pairs passing within distance in horizon seconds."
+        if self.stale:
+            self.update()
+        if not len(self.names):
+            return []
+        fastest = self.speed.max() * KNOTS_TO_MPS
+        (i, j) = self._candidates(distance + 2 * fastest * horizon)
+        if not len(i):
+            return []
+        lat = numpy.radians(self.latitude)
+        lon = numpy.radians(self.longitude)
+        # Where j is from i, in metres east and north
+        dlon = (lon[j] - lon[i] + math.pi) % (2 * math.pi) - math.pi
+        east = dlon * numpy.cos((lat[i] + lat[j]) / 2) * EARTH_MEAN_RADIUS
+        north = (lat[j] - lat[i]) * EARTH_MEAN_RADIUS
+        course = numpy.radians(self.heading)
+        speed = self.speed * KNOTS_TO_MPS
+        ve = speed * numpy.sin(course)
+        vn = speed * numpy.cos(course)
+        # How j moves relative to i
+        rve = ve[j] - ve[i]
+        rvn = vn[j] - vn[i]
+        closing = rve * rve + rvn * rvn
+        tcpa = numpy.zeros(len(i))
+        moving = closing > 0
+        tcpa[moving] = -(east[moving] * rve[moving] + north[moving] * rvn[moving]) / closing[moving]
+        tcpa = numpy.clip(tcpa, 0, horizon)
+        dcpa = numpy.hypot(east + rve * tcpa, north + rvn * tcpa)
+        names = self.names
+        return sorted([(names[i[n]], names[j[n]], float(dcpa[n]), float(tcpa[n]))
+                       for n in numpy.nonzero(dcpa <= distance)[0]],
+                      key=lambda pair: pair[3])
+
+# End
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.noise sensor noise model """
+
+import nmea.noise
+import nmea.scenario
+import nmea.fake
+import unittest, math, json
+
+WHEN = 1330759883
+
+class TestNoiseStream(unittest.TestCase):
+    def testReproducible(self):
+        model = nmea.noise.NoiseModel(seed=42)
+        first = [model.stream("ferry").next() for n in range(1)]
+        a = model.stream("ferry")
+        b = nmea.noise.NoiseModel(seed=42).stream("ferry")
+        fixes = [a.next() for n in range(600)]
+        self.assertEquals(fixes, [b.next() for n in range(600)])
+        self.assertEquals(first[0], fixes[0])
+        self.assertNotEqual(fixes, [model.stream("pilot").next() for n in range(600)])
+        self.assertNotEqual(fixes, [nmea.noise.NoiseModel(seed=43).stream("ferry").next() for n in range(600)])
+
+    def testJitter(self):
+        model = nmea.noise.NoiseModel(sigma=5.0, walk=0.0, hdop_walk=0.0, multipath=0.0, dropout=0.0)
+        stream = model.stream("a")
+        fixes = [stream.next() for n in range(20000)]
+        for axis in (0, 1):
+            values = [fix[axis] for fix in fixes]
+            mean = sum(values) / len(values)
+            sd = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+            self.assertTrue(abs(mean) < 0.2)
+            self.assertTrue(4.8 < sd < 5.2)
+        self.assertEquals(set([1.0]), set(fix[2] for fix in fixes))
+        self.assertTrue(all(fix[3] for fix in fixes))
+
+    def testWalkDecays(self):
+        model = nmea.noise.NoiseModel(sigma=0.0, walk=1.0, tau=10.0, multipath=0.0, dropout=0.0)
+        stream = model.stream("a")
+        north = [stream.next()[0] for n in range(20000)]
+        # A decaying walk stays near its stationary spread of walk/sqrt(1-decay**2)
+        spread = 1.0 / math.sqrt(1 - math.exp(-0.2))
+        sd = math.sqrt(sum(v * v for v in north) / len(north))
+        self.assertTrue(0.8 * spread < sd < 1.2 * spread)
+        # and is smooth from one fix, and one batch, to the next
+        steps = [abs(north[n + 1] - north[n]) for n in range(len(north) - 1)]
+        self.assertTrue(max(steps) < 6.0)
+
+    def testOutages(self):
+        model = nmea.noise.NoiseModel(dropout=0.002, outage=400.0, batch=64)
+        stream = model.stream("a")
+        valid = [stream.next()[3] for n in range(50000)]
+        self.assertTrue(False in valid)
+        # Runs of lost fixes, many longer than a batch
+        runs = []
+        length = 0
+        for v in valid + [True]:
+            if v:
+                if length:
+                    runs.append(length)
+                length = 0
+            else:
+                length += 1
+        self.assertTrue(max(runs) > 64)
+
+class TestNoisySimulator(unittest.TestCase):
+    def testPerturbed(self):
+        model = nmea.noise.NoiseModel(seed=1, sigma=20.0, dropout=0.0)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.70723, longitude=11.695213333333333,
+                                     noise=model.stream("a"), sentences=("RMC", "GGA"))
+        ref = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.70723, longitude=11.695213333333333)
+        lines = sim.step().splitlines(True)
+        truth = ref.step()
+        self.assertNotEqual(truth, lines[0])
+        self.assertEquals(truth[:18], lines[0][:18])
+        self.assertTrue(lines[1].startswith("$GPGGA,073124.000,"))
+        # The true track is not disturbed by the noise
+        self.assertEquals((ref._latitude, ref._longitude), (sim._latitude, sim._longitude))
+
+    def testFixLoss(self):
+        model = nmea.noise.NoiseModel(dropout=1.0, outage=1000.0)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7,
+                                     noise=model.stream("a"), sentences=("RMC", "GGA"))
+        (rmc, gga) = sim.step().splitlines()
+        self.assertTrue(rmc.startswith("$GPRMC,073124.000,V,,,,,,,280511,,,N*"))
+        self.assertTrue(gga.startswith("$GPGGA,073124.000,,,,,0,00,"))
+
+    def testPlainGGA(self):
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.70723, longitude=11.695213333333333,
+                                     sentences=("GGA",))
+        self.assertEquals("$GPGGA,073124.000,5742.434,N,1141.713,E,1,08,1.00,0.0,M,0.0,M,,*61\r\n", sim.step())
+
+    def testScenario(self):
+        scenario = nmea.scenario.compile_scenario('''{"vessels": [
+            {"name": "a", "start": [57.7, 11.7], "legs": [[10, 0, 5.0]], "count": 2,
+             "noise": {"seed": 5, "sigma": 4.0}}]}''')
+        sims = dict(scenario.simulators(cache=nmea.fake.SentenceCache()))
+        self.assertEquals(None, sims["a-0"]._lap)
+        self.assertNotEqual(sims["a-0"].step(), sims["a-1"].step())
+        again = dict(scenario.simulators())
+        self.assertEquals(nmea.noise.NoiseModel(seed=5, sigma=4.0).stream("a-0").next(),
+                          again["a-0"]._noise.next())
+
+    def testCheckpoint(self):
+        model = nmea.noise.NoiseModel(seed=3, batch=16)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7,
+                                     noise=model.stream("a"), sentences=("RMC", "GGA"))
+        for n in range(20):
+            sim.step()
+        state = json.loads(json.dumps(sim.state()))
+        expected = [sim.step() for n in range(40)]
+        resumed = nmea.fake.GPSSimulator(currtime=0, noise=model.stream("a"), sentences=("RMC", "GGA"))
+        resumed.restore(state)
+        self.assertEquals(expected, [resumed.step() for n in range(40)])
+        # A checkpoint taken before any noise is drawn
+        fresh = nmea.fake.GPSSimulator(currtime=WHEN, noise=model.stream("b"))
+        state = json.loads(json.dumps(fresh.state()))
+        expected = [fresh.step() for n in range(20)]
+        resumed = nmea.fake.GPSSimulator(currtime=0, noise=model.stream("b"))
+        resumed.restore(state)
+        self.assertEquals(expected, [resumed.step() for n in range(20)])
+
+    def testParkedNoise(self):
+        def run(park):
+            plan = nmea.fake.ShipPlan(latitude=57.7, longitude=11.7)
+            plan.addLeg(length=10, course=90, speed=10.0)
+            plan.addLeg(length=100, course=90, speed=0.0)
+            plan.addLeg(length=10, course=270, speed=10.0)
+            sim = nmea.fake.GPSSimulator(currtime=WHEN, shipplan=plan,
+                                         noise=nmea.noise.NoiseModel(seed=9).stream("a"),
+                                         policy=nmea.fake.EmissionPolicy(keepalive=1000))
+            sent = []
+            while sim._time < WHEN + 130:
+                line = sim.step()
+                if line:
+                    sent.append(line)
+                if park:
+                    sim.idle()
+            return sent
+        self.assertEquals(run(False), run(True))
+
+    def testPlainWalk(self):
+        scenario = nmea.scenario.compile_scenario('''{"vessels": [
+            {"name": "a", "start": [57.7, 11.7], "legs": [[10, 0, 5.0]],
+             "noise": {"tau": null, "walk": 1}}]}''')
+        sims = dict(scenario.simulators())
+        self.assertEquals(None, sims["a"]._noise.model.tau)
+        self.assertEquals(1.0, sims["a"]._noise.model.walk)
+        self.assertTrue(sims["a"].step())
+
+    def testBadNoise(self):
+        self.assertRaises(nmea.scenario.ScenarioError, nmea.scenario.compile_scenario,
+                          '{"vessels": [{"start": [0, 0], "legs": [[10, 0, 1]], "noise": {"colour": 1}}]}')
+        self.assertRaises(nmea.scenario.ScenarioError, nmea.scenario.compile_scenario,
+                          '{"vessels": [{"start": [0, 0], "legs": [[10, 0, 1]], "noise": 3}]}')
+
+if __name__ == "__main__":
+    unittest.main()
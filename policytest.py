@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+#
+""" Test change-driven emission and parking of idle fake GPSes """
+
+import nmea.fake
+import unittest, time
+
+WHEN = 1330759883
+
+def moored_plan():
+    "Sail for 10 seconds, lie still for 100, sail back."
+    plan = nmea.fake.ShipPlan(latitude=57.7, longitude=11.7)
+    plan.addLeg(length=10, course=90, speed=10.0)
+    plan.addLeg(length=100, course=90, speed=0.0)
+    plan.addLeg(length=10, course=270, speed=10.0)
+    return plan
+
+class TestEmissionPolicy(unittest.TestCase):
+    def testMovingSends(self):
+        policy = nmea.fake.EmissionPolicy()
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7, course=90, speed=10.0, policy=policy)
+        self.assertTrue(all(sim.step() for n in range(20)))
+        self.assertEquals(20, policy.sent)
+
+    def testStillSuppressed(self):
+        policy = nmea.fake.EmissionPolicy(keepalive=10)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7, speed=0.0, policy=policy)
+        lines = [sim.step() for n in range(25)]
+        # The first fix, then one every keepalive seconds
+        self.assertEquals([0, 10, 20], [n for (n, line) in enumerate(lines) if line])
+        self.assertEquals(22, policy.suppressed)
+
+    def testSlowMover(self):
+        # Half a metre a second is sent every other second with a 1 m threshold
+        policy = nmea.fake.EmissionPolicy(distance=1.0)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7, course=0, speed=1.0, policy=policy)
+        self.assertEquals(5, len([line for line in [sim.step() for n in range(10)] if line]))
+
+    def testTurn(self):
+        policy = nmea.fake.EmissionPolicy()
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, latitude=57.7, longitude=11.7, speed=0.0, policy=policy)
+        sim.step()
+        self.assertEquals("", sim.step())
+        sim._heading = 45
+        self.assertTrue(sim.step())
+
+class TestIdle(unittest.TestCase):
+    def testSkipsStationaryLeg(self):
+        policy = nmea.fake.EmissionPolicy(keepalive=1000)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, shipplan=moored_plan(), policy=policy, period=0.5)
+        ref = nmea.fake.GPSSimulator(currtime=WHEN, shipplan=moored_plan())
+        sent = []
+        while sim._time < WHEN + 130:
+            line = sim.step()
+            if line:
+                sent.append(line)
+            sim.idle()
+        expected = []
+        last = None
+        while ref._time < WHEN + 130:
+            line = ref.step()
+            # Everything but the time stamp and checksum
+            if line[18:-5] != last:
+                expected.append(line)
+            last = line[18:-5]
+        self.assertEquals(expected, sent)
+
+    def testIdleTime(self):
+        policy = nmea.fake.EmissionPolicy(keepalive=30)
+        sim = nmea.fake.GPSSimulator(currtime=WHEN, shipplan=moored_plan(), policy=policy, period=0.5)
+        for n in range(11):
+            sim.step()
+        self.assertEquals(0.0, sim._speed)
+        # The keep-alive comes before the end of the leg
+        self.assertEquals(14.0, sim.idle())
+        self.assertEquals(WHEN + 39, sim._time)
+        self.assertTrue(sim.step())
+        self.assertEquals(WHEN + 40, sim._sent[4])
+        self.assertEquals(0, nmea.fake.GPSSimulator(currtime=WHEN, shipplan=moored_plan()).idle())
+
+class Device:
+    def __init__(self, name):
+        self.name = name
+
+class TestParking(unittest.TestCase):
+    def testRotation(self):
+        session = nmea.fake.TestSession()
+        devices = [Device(n) for n in range(4)]
+        for device in devices:
+            session.append(device)
+        self.assertEquals(devices[0], session.choose())
+        self.assertEquals(devices[1], session.choose())
+        session.park(devices[1], time.time() + 0.05)
+        self.assertEquals([devices[2], devices[3], devices[0], devices[2]],
+                          [session.choose() for n in range(4)])
+        self.assertEquals(4, len(session.runqueue))
+        session.wake()
+        self.assertEquals(3, len(session.rotation))
+        time.sleep(0.06)
+        session.wake()
+        self.assertEquals(devices[1], session.rotation[-1])
+
+    def testRemoveParked(self):
+        session = nmea.fake.TestSession()
+        devices = [Device(n) for n in range(3)]
+        for device in devices:
+            session.append(device)
+        session.park(devices[2], time.time() + 60)
+        session.remove(devices[2])
+        self.assertEquals([], session.parked)
+        self.assertEquals(devices[:2], session.runqueue)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.profiler profiling hooks """
+
+import nmea.profiler
+import nmea.fake
+import unittest, os, time, pstats, tempfile, StringIO
+
+def spin(seconds):
+    "Burn CPU for a while."
+    end = time.time() + seconds
+    total = 0
+    while time.time() < end:
+        total += sum(range(100))
+    return total
+
+class TestTimers(unittest.TestCase):
+    def testAdd(self):
+        timers = nmea.profiler.Timers()
+        timers.add("feed", 0.5)
+        timers.add("feed", 0.25)
+        timers.add("poll", 1.0)
+        self.assertEquals(0.75, timers.totals["feed"])
+        self.assertEquals(2, timers.counts["feed"])
+        self.assertEquals(1, timers.counts["poll"])
+
+    def testDump(self):
+        timers = nmea.profiler.Timers()
+        timers.add("feed", 0.5)
+        timers.add("poll", 1.0)
+        out = StringIO.StringIO()
+        timers.dump(out)
+        lines = out.getvalue().splitlines()
+        self.assertEquals(2, len(lines))
+        self.assertTrue(lines[0].startswith("gpsfake: time poll"))
+        self.assertTrue(lines[1].startswith("gpsfake: time feed"))
+
+    def testDeliver(self):
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, latitude=57.70723, longitude=11.695213333333333)
+        dut = nmea.fake.FakePTY(sim)
+        dut.timers = nmea.profiler.Timers()
+        for n in range(3):
+            dut.feed(False)
+        self.assertEquals(3, dut.timers.counts["feed"])
+        self.assertEquals(3, dut.timers.counts["write"])
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testUnused(self):
+        dut = nmea.profiler.Profiler(self.path)
+        dut.save()
+        self.assertEquals(0, os.path.getsize(self.path))
+
+    def testProfile(self):
+        dut = nmea.profiler.Profiler(self.path)
+        dut.toggle()
+        self.assertTrue(dut.running)
+        spin(0.05)
+        dut.toggle()
+        self.assertFalse(dut.running)
+        dut.save()
+        stats = pstats.Stats(self.path)
+        self.assertTrue([f for f in stats.stats if f[2] == "spin"])
+
+    def testSampling(self):
+        dut = nmea.profiler.Profiler(self.path, sampling=True)
+        dut.start()
+        spin(0.2)
+        dut.save()
+        self.assertFalse(dut.running)
+        self.assertTrue(dut.stacks)
+        lines = open(self.path).read().splitlines()
+        self.assertTrue([line for line in lines if ":spin:" in line])
+        out = StringIO.StringIO()
+        dut.report(out)
+        self.assertTrue(out.getvalue().startswith("gpsfake: profile"))
+
+if __name__ == "__main__":
+    unittest.main()
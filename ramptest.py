@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.ramp load ramp """
+
+import nmea.ramp
+import nmea.fake
+import unittest, time
+
+class TestRamp(unittest.TestCase):
+    def testRates(self):
+        ramp = nmea.ramp.Ramp(start=10.0, factor=2.0, ceiling=80.0)
+        self.assertEquals([10.0, 20.0, 40.0, 80.0], list(ramp.rates()))
+
+    def testKnee(self):
+        ramp = nmea.ramp.Ramp(start=100.0, factor=2.0, dwell=1.0)
+        rates = ramp.rates()
+        self.assertEquals(100.0, rates.next())
+        self.assertTrue(ramp.record(100.0, 100, 100, 1.0)["sustained"])
+        self.assertEquals(200.0, rates.next())
+        self.assertTrue(ramp.record(200.0, 200, 196, 1.0)["sustained"])
+        self.assertEquals(400.0, rates.next())
+        level = ramp.record(400.0, 400, 250, 1.0)
+        self.assertFalse(level["sustained"])
+        self.assertEquals(150, level["lost"])
+        self.assertEquals([], list(rates))
+        report = ramp.report()
+        self.assertEquals(196.0, report["sustained"])
+        self.assertEquals(400.0, report["knee"])
+        self.assertEquals(3, len(report["levels"]))
+
+    def testFeederBehind(self):
+        # Devices that cannot write at the offered rate are a knee too
+        ramp = nmea.ramp.Ramp(start=1000.0)
+        self.assertFalse(ramp.record(1000.0, 500, 500, 1.0)["sustained"])
+        self.assertEquals(0.0, ramp.sustained())
+
+    def testLatencyLimit(self):
+        ramp = nmea.ramp.Ramp(limit=0.1)
+        self.assertTrue(ramp.record(50.0, 50, 50, 1.0, {"p50": 0.01, "p99": 0.05})["sustained"])
+        self.assertFalse(ramp.record(75.0, 75, 75, 1.0, {"p50": 0.05, "p99": 0.2})["sustained"])
+
+class TestUnpaced(unittest.TestCase):
+    def testLogStep(self):
+        load = nmea.fake.TestLoad("fake.log")
+        dut = nmea.fake.FakeLogGPS(load)
+        start = time.time()
+        lines = [dut.step() for n in range(100)]
+        self.assertTrue(time.time() - start < 100 * nmea.fake.WRITE_PAD)
+        count = len(load.sentences)
+        self.assertEquals([load.sentences[n % count] for n in range(100)], lines)
+        self.assertEquals(100, dut.index)
+
+    def testSimulatorFeed(self):
+        sim = nmea.fake.GPSSimulator(currtime=1330759883, latitude=57.70723, longitude=11.695213333333333)
+        ref = nmea.fake.GPSSimulator(currtime=1330759883, latitude=57.70723, longitude=11.695213333333333)
+        dut = nmea.fake.FakePTY(sim)
+        start = time.time()
+        line = dut.feed(False)
+        self.assertTrue(time.time() - start < sim.period)
+        self.assertEquals(ref.step(), line)
+
+if __name__ == "__main__":
+    unittest.main()
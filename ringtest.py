@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.ring shared-memory sentence ring """
+
+import nmea.ring
+import unittest, tempfile, os
+
+rmc = "$GPRMC,073124.000,A,5742.434,N,1141.713,E,1.00,0.00,280511,,,S*46\r\n"
+
+class TestRing(unittest.TestCase):
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix=".ring")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testReadBack(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=4096)
+        reader = nmea.ring.RingReader(self.path)
+        self.assertEquals(0, writer.device("/dev/pts/1"))
+        self.assertEquals(1, writer.device("/dev/pts/2"))
+        writer.write(rmc, 0)
+        writer.write("$GPTXT,hello*00\r\n", 1)
+        records = reader.records()
+        self.assertEquals([(0, rmc), (1, "$GPTXT,hello*00\r\n")],
+                          [(device, str(data)) for (device, data) in records])
+        self.assertEquals(["/dev/pts/1", "/dev/pts/2"], reader.names())
+        self.assertEquals([], reader.records())
+        writer.close()
+        reader.close()
+
+    def testLatestAndOldest(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=4096)
+        writer.write(rmc)
+        self.assertEquals([], nmea.ring.RingReader(self.path).records())
+        self.assertEquals(1, len(nmea.ring.RingReader(self.path, oldest=True).records()))
+        writer.close()
+
+    def testWrap(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=512)
+        reader = nmea.ring.RingReader(self.path)
+        got = []
+        for n in range(100):
+            line = "$GPTXT,%d*00\r\n" % n
+            writer.write(line)
+            if n % 3 == 2:
+                got.extend(str(data) for (device, data) in reader.records())
+        got.extend(str(data) for (device, data) in reader.records())
+        self.assertEquals(["$GPTXT,%d*00\r\n" % n for n in range(100)], got)
+        self.assertEquals(0, reader.lost)
+        writer.close()
+
+    def testOverrun(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=512)
+        reader = nmea.ring.RingReader(self.path)
+        for n in range(100):
+            writer.write(rmc)
+        self.assertEquals([], reader.records())
+        self.assertTrue(reader.lost > 512)
+        # The reader picks up again at the head
+        writer.write(rmc)
+        self.assertEquals([rmc], [str(data) for (device, data) in reader.records()])
+        writer.close()
+
+    def testOtherProcess(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=1 << 17)
+        reader = nmea.ring.RingReader(self.path)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for n in range(1000):
+                    writer.write(rmc)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEquals(1000, len(reader.records()))
+        writer.close()
+
+    def testTooLong(self):
+        writer = nmea.ring.RingWriter(self.path, capacity=64)
+        self.assertRaises(nmea.ring.RingError, writer.write, rmc)
+        writer.close()
+
+if __name__ == "__main__":
+    unittest.main()
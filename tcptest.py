@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.fake TCP fan-out sink """
+
+import nmea.fake
+import unittest, socket, time
+
+class TestFakeTCP(unittest.TestCase):
+    def setUp(self):
+        self.load = nmea.fake.TestLoad("fake.log")
+        self.dut = nmea.fake.FakeTCP(nmea.fake.FakeLogGPS(self.load))
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.dut.close()
+
+    def connect(self):
+        client = socket.create_connection((self.dut.ipaddr, self.dut.port))
+        self.clients.append(client)
+        # Let the listener see the connection before the next write
+        time.sleep(0.05)
+        return client
+
+    def receive(self, client, size):
+        data = ""
+        client.settimeout(2.0)
+        while len(data) < size:
+            data += client.recv(size - len(data))
+        return data
+
+    def testFanOut(self):
+        self.assertEquals("tcp://127.0.0.1:%d" % self.dut.port, self.dut.byname)
+        a = self.connect()
+        b = self.connect()
+        lines = [self.dut.feed(False) for n in range(5)]
+        self.assertEquals(2, len(self.dut.subscribers))
+        expected = "".join(lines)
+        self.assertEquals(expected, self.receive(a, len(expected)))
+        self.assertEquals(expected, self.receive(b, len(expected)))
+
+    def testSlowSubscriberDropped(self):
+        self.dut.limit = 4096
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        slow.connect((self.dut.ipaddr, self.dut.port))
+        self.clients.append(slow)
+        fast = self.connect()
+        fast.settimeout(2.0)
+        self.dut.accept()
+        # Keep the kernel from buffering a whole test run for the slow one
+        self.dut.subscribers[0].sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        sent = 0
+        for n in range(20000):
+            sent += len(self.dut.feed(False))
+            fast.recv(65536)
+            if len(self.dut.subscribers) == 1:
+                break
+        self.assertEquals(1, len(self.dut.subscribers))
+        self.assertEquals(1, self.dut.dropped)
+        # The feeder was never held up, and the fast reader kept everything
+        self.assertEquals(0, self.dut.subscribers[0].backlog)
+
+    def testRead(self):
+        client = self.connect()
+        client.sendall('?WATCH={"enable":true}\n')
+        time.sleep(0.05)
+        self.dut.read()
+        self.assertEquals(1, len(self.dut.subscribers))
+        client.close()
+        time.sleep(0.05)
+        self.dut.read()
+        self.assertEquals([], self.dut.subscribers)
+
+class Socket:
+    "Takes at most limit bytes per send, and remembers what it got."
+    def __init__(self, limit):
+        self.limit = limit
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(str(data[:self.limit]))
+        return len(self.sent[-1])
+
+class TestSubscriber(unittest.TestCase):
+    def testSharedStrings(self):
+        subscriber = nmea.fake.TCPSubscriber(Socket(15000), None)
+        big = ["a" * 10000, "b" * 10000]
+        small = ["c" * 70] * 100
+        for data in big + small:
+            subscriber.queue.append(data)
+            subscriber.backlog += len(data)
+        subscriber.send()
+        # The large strings went out from the shared copies
+        self.assertEquals(["a" * 10000, "b" * 10000], subscriber.sock.sent[:2])
+        self.assertTrue(max(len(d) for d in subscriber.sock.sent[2:]) <= nmea.fake.TCP_COALESCE)
+        self.assertEquals("".join(big + small), "".join(subscriber.sock.sent))
+        self.assertEquals(0, subscriber.backlog)
+
+if __name__ == "__main__":
+    unittest.main()
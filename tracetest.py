@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.tracer trace buffer """
+
+import nmea.tracer
+import unittest
+import os, shutil, tempfile, StringIO
+
+class TestTraceBuffer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testDevices(self):
+        trace = nmea.tracer.TraceBuffer(4)
+        self.assertEquals(0, trace.device("/dev/pts/1"))
+        self.assertEquals(1, trace.device("client1"))
+        self.assertEquals(0, trace.device("/dev/pts/1"))
+
+    def testRoundTrip(self):
+        trace = nmea.tracer.TraceBuffer(8)
+        gps = trace.device("/dev/pts/1")
+        trace.record(nmea.tracer.EVENT_ADD, gps)
+        trace.record(nmea.tracer.EVENT_FEED, gps, 70)
+        trace.save(self.path)
+        (names, dropped, records) = nmea.tracer.load(self.path)
+        self.assertEquals(["/dev/pts/1"], names)
+        self.assertEquals(0, dropped)
+        self.assertEquals(list(trace.records()), records)
+        self.assertEquals([(0, 3, 0), (0, 1, 70)], [r[1:] for r in records])
+
+    def testWraparound(self):
+        trace = nmea.tracer.TraceBuffer(4)
+        for n in range(10):
+            trace.record(nmea.tracer.EVENT_FEED, 0, n)
+        self.assertEquals([6, 7, 8, 9], [r[3] for r in trace.records()])
+        trace.save(self.path)
+        (names, dropped, records) = nmea.tracer.load(self.path)
+        self.assertEquals(6, dropped)
+        self.assertEquals([6, 7, 8, 9], [r[3] for r in records])
+        times = [r[0] for r in records]
+        self.assertEquals(sorted(times), times)
+
+    def testTimeline(self):
+        trace = nmea.tracer.TraceBuffer(16)
+        a = trace.device("a")
+        b = trace.device("b")
+        for device in (a, b, a):
+            trace.record(nmea.tracer.EVENT_FEED, device, 10)
+        out = StringIO.StringIO()
+        nmea.tracer.timeline(trace.names, list(trace.records()), out, step=60)
+        lines = out.getvalue().splitlines()
+        self.assertEquals(["0.0", "2", "1"], lines[1].split())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.traffic vessel index """
+
+import nmea.traffic
+import nmea.misc
+import nmea.fake
+import unittest, random, itertools
+
+class Vessel:
+    def __init__(self, latitude, longitude, heading=0.0, speed=0.0):
+        self._latitude = latitude
+        self._longitude = longitude
+        self._heading = heading
+        self._speed = speed
+
+class TestVesselIndex(unittest.TestCase):
+    def testPairsMatchBruteForce(self):
+        rand = random.Random(7)
+        vessels = [Vessel(57.0 + rand.random() * 0.2, 11.0 + rand.random() * 0.4) for n in range(400)]
+        for cell in (250.0, 1000.0):
+            dut = nmea.traffic.VesselIndex(cell=cell)
+            for (n, v) in enumerate(vessels):
+                dut.add(n, v)
+            got = set((a, b) for (a, b, d) in dut.pairs(800.0))
+            expected = set()
+            for (a, b) in itertools.combinations(range(len(vessels)), 2):
+                if nmea.misc.HaversineDistance((vessels[a]._latitude, vessels[a]._longitude),
+                                               (vessels[b]._latitude, vessels[b]._longitude)) <= 800.0:
+                    expected.add((a, b))
+            self.assertTrue(expected)
+            self.assertEquals(expected, got)
+
+    def testDateLine(self):
+        dut = nmea.traffic.VesselIndex()
+        dut.add("east", Vessel(10.0, 179.999))
+        dut.add("west", Vessel(10.0, -179.999))
+        pairs = dut.pairs(500.0)
+        self.assertEquals(1, len(pairs))
+        self.assertAlmostEqual(219.0, pairs[0][2], 0)
+
+    def testNear(self):
+        dut = nmea.traffic.VesselIndex()
+        dut.add("a", Vessel(57.0, 11.0))
+        dut.add("b", Vessel(57.01, 11.0))
+        dut.add("c", Vessel(57.1, 11.0))
+        self.assertEquals(["a", "b"], [name for (name, d) in dut.near(57.0, 11.0, 2000.0)])
+
+    def testNearMatchesBruteForce(self):
+        rand = random.Random(3)
+        vessels = [Vessel(57.0 + rand.random() * 0.5, 11.0 + rand.random() * 1.0) for n in range(300)]
+        dut = nmea.traffic.VesselIndex(cell=100.0)
+        for (n, v) in enumerate(vessels):
+            dut.add(n, v)
+        for distance in (50.0, 300.0, 20000.0):
+            expected = set(n for (n, v) in enumerate(vessels)
+                           if nmea.misc.HaversineDistance((57.2, 11.5), (v._latitude, v._longitude)) <= distance)
+            self.assertEquals(expected, set(name for (name, d) in dut.near(57.2, 11.5, distance)))
+
+    def testRemove(self):
+        dut = nmea.traffic.VesselIndex()
+        dut.add("a", Vessel(57.0, 11.0))
+        dut.add("b", Vessel(57.001, 11.0))
+        dut.add("c", Vessel(57.002, 11.0))
+        dut.update()
+        dut.remove("a")
+        dut.add("d", Vessel(57.1, 11.0))
+        dut.remove("d")
+        self.assertEquals(2, len(dut))
+        self.assertEquals([set(["b", "c"])], [set([a, b]) for (a, b, d) in dut.pairs(500.0)])
+
+    def testUpdate(self):
+        sim = nmea.fake.GPSSimulator(currtime=0, latitude=57.0, longitude=11.0, course=90, speed=20.0)
+        dut = nmea.traffic.VesselIndex(cell=100.0)
+        dut.add("sim", sim)
+        dut.add("buoy", Vessel(57.0, 11.01))
+        self.assertEquals([], dut.pairs(200.0))
+        for n in range(60):
+            sim.nextPos()
+        dut.update()
+        self.assertEquals(1, dut.moved)
+        self.assertEquals([("sim", "buoy")], [(a, b) for (a, b, d) in dut.pairs(200.0)])
+
+    def testTick(self):
+        sim = nmea.fake.GPSSimulator(currtime=0, latitude=57.0, longitude=11.0, course=90, speed=20.0)
+        dut = nmea.traffic.VesselIndex(cell=100.0, interval=1.0)
+        dut.add("sim", sim)
+        dut.add("buoy", Vessel(57.0, 11.01))
+        dut.tick(100.0)
+        for n in range(60):
+            sim.nextPos()
+        dut.tick(100.5)
+        self.assertEquals([], dut.pairs(200.0))
+        dut.tick(101.0)
+        self.assertEquals([("sim", "buoy")], [(a, b) for (a, b, d) in dut.pairs(200.0)])
+
+    def testCPA(self):
+        dut = nmea.traffic.VesselIndex()
+        # Head on, about 1852 m apart closing at 20 knots
+        dut.add("north", Vessel(57.0 + 1.0 / 60, 11.0, 180.0, 10.0))
+        dut.add("south", Vessel(57.0, 11.0, 0.0, 10.0))
+        # Well clear, going the same way
+        dut.add("far", Vessel(57.0, 11.5, 0.0, 10.0))
+        self.assertEquals([], dut.cpa(100.0, 60.0))
+        hits = dut.cpa(100.0, 600.0)
+        self.assertEquals(1, len(hits))
+        (a, b, dcpa, tcpa) = hits[0]
+        self.assertEquals(set(["north", "south"]), set([a, b]))
+        self.assertTrue(dcpa < 1.0)
+        self.assertAlmostEqual(1853.2 / (20 * nmea.misc.KNOTS_TO_MPS), tcpa, 0)
+
+    def testCPAOpening(self):
+        dut = nmea.traffic.VesselIndex()
+        dut.add("a", Vessel(57.0, 11.0, 180.0, 10.0))
+        dut.add("b", Vessel(57.001, 11.0, 0.0, 10.0))
+        # Already closest now
+        (a, b, dcpa, tcpa) = dut.cpa(200.0, 600.0)[0]
+        self.assertEquals(0.0, tcpa)
+        self.assertAlmostEqual(111.2, dcpa, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+#
+""" Test the nmea.fake UDP sink """
+
+import nmea.fake
+import nmea.latency
+import unittest, socket, time
+
+class TestFakeUDP(unittest.TestCase):
+    def setUp(self):
+        self.load = nmea.fake.TestLoad("fake.log")
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.settimeout(2.0)
+        self.port = str(self.listener.getsockname()[1])
+
+    def tearDown(self):
+        self.listener.close()
+
+    def testUnpacked(self):
+        dut = nmea.fake.FakeUDP(self.load, "127.0.0.1", self.port)
+        line = dut.feed(False)
+        self.assertEquals(line, self.listener.recv(65536))
+
+    def testPacked(self):
+        dut = nmea.fake.FakeUDP(self.load, "127.0.0.1", self.port, pack=4)
+        lines = [dut.feed(False) for n in range(6)]
+        self.assertEquals("".join(lines[:4]), self.listener.recv(65536))
+        dut.drain()
+        self.assertEquals("".join(lines[4:]), self.listener.recv(65536))
+
+    def testPackWait(self):
+        harness = nmea.latency.LatencyHarness()
+        dut = nmea.fake.FakeUDP(self.load, "127.0.0.1", self.port, pack=10)
+        dut.latency = harness
+        line = dut.feed(False)
+        dut.read()
+        self.assertEquals({}, harness.pending)
+        time.sleep(nmea.fake.PACK_WAIT)
+        dut.read()
+        self.assertEquals(line, self.listener.recv(65536))
+        # Reported as sent when the datagram went, not when queued
+        self.assertEquals(1, len(harness.pending))
+
+    def testDatagramLimit(self):
+        dut = nmea.fake.FakeUDP(self.load, "127.0.0.1", self.port, pack=1000)
+        lines = [dut.feed(False) for n in range(40)]
+        dut.drain()
+        received = []
+        while sum(len(d) for d in received) < len("".join(lines)):
+            received.append(self.listener.recv(65536))
+        self.assertTrue(len(received) > 1)
+        self.assertTrue(max(len(d) for d in received) <= nmea.fake.MAX_DATAGRAM)
+        self.assertEquals("".join(lines), "".join(received))
+
+    def testOptions(self):
+        dut = nmea.fake.FakeUDP(self.load, "239.192.0.1", "5000",
+                                ttl=2, broadcast=True, sndbuf=65536)
+        self.assertEquals(2, dut.sock.getsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL))
+        self.assertEquals(1, dut.sock.getsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST))
+        self.assertEquals("udp://239.192.0.1:5000", dut.byname)
+
+class TestUDPSink(unittest.TestCase):
+    def testMulticast(self):
+        self.assertTrue(nmea.fake.multicast("239.192.0.1"))
+        self.assertTrue(nmea.fake.multicast("224.0.0.1"))
+        self.assertFalse(nmea.fake.multicast("127.0.0.1"))
+        self.assertFalse(nmea.fake.multicast("localhost"))
+
+    def testParse(self):
+        self.assertEquals({"ipaddr": "239.192.0.1", "port": 6000, "pack": 8,
+                           "broadcast": True, "stride": 1},
+                          nmea.fake.udp_sink("239.192.0.1:6000,pack=8,broadcast,stride=1"))
+        self.assertEquals({"sndbuf": 262144}, nmea.fake.udp_sink(",sndbuf=262144"))
+        self.assertRaises(nmea.fake.TestSessionError, nmea.fake.udp_sink, "127.0.0.1,speed=9")
+        self.assertRaises(nmea.fake.TestSessionError, nmea.fake.udp_sink, "127.0.0.1:x")
+
+if __name__ == "__main__":
+    unittest.main()